@@ -3,6 +3,7 @@ Configuration module for the application.
 All configuration values should be centralized here.
 """
 import os
+import json
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 
@@ -13,6 +14,10 @@ class DatabaseConfig:
     """Database related configuration"""
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
     CONNECT_ARGS = {"check_same_thread": False}
+    # Read replicas (comma-separated URLs) for read-only endpoints
+    REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    # How long a user's reads stay on the primary after they write
+    REPLICA_STICKY_SECONDS = float(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "5"))
 
 class SecurityConfig:
     """Security and authentication related configuration"""
@@ -29,6 +34,8 @@ class CORSConfig:
     ALLOW_CREDENTIALS = True
     ALLOW_METHODS = ["*"]
     ALLOW_HEADERS = ["*"]
+    EXPOSE_HEADERS = ["ETag", "X-Next-Cursor", "Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining",
+                      "X-Reused-From"]
 
 class AIModelsConfig:
     """Configuration for AI models and code generation"""
@@ -49,6 +56,15 @@ class AIModelsConfig:
     GOOGLE_API_TIMEOUT = int(os.getenv("GOOGLE_API_TIMEOUT", "30"))
     GOOGLE_API_RATE_LIMIT_MAX_RETRIES = int(os.getenv("GOOGLE_API_RATE_LIMIT_MAX_RETRIES", "10"))
     GOOGLE_API_RATE_LIMIT_DELAY = int(os.getenv("GOOGLE_API_RATE_LIMIT_DELAY", "10"))
+    # Pings on each key's idle gRPC connection so it stays open between requests
+    GOOGLE_API_KEEPALIVE_SECONDS = float(os.getenv("GOOGLE_API_KEEPALIVE_SECONDS", "30"))
+    OPENAI_API_TIMEOUT = float(os.getenv("OPENAI_API_TIMEOUT", "60"))
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # Point at a stub for testing
+    OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+    OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    OPENAI_KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "60"))
+    OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true"  # Used only if the h2 package is installed
     
     # Model lists
     OPENAI_MODELS = ["gpt-3.5-turbo", "gpt-4o", "gpt-4-turbo", "claude-3-opus", "claude-3-sonnet"]
@@ -95,6 +111,18 @@ class PaymentConfig:
     PAYOS_CLIENT_ID = os.getenv("PAYOS_CLIENT_ID")
     PAYOS_API_KEY = os.getenv("PAYOS_API_KEY")
     PAYOS_CHECKSUM_KEY = os.getenv("PAYOS_CHECKSUM_KEY")
+    PAYOS_BASE_URL = os.getenv("PAYOS_BASE_URL", "https://api-merchant.payos.vn")  # Point at a stub for testing
+    PAYOS_TIMEOUT = float(os.getenv("PAYOS_TIMEOUT", "10"))                  # Deadline per call, retries included
+    PAYOS_CONNECT_TIMEOUT = float(os.getenv("PAYOS_CONNECT_TIMEOUT", "3"))
+    PAYOS_MAX_RETRIES = int(os.getenv("PAYOS_MAX_RETRIES", "2"))             # Reads only
+    PAYOS_RETRY_BASE_DELAY = float(os.getenv("PAYOS_RETRY_BASE_DELAY", "0.2"))
+    PAYOS_MAX_CONNECTIONS = int(os.getenv("PAYOS_MAX_CONNECTIONS", "20"))
+    PAYOS_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("PAYOS_MAX_KEEPALIVE_CONNECTIONS", "10"))
+    PAYOS_KEEPALIVE_SECONDS = float(os.getenv("PAYOS_KEEPALIVE_SECONDS", "30"))
+    
+    # Order codes: worker id (0-31) embedded in each code; leased from the database when unset
+    ORDER_CODE_WORKER_ID = int(os.getenv("ORDER_CODE_WORKER_ID")) if os.getenv("ORDER_CODE_WORKER_ID") else None
+    ORDER_CODE_LEASE_SECONDS = float(os.getenv("ORDER_CODE_LEASE_SECONDS", "300"))
     
     # Credit pricing
     CREDIT_PRICE = int(os.getenv("CREDIT_PRICE", "1000"))  # 1 credit = 1000 VND by default
@@ -104,6 +132,43 @@ class PaymentConfig:
     FRONTEND_BASE_URL = os.getenv("FRONTEND_BASE_URL", "https://codawaka.vercel.app")
     PAYMENT_CANCEL_URL = f"{FRONTEND_BASE_URL}/payment-result?status=cancel"
     PAYMENT_SUCCESS_URL = f"{FRONTEND_BASE_URL}/payment-result?status=success"
+    
+    # QR rendering when PayOS returns no QR code
+    QR_IMAGE_FORMAT = os.getenv("QR_IMAGE_FORMAT", "png")  # png or svg
+    QR_BOX_SIZE = int(os.getenv("QR_BOX_SIZE", "10"))      # Pixels per module; lower gives a smaller PNG
+    QR_WORKERS = int(os.getenv("QR_WORKERS", "2"))         # Render processes; 0 renders in the request thread
+    QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "1024"))
+    QR_RENDER_TIMEOUT = float(os.getenv("QR_RENDER_TIMEOUT", "10"))
+    # Payment creation returns without the QR code if it isn't ready this soon after the
+    # transaction is stored; clients then fetch it from /payment/qr/{transaction_id}
+    QR_PAYMENT_WAIT_SECONDS = float(os.getenv("QR_PAYMENT_WAIT_SECONDS", "1"))
+    
+    # Payment status: served from the DB (updated by webhooks); PayOS is only
+    # asked when a pending status hasn't been checked for STATUS_STALE_SECONDS
+    STATUS_STALE_SECONDS = float(os.getenv("PAYMENT_STATUS_STALE_SECONDS", "30"))
+    PAYOS_VERIFY_RATE = float(os.getenv("PAYOS_VERIFY_RATE", "5"))     # Upstream checks per second per process
+    PAYOS_VERIFY_BURST = float(os.getenv("PAYOS_VERIFY_BURST", "10"))
+    # Status event streams re-check the DB this often and give up after STATUS_STREAM_TIMEOUT
+    STATUS_STREAM_CHECK_SECONDS = float(os.getenv("PAYMENT_STATUS_STREAM_CHECK_SECONDS", "15"))
+    STATUS_STREAM_TIMEOUT = float(os.getenv("PAYMENT_STATUS_STREAM_TIMEOUT", "600"))
+    
+    # Webhook inbox: events are stored on receipt and applied by a background worker
+    WEBHOOK_BATCH_SIZE = int(os.getenv("PAYMENT_WEBHOOK_BATCH_SIZE", "100"))
+    WEBHOOK_POLL_SECONDS = float(os.getenv("PAYMENT_WEBHOOK_POLL_SECONDS", "1"))
+    # Events that fail to apply are retried after BASE * 2^(attempt - 1) seconds, and
+    # marked failed after MAX_ATTEMPTS
+    WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("PAYMENT_WEBHOOK_RETRY_BASE_SECONDS", "5"))
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv("PAYMENT_WEBHOOK_MAX_ATTEMPTS", "8"))
+    
+    # Reconciliation: pending payments older than RECONCILE_AFTER_SECONDS are checked
+    # with PayOS every RECONCILE_INTERVAL_SECONDS; those older than EXPIRE_AFTER_SECONDS
+    # are cancelled. 0 disables the sweeper.
+    RECONCILE_INTERVAL_SECONDS = float(os.getenv("PAYMENT_RECONCILE_INTERVAL_SECONDS", "300"))
+    RECONCILE_AFTER_SECONDS = float(os.getenv("PAYMENT_RECONCILE_AFTER_SECONDS", "600"))
+    EXPIRE_AFTER_SECONDS = float(os.getenv("PAYMENT_EXPIRE_AFTER_SECONDS", "86400"))
+    RECONCILE_BATCH_SIZE = int(os.getenv("PAYMENT_RECONCILE_BATCH_SIZE", "200"))
+    RECONCILE_CONCURRENCY = int(os.getenv("PAYMENT_RECONCILE_CONCURRENCY", "8"))
+    RECONCILE_RATE = float(os.getenv("PAYMENT_RECONCILE_RATE", "10"))  # PayOS calls per second per sweep
 
 class EmailConfig:
     """Email (SMTP) configuration"""
@@ -112,6 +177,139 @@ class EmailConfig:
     SMTP_USER = os.getenv("EMAIL_SMTP_USER")
     SMTP_PASSWORD = os.getenv("EMAIL_SMTP_PASSWORD")
     FROM_ADDRESS = os.getenv("EMAIL_FROM_ADDRESS")
+    SMTP_STARTTLS = os.getenv("EMAIL_SMTP_STARTTLS", "true").lower() == "true"
+    # Outbox worker: mails per batch over one reused SMTP connection
+    OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+    OUTBOX_POLL_SECONDS = float(os.getenv("EMAIL_OUTBOX_POLL_SECONDS", "2"))
+    # Retry with exponential backoff: BASE * 2^(attempt - 1) seconds, up to MAX_ATTEMPTS
+    OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("EMAIL_OUTBOX_RETRY_BASE_SECONDS", "30"))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "6"))
+    # How long a claimed batch is reserved for its worker before others may retry it
+    OUTBOX_LEASE_SECONDS = int(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "300"))
+    # Idle time after which the SMTP connection is checked with NOOP before reuse
+    SMTP_IDLE_CHECK_SECONDS = float(os.getenv("EMAIL_SMTP_IDLE_CHECK_SECONDS", "30"))
+
+class ExportConfig:
+    """Admin data export configuration"""
+    # Number of rows fetched per round-trip from the server-side cursor
+    BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+class ArchiveConfig:
+    """Code history archival configuration"""
+    DIRECTORY = os.getenv("ARCHIVE_DIR", "./data/archive")
+    # Generations older than this are moved out of the hot table
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+    # Records per compressed block; one sparse index entry is kept per block
+    BLOCK_SIZE = int(os.getenv("ARCHIVE_BLOCK_SIZE", "256"))
+    # Maximum records written to a single segment file
+    SEGMENT_MAX_ROWS = int(os.getenv("ARCHIVE_SEGMENT_MAX_ROWS", "100000"))
+
+class PromptReuseConfig:
+    """Configuration for reusing prior generations of near-duplicate prompts"""
+    ENABLED = os.getenv("PROMPT_REUSE_ENABLED", "false").lower() == "true"
+    # Minimum estimated Jaccard similarity of prompt shingles for a reuse
+    THRESHOLD = float(os.getenv("PROMPT_REUSE_THRESHOLD", "0.9"))
+    # Fraction of the model's credit cost charged for a reused result
+    CREDIT_RATIO = float(os.getenv("PROMPT_REUSE_CREDIT_RATIO", "0.5"))
+    # Users are only given their own earlier results unless this is on
+    SHARE_ACROSS_USERS = os.getenv("PROMPT_REUSE_SHARE_ACROSS_USERS", "false").lower() == "true"
+    # MinHash/LSH parameters; 8 bands of 8 rows puts the LSH threshold near 0.77
+    NUM_PERM = int(os.getenv("PROMPT_REUSE_NUM_PERM", "64"))
+    BANDS = int(os.getenv("PROMPT_REUSE_BANDS", "8"))
+    SHINGLE_SIZE = int(os.getenv("PROMPT_REUSE_SHINGLE_SIZE", "3"))
+
+class HistoryConfig:
+    """Code generation history write configuration"""
+    # Queue history rows in memory and insert them in batches instead of per request
+    WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "false").lower() == "true"
+    BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+    FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "200"))
+    QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+    SPILL_DIR = os.getenv("HISTORY_SPILL_DIR", "./data/history-spill")
+
+class PartitionConfig:
+    """Monthly partitioning of history tables (Postgres only)"""
+    ENABLED = os.getenv("DB_PARTITIONING", "false").lower() == "true"
+    # Partitions created ahead of the current month
+    MONTHS_AHEAD = int(os.getenv("DB_PARTITION_MONTHS_AHEAD", "3"))
+    # Months of partitions kept attached; 0 keeps everything
+    RETENTION_MONTHS = int(os.getenv("DB_PARTITION_RETENTION_MONTHS", "0"))
+    # "detach" keeps expired partitions as standalone tables for backup, "drop" deletes them
+    RETENTION_ACTION = os.getenv("DB_PARTITION_RETENTION_ACTION", "detach")
+    MAINTENANCE_INTERVAL_HOURS = float(os.getenv("DB_PARTITION_MAINTENANCE_INTERVAL_HOURS", "24"))
+
+class QueryStatsConfig:
+    """Database query instrumentation"""
+    # Statements slower than this are logged with their parameters redacted
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+    # Report per-request query count and DB time in X-DB-Query-Count / X-DB-Time-Ms
+    RESPONSE_HEADERS = os.getenv(
+        "QUERY_STATS_HEADERS", "true" if os.getenv("ENV", "development") == "development" else "false"
+    ).lower() == "true"
+
+class RateLimitConfig:
+    """Request rate limits for the generation endpoints"""
+    ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    # memory: per worker process; database: shared by all workers through the rate_limit_buckets table
+    BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    # Take the client IP from X-Forwarded-For; only enable behind a proxy that sets it
+    TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+    # Proxies in front of the app that append to X-Forwarded-For; the client IP is the
+    # entry this many from the right, since entries further left can be forged
+    TRUSTED_PROXY_HOPS = int(os.getenv("RATE_LIMIT_TRUSTED_PROXY_HOPS", "1"))
+    # Users' tiers are looked up and cached this long, so a purchase lifts the limits
+    # without a new token; 0 uses the tier in the token, which is set at login
+    TIER_CACHE_SECONDS = float(os.getenv("RATE_LIMIT_TIER_CACHE_SECONDS", "60"))
+    # Route -> tier -> rule. Tiers: admin, paid and free for users; requests
+    # without a token are limited per IP as "anonymous". Tiers without a rule aren't limited.
+    # Algorithms: sliding_window (limit per period) or token_bucket (burst of limit,
+    # refilled at limit/period per second). Override with RATE_LIMIT_RULES as JSON.
+    RULES: Dict[str, Dict[str, Any]] = json.loads(os.getenv("RATE_LIMIT_RULES", "null")) or {
+        "/code/generate-code": {
+            "free": {"algorithm": "sliding_window", "limit": 10, "period": 60},
+            "paid": {"algorithm": "token_bucket", "limit": 30, "period": 60},
+            "anonymous": {"algorithm": "sliding_window", "limit": 10, "period": 60},
+        },
+        "/code/completion": {
+            "anonymous": {"algorithm": "sliding_window", "limit": 10, "period": 60},
+        },
+    }
+
+class GenerationSchedulerConfig:
+    """Scheduling of code generation requests onto the AI providers"""
+    # Generations sent to the providers at once; raise it as far as the API keys' quotas allow
+    CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "1"))
+    # Share of provider capacity per user tier when requests are waiting
+    TIER_WEIGHTS: Dict[str, float] = json.loads(os.getenv("GENERATION_TIER_WEIGHTS", "null")) or {
+        "admin": 8, "paid": 4, "free": 1,
+    }
+    PER_USER_CONCURRENCY = int(os.getenv("GENERATION_PER_USER_CONCURRENCY", "1"))
+    # Waiting longer than this fails the request with 503
+    MAX_QUEUE_WAIT_SECONDS = float(os.getenv("GENERATION_MAX_QUEUE_WAIT_SECONDS", "60"))
+    # Admission control: new requests are rejected with 503 when their estimated queue
+    # wait exceeds the budget or this many requests are already waiting. Each waiting
+    # request blocks a thread, but from the scheduler's own pool (CONCURRENCY +
+    # MAX_QUEUE_DEPTH + THREAD_HEADROOM threads), not the threadpool other endpoints
+    # share, so the depth isn't bounded by that threadpool's 40 threads
+    WAIT_BUDGET_SECONDS = float(os.getenv("GENERATION_WAIT_BUDGET_SECONDS", "30"))
+    MAX_QUEUE_DEPTH = int(os.getenv("GENERATION_MAX_QUEUE_DEPTH", "100"))
+    # Threads for requests on their way in or out of the queue
+    THREAD_HEADROOM = int(os.getenv("GENERATION_THREAD_HEADROOM", "20"))
+    WAIT_SAMPLES = int(os.getenv("GENERATION_WAIT_SAMPLES", "1000"))  # Recent waits kept per tier for metrics
+
+class RequestDeadlineConfig:
+    """End-to-end deadlines for requests that call the AI providers"""
+    # Clients may ask for a shorter (or longer, up to MAX_SECONDS) deadline in seconds
+    HEADER = "X-Request-Timeout"
+    DEFAULT_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+    MAX_SECONDS = float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", "120"))
+    # How often a running generation checks whether its client is still connected
+    DISCONNECT_POLL_SECONDS = float(os.getenv("REQUEST_DISCONNECT_POLL_SECONDS", "0.5"))
+    # Route -> default deadline, overriding DEFAULT_SECONDS
+    ROUTE_DEFAULTS: Dict[str, float] = json.loads(os.getenv("REQUEST_DEADLINE_ROUTES", "null")) or {
+        "/code/generate-code": 60,
+        "/code/completion": 30,
+    }
 
 class Config:
     """Main configuration class that combines all config sections"""
@@ -121,6 +319,15 @@ class Config:
     AI = AIModelsConfig
     PAYMENT = PaymentConfig
     EMAIL = EmailConfig
+    EXPORT = ExportConfig
+    ARCHIVE = ArchiveConfig
+    PROMPT_REUSE = PromptReuseConfig
+    HISTORY = HistoryConfig
+    PARTITION = PartitionConfig
+    QUERY_STATS = QueryStatsConfig
+    RATE_LIMIT = RateLimitConfig
+    SCHEDULER = GenerationSchedulerConfig
+    DEADLINE = RequestDeadlineConfig
     
     # Application metadata
     APP_NAME = "Code Generator API"
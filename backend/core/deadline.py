@@ -0,0 +1,173 @@
+"""
+Request deadlines that travel with a request down to the provider calls.
+
+A Deadline is created once per request, from the client's X-Request-Timeout
+header or the route's default, and passed to every layer that waits: the
+generation queue, each provider attempt and each retry delay. Each of them
+takes only what is left of the budget, so a request that can no longer finish
+in time stops instead of retrying for minutes after the client has given up.
+
+A deadline is also cancelled when the client disconnects (see
+run_until_disconnected); from then on every check fails with RequestCancelled,
+and waits registered with on_cancel() wake up at once.
+"""
+import asyncio
+import functools
+import math
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+import anyio.to_thread
+from anyio import CapacityLimiter
+from fastapi import HTTPException, Request
+
+from config import Config
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request's deadline passes before its work is done"""
+
+
+class RequestCancelled(DeadlineExceeded):
+    """Raised when the client went away before its request was done"""
+
+
+class Deadline:
+    """A point in time by which a request must be answered, or sooner if it's cancelled."""
+
+    __slots__ = ("timeout", "expires_at", "_cancelled", "_callbacks", "_lock")
+
+    def __init__(self, timeout: float):
+        """
+        Args:
+            timeout: Seconds from now
+        """
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        self._cancelled = threading.Event()
+        self._callbacks: List[Callable[[], Any]] = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """Seconds left, never negative; none once cancelled"""
+        if self._cancelled.is_set():
+            return 0.0
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self._cancelled.is_set() or time.monotonic() >= self.expires_at
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        """End the deadline now and wake everything waiting on it"""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], Any]) -> None:
+        """Call `callback` (from the cancelling thread) when the deadline is cancelled"""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def limit(self, timeout: Optional[float]) -> float:
+        """
+        Shrink a timeout to what is left of the deadline.
+
+        Raises:
+            DeadlineExceeded: If nothing is left
+        """
+        remaining = self.check()
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def check(self) -> float:
+        """
+        Returns:
+            Seconds left
+
+        Raises:
+            RequestCancelled: If the deadline was cancelled
+            DeadlineExceeded: If the deadline has passed
+        """
+        if self._cancelled.is_set():
+            raise RequestCancelled("Client disconnected")
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.timeout:g}s exceeded")
+        return remaining
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Sleep before a retry, unless the deadline would pass first; then
+        raise right away rather than waking up with no time left to retry.
+
+        Raises:
+            RequestCancelled: If the deadline is cancelled before or during the sleep
+            DeadlineExceeded: If the deadline is closer than `seconds`
+        """
+        if seconds >= self.check():
+            raise DeadlineExceeded(
+                f"Request deadline of {self.timeout:g}s leaves no time for a retry in {seconds:g}s"
+            )
+        if self._cancelled.wait(seconds):
+            raise RequestCancelled("Client disconnected")
+
+    def __repr__(self) -> str:
+        if self.cancelled:
+            return f"Deadline(cancelled, {self.timeout:g}s)"
+        return f"Deadline({self.remaining():.2f}s of {self.timeout:g}s left)"
+
+
+async def request_deadline(request: Request) -> Deadline:
+    """
+    Dependency giving the request's deadline: the X-Request-Timeout header in
+    seconds if the client sent one, capped at MAX_SECONDS, else the route default.
+    Async so that resolving it never waits for a threadpool thread.
+    """
+    header = request.headers.get(Config.DEADLINE.HEADER)
+    timeout = Config.DEADLINE.ROUTE_DEFAULTS.get(request.url.path, Config.DEADLINE.DEFAULT_SECONDS)
+    if header is not None:
+        try:
+            timeout = float(header)
+        except ValueError:
+            timeout = math.nan
+        if not timeout > 0:
+            raise HTTPException(status_code=400, detail=f"Invalid {Config.DEADLINE.HEADER} header")
+    return Deadline(min(timeout, Config.DEADLINE.MAX_SECONDS))
+
+
+async def run_until_disconnected(request: Request, deadline: Deadline, func: Callable, /, *args,
+                                 limiter: Optional[CapacityLimiter] = None, **kwargs) -> Any:
+    """
+    Run blocking `func` in the threadpool and cancel `deadline` if the client
+    disconnects meanwhile, so that `func` can stop its provider calls and skip
+    charging for a result nobody will read.
+
+    Args:
+        limiter: Threads to run `func` on (default: the shared threadpool)
+
+    Raises:
+        RequestCancelled: If `func` stopped because the client disconnected
+    """
+    work = asyncio.ensure_future(
+        anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=limiter)
+    )
+    while True:
+        done, _ = await asyncio.wait({work}, timeout=Config.DEADLINE.DISCONNECT_POLL_SECONDS)
+        if done:
+            return work.result()
+        if await request.is_disconnected():
+            deadline.cancel()
+            # The thread can't be interrupted; it notices the cancellation at its next wait
+            return await work
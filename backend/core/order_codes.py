@@ -0,0 +1,192 @@
+"""
+Snowflake-style order codes for PayOS.
+
+An order code packs a millisecond timestamp, a worker id and a per-millisecond
+sequence into 53 bits, the largest integer PayOS accepts (JavaScript's
+Number.MAX_SAFE_INTEGER). Codes from one generator are strictly increasing, and
+codes from generators with different worker ids never collide. Worker ids come
+from ORDER_CODE_WORKER_ID or are leased from the order_code_workers table, so
+every process running against the same database gets its own. A lease row keeps
+the last timestamp its holder used, and the next holder of that worker id starts
+above it, so codes stay unique when a generator that ran ahead of the clock
+hands its id over.
+"""
+import os
+import socket
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+
+logger = logging.getLogger("order_codes")
+
+TIMESTAMP_BITS = 41  # Milliseconds since ORDER_CODE_EPOCH; lasts about 69 years
+WORKER_ID_BITS = 5
+SEQUENCE_BITS = 7
+
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+MAX_ORDER_CODE = (1 << (TIMESTAMP_BITS + WORKER_ID_BITS + SEQUENCE_BITS)) - 1  # 2**53 - 1
+
+# 2025-01-01T00:00:00Z
+ORDER_CODE_EPOCH_MS = 1735689600000
+
+
+def decode_order_code(order_code: int) -> dict:
+    """Split an order code into its timestamp, worker id and sequence"""
+    sequence = order_code & MAX_SEQUENCE
+    worker_id = (order_code >> SEQUENCE_BITS) & MAX_WORKER_ID
+    timestamp_ms = (order_code >> (SEQUENCE_BITS + WORKER_ID_BITS)) + ORDER_CODE_EPOCH_MS
+    return {
+        "timestamp": datetime.utcfromtimestamp(timestamp_ms / 1000).isoformat(),
+        "worker_id": worker_id,
+        "sequence": sequence,
+    }
+
+
+class OrderCodeGenerator:
+    """Thread-safe generator of unique, increasing order codes."""
+
+    def __init__(self, worker_id: Optional[int] = None, session_factory: Optional[Callable] = None):
+        """
+        Args:
+            worker_id: Fixed worker id; when None, ORDER_CODE_WORKER_ID or a leased id is used
+            session_factory: Callable returning a new database session for leasing (default: SessionLocal)
+        """
+        if worker_id is None:
+            worker_id = Config.PAYMENT.ORDER_CODE_WORKER_ID
+        if worker_id is not None and not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"Order code worker id must be between 0 and {MAX_WORKER_ID}")
+        self._fixed_worker_id = worker_id
+        self._session_factory = session_factory
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self._lock = threading.Lock()
+        self._worker_id: Optional[int] = worker_id
+        self._lease_renew_at = 0.0
+        self._lease_expires_at = 0.0
+        self._last_ms = -1
+        self._sequence = 0
+
+    @property
+    def worker_id(self) -> Optional[int]:
+        return self._worker_id
+
+    def next_code(self) -> int:
+        """
+        Get the next order code.
+
+        If the clock goes backwards or a millisecond's sequence runs out, the
+        generator keeps counting from its last timestamp instead of waiting, so
+        codes stay increasing.
+        """
+        with self._lock:
+            if self._fixed_worker_id is None:
+                self._ensure_lease()
+            now_ms = int(time.time() * 1000) - ORDER_CODE_EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            elif self._sequence < MAX_SEQUENCE:
+                self._sequence += 1
+            else:
+                self._last_ms += 1
+                self._sequence = 0
+            if self._last_ms >= 1 << TIMESTAMP_BITS:
+                raise OverflowError("Order code timestamp space exhausted")
+            return (self._last_ms << (WORKER_ID_BITS + SEQUENCE_BITS)) \
+                | (self._worker_id << SEQUENCE_BITS) \
+                | self._sequence
+
+    def _ensure_lease(self) -> None:
+        """Lease a worker id, or renew the current lease once half of it has passed"""
+        now = time.monotonic()
+        if self._worker_id is not None and now < self._lease_renew_at:
+            return
+        from models import OrderCodeWorker
+        if self._session_factory is None:
+            from database import SessionLocal
+            self._session_factory = SessionLocal
+
+        ttl = Config.PAYMENT.ORDER_CODE_LEASE_SECONDS
+        db = self._session_factory()
+        try:
+            wall_now = datetime.utcnow()
+            expires_at = (wall_now + timedelta(seconds=ttl)).isoformat()
+            # Keep the current id while this process still holds it
+            if self._worker_id is not None and now < self._lease_expires_at:
+                renewed = db.query(OrderCodeWorker)\
+                    .filter(OrderCodeWorker.worker_id == self._worker_id, OrderCodeWorker.owner == self._owner)\
+                    .update({OrderCodeWorker.expires_at: expires_at, OrderCodeWorker.last_ms: self._last_ms},
+                            synchronize_session=False)
+                db.commit()
+                if renewed:
+                    self._set_lease(now, ttl)
+                    return
+                logger.warning(f"Lost the lease on order code worker id {self._worker_id}")
+
+            leases = {row.worker_id: row for row in db.query(OrderCodeWorker).all()}
+            for candidate in range(MAX_WORKER_ID + 1):
+                lease = leases.get(candidate)
+                previous_ms = lease.last_ms if lease is not None else None
+                if lease is None:
+                    db.add(OrderCodeWorker(worker_id=candidate, owner=self._owner, expires_at=expires_at))
+                    try:
+                        db.commit()
+                    except IntegrityError:
+                        db.rollback()
+                        continue
+                elif lease.expires_at < wall_now.isoformat():
+                    # Compare-and-set on the old lease so two processes can't take it together
+                    taken = db.query(OrderCodeWorker)\
+                        .filter(OrderCodeWorker.worker_id == candidate,
+                                OrderCodeWorker.owner == lease.owner,
+                                OrderCodeWorker.expires_at == lease.expires_at)\
+                        .update({OrderCodeWorker.owner: self._owner, OrderCodeWorker.expires_at: expires_at},
+                                synchronize_session=False)
+                    db.commit()
+                    if not taken:
+                        continue
+                else:
+                    continue
+                self._worker_id = candidate
+                # Stay above every code an earlier holder of this id may have issued
+                if previous_ms is not None and previous_ms >= self._last_ms:
+                    self._last_ms = previous_ms
+                    self._sequence = MAX_SEQUENCE
+                self._set_lease(now, ttl)
+                logger.info(f"Leased order code worker id {candidate}")
+                return
+            raise RuntimeError(f"All {MAX_WORKER_ID + 1} order code worker ids are leased")
+        finally:
+            db.close()
+
+    def _set_lease(self, now: float, ttl: float) -> None:
+        self._lease_renew_at = now + ttl / 2
+        self._lease_expires_at = now + ttl
+
+    def release(self) -> None:
+        """
+        Give the leased worker id back so a new process can take it right away.
+        The row is kept, expired, with the last timestamp used, for the next holder to start above.
+        """
+        with self._lock:
+            if self._fixed_worker_id is not None or self._worker_id is None or self._session_factory is None:
+                return
+            from models import OrderCodeWorker
+            db = self._session_factory()
+            try:
+                db.query(OrderCodeWorker)\
+                    .filter(OrderCodeWorker.worker_id == self._worker_id, OrderCodeWorker.owner == self._owner)\
+                    .update({OrderCodeWorker.expires_at: datetime.utcnow().isoformat(),
+                             OrderCodeWorker.last_ms: self._last_ms},
+                            synchronize_session=False)
+                db.commit()
+            finally:
+                db.close()
+            self._worker_id = None
+            self._lease_renew_at = self._lease_expires_at = 0.0
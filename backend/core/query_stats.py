@@ -0,0 +1,139 @@
+"""
+Per-request database query statistics and slow-query logging.
+
+Cursor execution events on every engine feed the statistics of the current
+request, which live in a context variable so that sync endpoints running in the
+threadpool and their dependencies all count against the same request.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import Config
+
+logger = logging.getLogger("query_stats")
+
+
+class QueryStats:
+    """Query count and total database time of one unit of work."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: List[str] = []
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.statements.append(statement)
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def redact_parameters(parameters: Any) -> Any:
+    """Replace parameter values with their types so slow-query logs never contain user data"""
+    if isinstance(parameters, dict):
+        return {key: redact_parameters(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_parameters(value) for value in parameters]
+    return None if parameters is None else f"<{type(parameters).__name__}>"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    if elapsed * 1000 >= Config.QUERY_STATS.SLOW_QUERY_MS:
+        logger.warning(
+            f"Slow query ({elapsed * 1000:.1f} ms): {statement} "
+            f"parameters={redact_parameters(parameters)}"
+        )
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryStats]:
+    """Collect statistics for every query run inside the block"""
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int) -> Iterator[QueryStats]:
+    """
+    Fail if the block runs more than limit queries. Meant for tests of code called
+    in-process, e.g.
+
+        with assert_max_queries(2):
+            CodeGenerationRepository(db).get_by_user_id(user.id)
+    """
+    with count_queries() as stats:
+        yield stats
+    if stats.count > limit:
+        executed = "\n".join(f"  {statement}" for statement in stats.statements)
+        raise AssertionError(f"Expected at most {limit} queries, {stats.count} were executed:\n{executed}")
+
+
+def assert_response_max_queries(response, limit: int) -> None:
+    """
+    Fail if the request behind a response ran more than limit queries. Meant for
+    endpoint tests through TestClient, which runs the app on another thread, e.g.
+
+        assert_response_max_queries(client.get("/code/history", headers=headers), 3)
+    """
+    count = response.headers.get("x-db-query-count")
+    if count is None:
+        raise AssertionError("Response has no X-DB-Query-Count header; set QUERY_STATS_HEADERS=true")
+    if int(count) > limit:
+        raise AssertionError(
+            f"Expected at most {limit} queries for {response.request.method} {response.request.url.path}, "
+            f"{count} were executed"
+        )
+
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware that counts the queries of each request and, when enabled,
+    reports them in X-DB-Query-Count and X-DB-Time-Ms response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # An enclosing count_queries() block (e.g. in a test) keeps collecting
+        stats = _current_stats.get() or QueryStats()
+        token = _current_stats.set(stats)
+
+        async def send_with_stats(message):
+            if message["type"] == "http.response.start" and Config.QUERY_STATS.RESPONSE_HEADERS:
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-query-count", str(stats.count).encode()))
+                headers.append((b"x-db-time-ms", f"{stats.seconds * 1000:.1f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            _current_stats.reset(token)
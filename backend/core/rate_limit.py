@@ -0,0 +1,400 @@
+"""
+Rate limiting: token buckets for outgoing calls and per-client request limits.
+
+Request limits are configured per route and per user tier, using either a
+sliding window counter or a token bucket. Limit state lives in a backend: the
+memory backend is per process, the database backend is shared by every worker
+on the same database (a local SQLite file stands in for it on one machine).
+RateLimitMiddleware applies the limits before routing, so rejected requests
+cost no database or provider work beyond the limit check itself.
+"""
+import math
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from jose import JWTError, jwt
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+from config import Config
+
+logger = logging.getLogger("rate_limit")
+
+
+class TokenBucket:
+    """
+    Allows `rate` operations per second on average with bursts of up to `capacity`.
+    Thread-safe; the state is local to the process.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens if they are available; never blocks"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Wait until tokens are available and take them"""
+        while not self.try_acquire(tokens):
+            time.sleep(self.retry_after(tokens))
+
+    def retry_after(self, tokens: float = 1.0) -> float:
+        """Seconds until tokens will be available"""
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = tokens - self._tokens
+            return max(0.0, missing / self.rate) if self.rate else float("inf")
+
+
+# Request limits
+
+SLIDING_WINDOW = "sliding_window"
+TOKEN_BUCKET = "token_bucket"
+
+
+class RateLimitRule:
+    """`limit` requests per `period` seconds for one client on one route."""
+
+    def __init__(self, algorithm: str, limit: int, period: float):
+        if algorithm not in (SLIDING_WINDOW, TOKEN_BUCKET):
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        if limit < 1 or period <= 0:
+            raise ValueError("Rate limit needs a limit of at least 1 and a positive period")
+        self.algorithm = algorithm
+        self.limit = limit
+        self.period = period
+
+    @classmethod
+    def from_config(cls, rule: Dict[str, Any]) -> "RateLimitRule":
+        return cls(rule.get("algorithm", SLIDING_WINDOW), int(rule["limit"]), float(rule["period"]))
+
+    def __repr__(self) -> str:
+        return f"{self.algorithm}:{self.limit}/{self.period:g}s"
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # Seconds until the next request would be allowed; 0 when allowed
+
+
+def _sliding_window(state: Optional[Dict[str, float]], rule: RateLimitRule,
+                    now: float) -> Tuple[Optional[Dict[str, float]], RateLimitResult]:
+    """
+    Sliding window counter: the previous fixed window's count, weighted by how much of
+    it still overlaps the sliding window, plus the current window's count.
+    Returns the new state (None when unchanged) and the result.
+    """
+    period = rule.period
+    window_start = math.floor(now / period) * period
+    count = previous = 0.0
+    if state is not None:
+        if state["window_start"] == window_start:
+            count, previous = state["count"], state["previous_count"]
+        elif state["window_start"] == window_start - period:
+            previous = state["count"]
+
+    elapsed = now - window_start
+    estimated = previous * (1 - elapsed / period) + count
+    if estimated + 1 <= rule.limit:
+        new_state = {"window_start": window_start, "count": count + 1, "previous_count": previous,
+                     "tokens": 0.0, "updated_at": now}
+        return new_state, RateLimitResult(True, rule.limit, int(rule.limit - estimated - 1), 0.0)
+
+    if count + 1 <= rule.limit:
+        # Once the previous window's weight has decayed enough for one more request
+        retry_after = period * (1 - (rule.limit - 1 - count) / previous) - elapsed
+    else:
+        # Not before the next window, where this window becomes the decaying one
+        retry_after = period - elapsed + period * (1 - (rule.limit - 1) / count)
+    return None, RateLimitResult(False, rule.limit, 0, max(retry_after, 0.001))
+
+
+def _token_bucket(state: Optional[Dict[str, float]], rule: RateLimitRule,
+                  now: float) -> Tuple[Optional[Dict[str, float]], RateLimitResult]:
+    """Token bucket refilled at limit/period per second, holding up to `limit` tokens"""
+    rate = rule.limit / rule.period
+    tokens = float(rule.limit)
+    if state is not None:
+        tokens = min(float(rule.limit), state["tokens"] + (now - state["updated_at"]) * rate)
+    if tokens >= 1:
+        new_state = {"window_start": 0.0, "count": 0.0, "previous_count": 0.0,
+                     "tokens": tokens - 1, "updated_at": now}
+        return new_state, RateLimitResult(True, rule.limit, int(tokens - 1), 0.0)
+    return None, RateLimitResult(False, rule.limit, 0, (1 - tokens) / rate)
+
+
+ALGORITHMS = {SLIDING_WINDOW: _sliding_window, TOKEN_BUCKET: _token_bucket}
+
+
+class MemoryRateLimitBackend:
+    """Limit state in process memory; each worker process limits on its own."""
+
+    PURGE_EVERY = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[str, Tuple[Dict[str, float], float]] = {}
+        self._hits = 0
+
+    def hit(self, key: str, rule: RateLimitRule) -> RateLimitResult:
+        now = time.time()
+        with self._lock:
+            entry = self._states.get(key)
+            new_state, result = ALGORITHMS[rule.algorithm](entry[0] if entry else None, rule, now)
+            if new_state is not None:
+                self._states[key] = (new_state, now + 2 * rule.period)
+            self._hits += 1
+            if self._hits % self.PURGE_EVERY == 0:
+                self._states = {k: v for k, v in self._states.items() if v[1] > now}
+        return result
+
+
+class DatabaseRateLimitBackend:
+    """
+    Limit state in the rate_limit_buckets table, shared by every worker using the database.
+    Updates are compare-and-set on a version column, so two workers never both take the
+    last slot; denied requests read one row and write nothing.
+    """
+
+    PURGE_EVERY = 1000
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, engine: Engine):
+        from models import RateLimitBucket
+        self.engine = engine
+        self.table = RateLimitBucket.__table__
+        self._hits = 0
+
+    def hit(self, key: str, rule: RateLimitRule) -> RateLimitResult:
+        table = self.table
+        for _ in range(self.MAX_ATTEMPTS):
+            now = time.time()
+            with self.engine.begin() as conn:
+                row = conn.execute(select(table).where(table.c.key == key)).mappings().first()
+                new_state, result = ALGORITHMS[rule.algorithm](dict(row) if row else None, rule, now)
+                if new_state is None:
+                    return result
+                values = {**new_state, "expires_at": now + 2 * rule.period}
+                if row is None:
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(insert(table).values(key=key, version=1, **values))
+                    except IntegrityError:
+                        # Another worker created the row first; read it again
+                        continue
+                else:
+                    updated = conn.execute(
+                        update(table)
+                        .where(table.c.key == key, table.c.version == row["version"])
+                        .values(version=row["version"] + 1, **values)
+                    ).rowcount
+                    if not updated:
+                        continue
+            self._hits += 1
+            if self._hits % self.PURGE_EVERY == 0:
+                self.purge()
+            return result
+        # Heavy contention on one key: err on the side of the limit
+        return RateLimitResult(False, rule.limit, 0, 1.0)
+
+    def purge(self) -> int:
+        """Delete state that no rule needs any more"""
+        with self.engine.begin() as conn:
+            return conn.execute(delete(self.table).where(self.table.c.expires_at < time.time())).rowcount
+
+
+class RateLimiter:
+    """Matches requests to the configured rules and checks them against a backend."""
+
+    def __init__(self, rules: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None, backend=None):
+        """
+        Args:
+            rules: Route path -> tier -> rule settings (default from Config)
+            backend: MemoryRateLimitBackend or DatabaseRateLimitBackend (default per Config)
+        """
+        rules = Config.RATE_LIMIT.RULES if rules is None else rules
+        self.rules = {
+            path: {tier: RateLimitRule.from_config(rule) for tier, rule in tiers.items() if rule}
+            for path, tiers in rules.items()
+        }
+        if backend is None:
+            if Config.RATE_LIMIT.BACKEND == "database":
+                from database import engine
+                backend = DatabaseRateLimitBackend(engine)
+            else:
+                backend = MemoryRateLimitBackend()
+        self.backend = backend
+        # The database backend does I/O and must stay off the event loop
+        self.blocking = isinstance(backend, DatabaseRateLimitBackend)
+
+    def check(self, path: str, client: str, tier: str) -> Optional[RateLimitResult]:
+        """Count a request; None when no rule applies"""
+        rule = self.rules.get(path, {}).get(tier)
+        if rule is None:
+            return None
+        # Per tier, since each algorithm keeps its own kind of state and a user's tier can change
+        return self.backend.hit(f"{path}|{tier}|{client}", rule)
+
+
+class TierCache:
+    """
+    Users' current tiers, looked up in the database and kept for TIER_CACHE_SECONDS.
+    The tier in a token is fixed at login, so without this a purchase would only
+    lift a user's limits once their token expires.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_size: int = 10000, session_factory=None):
+        """
+        Args:
+            ttl: Seconds a looked-up tier is used for (default from Config)
+            max_size: Users kept; the least recently checked are dropped first
+            session_factory: Callable returning a new database session (default: SessionLocal)
+        """
+        self.ttl = Config.RATE_LIMIT.TIER_CACHE_SECONDS if ttl is None else ttl
+        self.max_size = max_size
+        self._session_factory = session_factory
+        self._tiers: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[str]:
+        """The cached tier, or None if it must be looked up"""
+        with self._lock:
+            cached = self._tiers.get(username)
+            if cached is None or cached[1] <= time.monotonic():
+                return None
+            self._tiers.move_to_end(username)
+            return cached[0]
+
+    def resolve(self, username: str, default: str) -> str:
+        """Look the tier up in the database and cache it; blocking"""
+        from models import User
+        from services.user_service import UserService
+        if self._session_factory is None:
+            from database import SessionLocal
+            self._session_factory = SessionLocal
+
+        db = self._session_factory()
+        try:
+            user = db.query(User).filter(User.username == username).first()
+            tier = UserService.get_tier(db, user) if user else default
+        finally:
+            db.close()
+        with self._lock:
+            self._tiers[username] = (tier, time.monotonic() + self.ttl)
+            self._tiers.move_to_end(username)
+            while len(self._tiers) > self.max_size:
+                self._tiers.popitem(last=False)
+        return tier
+
+
+def client_identity(scope) -> Tuple[str, str]:
+    """
+    The client a request counts against and the tier in its bearer token, read
+    without touching the database. Requests without a valid token count against
+    their IP address in the "anonymous" tier.
+    """
+    headers = dict(scope.get("headers") or [])
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if authorization.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(authorization[7:], Config.SECURITY.SECRET_KEY,
+                                 algorithms=[Config.SECURITY.ALGORITHM])
+            if payload.get("sub"):
+                return f"user:{payload['sub']}", payload.get("tier", "free")
+        except JWTError:
+            pass
+
+    ip = scope["client"][0] if scope.get("client") else "unknown"
+    if Config.RATE_LIMIT.TRUST_PROXY and b"x-forwarded-for" in headers:
+        # Each proxy appends the address it received the request from, so only the entries
+        # added by our own proxies can be trusted; anything left of them is client-supplied
+        forwarded = [entry.strip() for entry in headers[b"x-forwarded-for"].decode("latin-1").split(",")]
+        hops = max(Config.RATE_LIMIT.TRUSTED_PROXY_HOPS, 1)
+        ip = forwarded[max(len(forwarded) - hops, 0)] or ip
+    return f"ip:{ip}", "anonymous"
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware that answers requests over their limit with 429 and Retry-After
+    before they reach the router.
+    """
+
+    def __init__(self, app, limiter: Optional[RateLimiter] = None, tiers: Optional[TierCache] = None):
+        self.app = app
+        self.limiter = limiter
+        self.tiers = tiers
+
+    async def _current_tier(self, username: str, token_tier: str) -> str:
+        tier = self.tiers.get(username)
+        if tier is None:
+            try:
+                tier = await run_in_threadpool(self.tiers.resolve, username, token_tier)
+            except Exception as e:
+                logger.error(f"Error looking up the tier of {username}, using the token's: {str(e)}")
+                tier = token_tier
+        return tier
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not Config.RATE_LIMIT.ENABLED:
+            await self.app(scope, receive, send)
+            return
+        if self.limiter is None:
+            from core.dependency_injection import DIContainer
+            self.limiter = DIContainer.get_instance(RateLimiter)
+            self.tiers = self.tiers or DIContainer.get_instance(TierCache)
+        if scope["path"] not in self.limiter.rules:
+            await self.app(scope, receive, send)
+            return
+
+        client, tier = client_identity(scope)
+        if client.startswith("user:") and self.tiers is not None and self.tiers.ttl > 0:
+            tier = await self._current_tier(client[len("user:"):], tier)
+        try:
+            if self.limiter.blocking:
+                result = await run_in_threadpool(self.limiter.check, scope["path"], client, tier)
+            else:
+                result = self.limiter.check(scope["path"], client, tier)
+        except Exception as e:
+            # A broken limit store shouldn't take the endpoints down with it
+            logger.error(f"Rate limit check failed, allowing request: {str(e)}")
+            result = None
+
+        if result is None or result.allowed:
+            await self.app(scope, receive, send)
+            return
+
+        body = b'{"detail":"Too many requests, please retry later"}'
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(result.retry_after))).encode()),
+                (b"x-ratelimit-limit", str(result.limit).encode()),
+                (b"x-ratelimit-remaining", b"0"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -6,6 +6,7 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from database import get_db
 from models import User
@@ -68,9 +69,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(db, username=token_data.username)
+    # Off the event loop: when the connection pool is exhausted the lookup waits for a
+    # connection, and blocking the loop would stall the requests that would give one back
+    user = await run_in_threadpool(get_user, db, username=token_data.username)
     if user is None:
         raise credentials_exception
+    # Lets the session keep this user's reads on the primary right after their writes
+    db.info["user_id"] = user.id
     return user
 
 
@@ -115,8 +120,9 @@ async def get_user_id_from_token(token: str = Depends(oauth2_scheme), db: Sessio
     except JWTError:
         raise credentials_exception
         
-    user = get_user(db, username=token_data.username)
+    user = await run_in_threadpool(get_user, db, username=token_data.username)
     if user is None:
         raise credentials_exception
+    db.info["user_id"] = user.id
         
     return user.id
\ No newline at end of file
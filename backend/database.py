@@ -1,16 +1,101 @@
-from sqlalchemy import create_engine
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+from fastapi import Depends
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
 
 from config import Config
 
+
+def _connect_args(url: str) -> dict:
+    # check_same_thread is a SQLite-only driver argument
+    return Config.DB.CONNECT_ARGS if url.startswith("sqlite") else {}
+
+
 # Create engine
 engine = create_engine(
-    Config.DB.DATABASE_URL, connect_args=Config.DB.CONNECT_ARGS
+    Config.DB.DATABASE_URL, connect_args=_connect_args(Config.DB.DATABASE_URL)
 )
 
+# Read replica engines; empty when no replicas are configured
+replica_engines = [
+    create_engine(url, connect_args=_connect_args(url)) for url in Config.DB.REPLICA_URLS
+]
+
+# Users whose data changed recently, with the time of the last committed write
+_recent_writers: Dict[int, float] = {}
+_recent_writers_lock = threading.Lock()
+
+
+def mark_user_write(user_id: int) -> None:
+    """Keep a user's reads on the primary for the stickiness window"""
+    now = time.monotonic()
+    with _recent_writers_lock:
+        _recent_writers[user_id] = now
+        if len(_recent_writers) > 10000:
+            cutoff = now - Config.DB.REPLICA_STICKY_SECONDS
+            for stale_id in [uid for uid, at in _recent_writers.items() if at < cutoff]:
+                del _recent_writers[stale_id]
+
+
+def is_sticky(user_id: Optional[int]) -> bool:
+    """Whether a user wrote recently enough that replicas may not have caught up"""
+    if user_id is None:
+        return False
+    written_at = _recent_writers.get(user_id)
+    return written_at is not None and time.monotonic() - written_at < Config.DB.REPLICA_STICKY_SECONDS
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to a replica when opted in with info["use_replica"].
+    Everything goes to the primary once the session has written anything, and
+    for a user (info["user_id"]) who wrote within the stickiness window.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            replica_engines
+            and self.info.get("use_replica")
+            and not self._flushing
+            and not self.info.get("has_writes")
+            and not isinstance(clause, UpdateBase)
+            and not is_sticky(self.info.get("user_id"))
+        ):
+            return random.choice(replica_engines)
+        return engine
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _track_written_users(session, flush_context):
+    session.info["has_writes"] = True
+    written = session.info.setdefault("written_user_ids", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        user_id = obj.id if obj.__tablename__ == "users" else getattr(obj, "user_id", None)
+        if user_id is not None:
+            written.add(user_id)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _mark_written_users(session):
+    for user_id in session.info.pop("written_user_ids", ()):
+        mark_user_write(user_id)
+    if session.info.get("user_id") is not None and session.info.get("has_writes"):
+        mark_user_write(session.info["user_id"])
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_written_users(session):
+    session.info.pop("written_user_ids", None)
+
+
 # Create SessionLocal class
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 
 # Create Base class
 Base = declarative_base()
@@ -21,4 +106,31 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def get_read_db(db: Session = Depends(get_db)):
+    """Request session whose reads may be served by a replica"""
+    db.info["use_replica"] = True
+    return db
+
+
+def add_missing_columns(bind=engine):
+    """
+    Add nullable model columns that are missing from existing tables.
+    create_all only creates missing tables, so columns added to a model later
+    (and their indexes) are applied here.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
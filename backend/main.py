@@ -1,13 +1,59 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 import models
-from database import engine
+from database import engine, SessionLocal, add_missing_columns
 from routers import auth, users, models as models_router, code_generation, admin, payments
 from config import Config
+from repositories.code_search_repository import CodeSearchRepository
+from repositories.partition_repository import PartitionRepository
+from services.prompt_similarity import PromptSimilarityIndex
+from services.history_writer import HistoryWriteBehindBuffer
+from services.mail_outbox import MailWorker
+from services.qr_renderer import QRRenderer
+from services.payment_webhooks import PaymentWebhookWorker
+from services.payment_reconciler import PaymentReconciler
+from services import payment_service
+from services.api_clients import GoogleApiClient, OpenAIApiClient
+from core.dependency_injection import DIContainer
+from core.query_stats import QueryStatsMiddleware
+from core.rate_limit import RateLimitMiddleware
+from core.order_codes import OrderCodeGenerator
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
+add_missing_columns(engine)
+PartitionRepository.install(engine)
+CodeSearchRepository.install(engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load historical prompts for near-duplicate lookups without delaying startup
+    DIContainer.get_instance(PromptSimilarityIndex).build_in_background(SessionLocal)
+    PartitionRepository.maintain_in_background(engine)
+    DIContainer.get_instance(MailWorker, SessionLocal).start()
+    DIContainer.get_instance(QRRenderer).warm_up()
+    DIContainer.get_instance(GoogleApiClient).warm_up(sorted(set(Config.AI.GOOGLE_MODEL_MAPPING.values())))
+    await DIContainer.get_instance(OpenAIApiClient).start()
+    DIContainer.get_instance(PaymentWebhookWorker, SessionLocal).start()
+    DIContainer.get_instance(PaymentReconciler, SessionLocal).start()
+    if Config.HISTORY.WRITE_BEHIND:
+        DIContainer.get_instance(HistoryWriteBehindBuffer, SessionLocal).start()
+    yield
+    await DIContainer.get_instance(MailWorker, SessionLocal).close()
+    DIContainer.get_instance(QRRenderer).close()
+    await DIContainer.get_instance(PaymentWebhookWorker, SessionLocal).close()
+    await DIContainer.get_instance(PaymentReconciler, SessionLocal).close()
+    DIContainer.get_instance(OrderCodeGenerator).release()
+    payment_service.payos_client.close()
+    DIContainer.get_instance(GoogleApiClient).close()
+    await DIContainer.get_instance(OpenAIApiClient).close()
+    if Config.HISTORY.WRITE_BEHIND:
+        DIContainer.get_instance(HistoryWriteBehindBuffer, SessionLocal).close()
+
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -16,9 +62,14 @@ app = FastAPI(
     version=Config.APP_VERSION,
     docs_url=None,
     redoc_url=None,
-    openapi_url=None
+    openapi_url=None,
+    lifespan=lifespan
 )
 
+# Reject requests over their rate limit before routing; added first so that
+# CORS headers still wrap its 429 responses
+app.add_middleware(RateLimitMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -26,8 +77,12 @@ app.add_middleware(
     allow_credentials=Config.CORS.ALLOW_CREDENTIALS,
     allow_methods=Config.CORS.ALLOW_METHODS,
     allow_headers=Config.CORS.ALLOW_HEADERS,
+    expose_headers=Config.CORS.EXPOSE_HEADERS,
 )
 
+# Count queries per request and log slow ones
+app.add_middleware(QueryStatsMiddleware)
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(users.router)
@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, Float, ForeignKey, Integer, String, Text
+from sqlalchemy import BigInteger, Boolean, Column, Float, ForeignKey, Index, Integer, String, Text, func, select
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -34,6 +35,15 @@ class ModelPricing(Base):
     description = Column(Text, nullable=True)
 
 
+class CodeBlob(Base):
+    __tablename__ = "code_blobs"
+
+    hash = Column(String, primary_key=True)  # SHA-256 hex digest of the content
+    content = Column(Text)
+    size = Column(Integer)
+    ref_count = Column(Integer, default=0)  # Number of code_generations rows referencing this blob
+
+
 class CodeGeneration(Base):
     __tablename__ = "code_generations"
 
@@ -41,12 +51,114 @@ class CodeGeneration(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     model_name = Column(String, index=True)
     prompt = Column(Text)
-    generated_code = Column(Text, nullable=True)
+    # Inline code of rows written before blob deduplication; NULL once migrated
+    legacy_generated_code = Column("generated_code", Text, nullable=True)
+    code_hash = Column(String, ForeignKey("code_blobs.hash"), nullable=True, index=True)
     credits_used = Column(Float)
     timestamp = Column(String)  # ISO format timestamp
+    language = Column(String, nullable=True)
+    # Generation whose stored code was returned for a near-identical prompt; NULL if generated
+    reused_from = Column(Integer, nullable=True)
     
     # Relationship to User
     user = relationship("User", back_populates="code_generations")
+    # Relationship to the deduplicated code content
+    code_blob = relationship("CodeBlob", lazy="joined")
+
+    @hybrid_property
+    def generated_code(self):
+        if self.code_blob is not None:
+            return self.code_blob.content
+        return self.legacy_generated_code
+
+    @generated_code.setter
+    def generated_code(self, value):
+        # Only used for detached copies; stored rows get their code through CodeBlobRepository
+        self.legacy_generated_code = value
+
+    @generated_code.expression
+    def generated_code(cls):
+        blob_content = select(CodeBlob.content).where(CodeBlob.hash == cls.code_hash).scalar_subquery()
+        return func.coalesce(blob_content, cls.legacy_generated_code).label("generated_code")
+
+
+class IdSequence(Base):
+    """Id counters for tables whose ids are reserved before their rows are inserted (SQLite only; Postgres uses the table's sequence)"""
+    __tablename__ = "id_sequences"
+
+    name = Column(String, primary_key=True)  # Table name
+    next_id = Column(Integer)  # First id not handed out yet
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String)
+    subject = Column(String)
+    text_body = Column(Text)
+    html_body = Column(Text, nullable=True)
+    status = Column(String, default="pending", index=True)  # pending, sent, failed
+    attempts = Column(Integer, default=0)
+    # ISO timestamp before which the mail isn't picked up; also leases mail to the sending worker
+    next_attempt_at = Column(String, index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(String)  # ISO format timestamp
+    sent_at = Column(String, nullable=True)  # ISO format timestamp
+
+
+class PaymentWebhookEvent(Base):
+    __tablename__ = "payment_webhook_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # paymentLinkId and result code; PayOS retries of the same event share it
+    event_key = Column(String, unique=True, index=True)
+    payment_link_id = Column(String, index=True)
+    code = Column(String)  # "00" for a successful payment
+    payload = Column(Text)  # Verified webhook data as JSON
+    status = Column(String, default="pending", index=True)  # pending, applied, ignored, failed
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)  # Failed attempts to apply the event so far
+    # ISO timestamp before which a pending event isn't retried; NULL means now
+    next_attempt_at = Column(String, nullable=True, index=True)
+    received_at = Column(String)  # ISO format timestamp
+    processed_at = Column(String, nullable=True)  # ISO format timestamp
+
+
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+
+    # Route and client, e.g. "/code/generate-code|user:alice"
+    key = Column(String, primary_key=True)
+    version = Column(Integer, default=1)  # Compare-and-set guard for concurrent workers
+    # Sliding window counter state (epoch seconds)
+    window_start = Column(Float, default=0)
+    count = Column(Float, default=0)
+    previous_count = Column(Float, default=0)
+    # Token bucket state (epoch seconds)
+    tokens = Column(Float, default=0)
+    updated_at = Column(Float, default=0)
+    expires_at = Column(Float, index=True)  # State may be deleted after this time
+
+
+class OrderCodeWorker(Base):
+    __tablename__ = "order_code_workers"
+
+    # Worker id embedded in order codes, leased to one process at a time
+    worker_id = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String)  # host:pid of the process holding the lease
+    expires_at = Column(String)  # ISO format timestamp (UTC)
+    # Highest timestamp in the holder's codes (ms since the order code epoch) at its last
+    # renewal or release; the next holder starts above it in case the last one ran ahead of the clock
+    last_ms = Column(BigInteger, nullable=True)
+
+
+class PaymentTransactionKey(Base):
+    __tablename__ = "payment_transaction_keys"
+
+    # Written in the same transaction as each payment. Keeps PayOS transaction ids unique
+    # once payment_transactions is partitioned, as its own unique indexes then include created_at
+    transaction_id = Column(String, primary_key=True)
 
 
 class PaymentTransaction(Base):
@@ -57,9 +169,20 @@ class PaymentTransaction(Base):
     amount = Column(Integer)  # Amount in VND
     credits = Column(Integer)  # Number of credits purchased
     transaction_id = Column(String, unique=True, index=True)  # PayOS transaction ID
+    order_code = Column(BigInteger, nullable=True, index=True)  # Order code sent to PayOS
+    checkout_url = Column(String, nullable=True)  # PayOS checkout page, encoded in the payment QR code
     status = Column(String)  # pending, completed, failed
     created_at = Column(String)  # ISO format timestamp
     completed_at = Column(String, nullable=True)  # ISO format timestamp when payment completed
+    last_checked_at = Column(String, nullable=True)  # ISO format timestamp of the last status check with PayOS
+    updated_at = Column(String, nullable=True)  # ISO format timestamp of the last status change
     
     # Relationship to User
-    user = relationship("User", back_populates="payment_transactions")
\ No newline at end of file
+    user = relationship("User", back_populates="payment_transactions")
+    
+    __table_args__ = (
+        # Lets the reconciliation sweep find old pending payments without scanning the table
+        Index("ix_payment_transactions_status_created_at", "status", "created_at"),
+        # Serves a user's history pages in created_at order
+        Index("ix_payment_transactions_user_id_created_at", "user_id", "created_at"),
+    )
\ No newline at end of file
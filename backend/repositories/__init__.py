@@ -5,10 +5,12 @@ from .base import BaseRepository
 from .user_repository import UserRepository
 from .model_repository import ModelPricingRepository
 from .code_repository import CodeGenerationRepository
+from .code_blob_repository import CodeBlobRepository
 
 __all__ = [
     'BaseRepository',
     'UserRepository',
     'ModelPricingRepository',
-    'CodeGenerationRepository'
+    'CodeGenerationRepository',
+    'CodeBlobRepository'
 ]
\ No newline at end of file
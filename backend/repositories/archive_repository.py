@@ -0,0 +1,166 @@
+"""
+Repository for archived code generations stored in compressed segment files.
+
+Each archive run writes one immutable segment:
+    seg-<first_id>-<last_id>.dat  concatenated zlib-compressed NDJSON blocks, ordered by id
+    seg-<first_id>-<last_id>.idx  sparse index with one (first_id, offset, length) entry per block
+The index is renamed into place last, so a segment only becomes visible once it is complete.
+"""
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger("archive_repository")
+
+INDEX_ENTRY = struct.Struct("<qqi")  # first id in block, byte offset, compressed length
+SEGMENT_PATTERN = re.compile(r"^seg-(\d+)-(\d+)\.idx$")
+
+
+class _Segment:
+    """An open, memory-mapped segment with its sparse index loaded."""
+
+    def __init__(self, data_path: str, index_path: str):
+        with open(index_path, "rb") as f:
+            raw = f.read()
+        entries = [INDEX_ENTRY.unpack_from(raw, pos) for pos in range(0, len(raw), INDEX_ENTRY.size)]
+        self.block_first_ids = [entry[0] for entry in entries]
+        self.block_spans = [(entry[1], entry[2]) for entry in entries]
+        self._file = open(data_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def find(self, record_id: int) -> Optional[Dict[str, Any]]:
+        position = bisect.bisect_right(self.block_first_ids, record_id) - 1
+        if position < 0:
+            return None
+        offset, length = self.block_spans[position]
+        block = zlib.decompress(self._map[offset:offset + length])
+        for line in block.splitlines():
+            record = json.loads(line)
+            if record["id"] == record_id:
+                return record
+        return None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class CodeArchiveRepository:
+    """Append-only store of archived code generations, looked up by id."""
+
+    def __init__(self, directory: Optional[str] = None, block_size: Optional[int] = None):
+        """
+        Args:
+            directory: Directory holding segment files (default from Config)
+            block_size: Records per compressed block (default from Config)
+        """
+        self.directory = directory or Config.ARCHIVE.DIRECTORY
+        self.block_size = block_size or Config.ARCHIVE.BLOCK_SIZE
+        self._lock = threading.Lock()
+        self._segment_ranges: List[Tuple[int, int, str]] = []
+        self._segments: Dict[str, _Segment] = {}
+        self._listing_mtime = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def write_segment(self, records: Iterable[Dict[str, Any]]) -> Optional[str]:
+        """
+        Write records (sorted by id) as a new segment.
+
+        Args:
+            records: Records to archive, each with an integer "id"
+
+        Returns:
+            Segment name, or None if there was nothing to write
+        """
+        records = list(records)
+        if not records:
+            return None
+
+        name = f"seg-{records[0]['id']:012d}-{records[-1]['id']:012d}"
+        data_path = os.path.join(self.directory, f"{name}.dat")
+        index_path = os.path.join(self.directory, f"{name}.idx")
+
+        index = bytearray()
+        offset = 0
+        with open(f"{data_path}.tmp", "wb") as data_file:
+            for start in range(0, len(records), self.block_size):
+                block = records[start:start + self.block_size]
+                payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in block)
+                compressed = zlib.compress(payload.encode("utf-8"), 6)
+                data_file.write(compressed)
+                index += INDEX_ENTRY.pack(block[0]["id"], offset, len(compressed))
+                offset += len(compressed)
+            data_file.flush()
+            os.fsync(data_file.fileno())
+
+        with open(f"{index_path}.tmp", "wb") as index_file:
+            index_file.write(index)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+        os.replace(f"{data_path}.tmp", data_path)
+        os.replace(f"{index_path}.tmp", index_path)
+        logger.info(f"Wrote archive segment {name} with {len(records)} records")
+        return name
+
+    def _refresh_listing(self) -> None:
+        """Reload the sorted list of segment id ranges when the directory changes."""
+        mtime = os.stat(self.directory).st_mtime_ns
+        if mtime == self._listing_mtime:
+            return
+        ranges = []
+        for filename in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(filename)
+            if match:
+                ranges.append((int(match.group(1)), int(match.group(2)), filename[:-len(".idx")]))
+        ranges.sort()
+        self._segment_ranges = ranges
+        self._listing_mtime = mtime
+
+    def _open_segment(self, name: str) -> _Segment:
+        segment = self._segments.get(name)
+        if segment is None:
+            segment = _Segment(
+                os.path.join(self.directory, f"{name}.dat"),
+                os.path.join(self.directory, f"{name}.idx")
+            )
+            self._segments[name] = segment
+        return segment
+
+    def get(self, record_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Look up an archived record by id.
+
+        Args:
+            record_id: Code generation id
+
+        Returns:
+            The archived record, or None if it isn't archived
+        """
+        with self._lock:
+            self._refresh_listing()
+            # Segments can overlap in id range, so check every candidate from the newest down
+            candidates = [name for first, last, name in self._segment_ranges if first <= record_id <= last]
+            segments = [self._open_segment(name) for name in reversed(candidates)]
+
+        for segment in segments:
+            record = segment.find(record_id)
+            if record is not None:
+                return record
+        return None
+
+    def close(self) -> None:
+        """Unmap all open segments."""
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
@@ -1,8 +1,12 @@
 """
 Base repository with common database operations.
 """
-from typing import TypeVar, Generic, Type, List, Optional, Any, Dict
-from sqlalchemy.orm import Session
+import base64
+import json
+from datetime import datetime
+from typing import TypeVar, Generic, Type, List, Optional, Any, Dict, Tuple
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query, Session
 from pydantic import BaseModel
 
 from models import Base
@@ -11,6 +15,65 @@ T = TypeVar('T', bound=Base)
 CreateSchemaType = TypeVar('CreateSchemaType', bound=BaseModel)
 UpdateSchemaType = TypeVar('UpdateSchemaType', bound=BaseModel)
 
+
+def filter_time_range(query: Query, column, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None) -> Query:
+    """
+    Restrict a query to [start, end) on an ISO timestamp column.
+    On partitioned tables this lets Postgres skip the months outside the range.
+    """
+    # Timestamps are stored as ISO strings, which sort the same way as the datetimes
+    if start is not None:
+        query = query.filter(column >= start.isoformat())
+    if end is not None:
+        query = query.filter(column < end.isoformat())
+    return query
+
+
+def encode_cursor(timestamp: str, id: int) -> str:
+    """Opaque cursor for the row after which the next page starts"""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Read a cursor made by encode_cursor.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        timestamp, id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(timestamp), int(id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def paginate_newest_first(query: Query, timestamp_column, id_column, limit: int,
+                          cursor: Optional[str] = None, skip: int = 0) -> Tuple[List[Any], Optional[str]]:
+    """
+    Keyset pagination in (timestamp, id) descending order.
+    Unlike offset pagination, each page costs the same however deep it is and rows
+    inserted meanwhile don't shift later pages. `skip` is only for clients that
+    still page by offset; it is ignored when a cursor is given.
+
+    Returns:
+        The page and the cursor of the next page, or None on the last page
+    """
+    if cursor is not None:
+        timestamp, id = decode_cursor(cursor)
+        query = query.filter(or_(
+            timestamp_column < timestamp,
+            and_(timestamp_column == timestamp, id_column < id)
+        ))
+        skip = 0
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).offset(skip).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
+
+
 class BaseRepository(Generic[T, CreateSchemaType, UpdateSchemaType]):
     """
     Base repository for database operations with standard CRUD methods.
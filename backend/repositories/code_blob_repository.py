@@ -0,0 +1,139 @@
+"""
+Repository for content-addressed, reference-counted generated code blobs.
+"""
+import hashlib
+import logging
+from typing import Dict
+
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import CodeBlob, CodeGeneration
+
+logger = logging.getLogger("code_blob_repository")
+
+
+class CodeBlobRepository:
+    """
+    Stores each distinct piece of generated code once, keyed by its SHA-256 digest.
+    Methods only stage changes in the session; callers own the commit, so a blob
+    reference and the row holding it are always written in the same transaction.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def hash_content(content: str) -> str:
+        """Get the content address of a piece of code"""
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def acquire(self, content: str, count: int = 1) -> str:
+        """
+        Store content if it's new and add references to it.
+
+        Args:
+            content: Generated code
+            count: Number of references to add
+
+        Returns:
+            The content hash to store on the referencing row
+        """
+        digest = self.hash_content(content)
+        dialect = self.db.get_bind().dialect.name
+        insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+        # A single upsert keeps concurrent writers of the same content from racing
+        statement = insert(CodeBlob).values(
+            hash=digest,
+            content=content,
+            size=len(content.encode("utf-8")),
+            ref_count=count
+        ).on_conflict_do_update(
+            index_elements=[CodeBlob.hash],
+            set_={"ref_count": CodeBlob.ref_count + count}
+        )
+        self.db.execute(statement)
+        return digest
+
+    def release(self, digest: str, count: int = 1) -> None:
+        """
+        Drop references to a blob and delete it once nothing references it.
+
+        Args:
+            digest: Content hash
+            count: Number of references to drop
+        """
+        self.db.execute(
+            update(CodeBlob)
+            .where(CodeBlob.hash == digest)
+            .values(ref_count=CodeBlob.ref_count - count)
+        )
+        self.db.execute(delete(CodeBlob).where(CodeBlob.hash == digest, CodeBlob.ref_count <= 0))
+
+    def migrate_legacy_rows(self, batch_size: int = 500) -> int:
+        """
+        Move inline generated_code of existing rows into blobs, one committed batch at a time.
+        Safe to interrupt and re-run; a row is only claimed if it has no hash yet.
+
+        Args:
+            batch_size: Rows migrated per transaction
+
+        Returns:
+            Number of rows migrated
+        """
+        migrated = 0
+        while True:
+            rows = self.db.query(CodeGeneration.id, CodeGeneration.legacy_generated_code)\
+                .filter(CodeGeneration.code_hash.is_(None), CodeGeneration.legacy_generated_code.isnot(None))\
+                .order_by(CodeGeneration.id)\
+                .limit(batch_size)\
+                .all()
+            if not rows:
+                break
+
+            try:
+                for code_gen_id, content in rows:
+                    digest = self.acquire(content)
+                    claimed = self.db.execute(
+                        update(CodeGeneration)
+                        .where(CodeGeneration.id == code_gen_id, CodeGeneration.code_hash.is_(None))
+                        .values({CodeGeneration.code_hash: digest, CodeGeneration.legacy_generated_code: None})
+                        .execution_options(synchronize_session=False)
+                    ).rowcount
+                    if claimed:
+                        migrated += 1
+                    else:
+                        # Another migration run got to this row first
+                        self.release(digest)
+                self.db.commit()
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"Error migrating generated code to blobs: {str(e)}")
+                raise
+
+        logger.info(f"Migrated {migrated} code generations to content-addressed blobs")
+        return migrated
+
+    def get_statistics(self) -> Dict[str, int]:
+        """
+        Get blob storage statistics.
+
+        Returns:
+            Distinct blob count, stored bytes and the bytes that inline storage would take
+        """
+        blobs, stored_bytes, logical_bytes = self.db.query(
+            func.count(CodeBlob.hash),
+            func.coalesce(func.sum(CodeBlob.size), 0),
+            func.coalesce(func.sum(CodeBlob.size * CodeBlob.ref_count), 0)
+        ).one()
+        legacy_rows = self.db.query(CodeGeneration)\
+            .filter(CodeGeneration.code_hash.is_(None), CodeGeneration.legacy_generated_code.isnot(None))\
+            .count()
+        return {
+            "blobs": blobs,
+            "stored_bytes": stored_bytes,
+            "logical_bytes": logical_bytes,
+            "legacy_rows": legacy_rows
+        }
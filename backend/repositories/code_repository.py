@@ -1,12 +1,16 @@
 """
 Repository for code generation related database operations.
 """
-from typing import Optional, List
+from collections import Counter
+from typing import Optional, List, Dict, Any
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 from datetime import datetime
 
-from .base import BaseRepository
-from models import CodeGeneration, User
+from .base import BaseRepository, filter_time_range
+from .code_blob_repository import CodeBlobRepository
+from models import CodeGeneration, IdSequence, User
 from schemas import CodeGenerationCreate, CodeGenerationUpdate
 
 class CodeGenerationRepository(BaseRepository[CodeGeneration, CodeGenerationCreate, CodeGenerationUpdate]):
@@ -15,7 +19,14 @@ class CodeGenerationRepository(BaseRepository[CodeGeneration, CodeGenerationCrea
     def __init__(self, db: Session):
         super().__init__(CodeGeneration, db)
     
-    def get_by_user_id(self, user_id: int, skip: int = 0, limit: int = 100) -> List[CodeGeneration]:
+    def get_by_user_id(
+        self,
+        user_id: int,
+        skip: int = 0,
+        limit: int = 100,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> List[CodeGeneration]:
         """
         Get code generation history for a user.
         
@@ -23,28 +34,74 @@ class CodeGenerationRepository(BaseRepository[CodeGeneration, CodeGenerationCrea
             user_id: ID of the user
             skip: Number of records to skip
             limit: Maximum number of records to return
+            start: Only include generations at or after this time
+            end: Only include generations before this time
             
         Returns:
             List of CodeGeneration objects
         """
-        return self.db.query(CodeGeneration)\
-            .filter(CodeGeneration.user_id == user_id)\
+        query = self.db.query(CodeGeneration).filter(CodeGeneration.user_id == user_id)
+        return filter_time_range(query, CodeGeneration.timestamp, start, end)\
             .order_by(CodeGeneration.id.desc())\
             .offset(skip)\
             .limit(limit)\
             .all()
     
-    def count_by_user_id(self, user_id: int) -> int:
+    def count_by_user_id(
+        self,
+        user_id: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> int:
         """
         Count code generations for a user.
         
         Args:
             user_id: ID of the user
+            start: Only count generations at or after this time
+            end: Only count generations before this time
             
         Returns:
             Number of code generations
         """
-        return self.db.query(CodeGeneration).filter(CodeGeneration.user_id == user_id).count()
+        query = self.db.query(CodeGeneration).filter(CodeGeneration.user_id == user_id)
+        return filter_time_range(query, CodeGeneration.timestamp, start, end).count()
+    
+    def reserve_ids(self, count: int) -> List[int]:
+        """
+        Reserve ids for rows that will be inserted later, such as write-behind
+        history records, so callers can be given the id right away.
+        
+        On Postgres the ids come from the table's own id sequence. On SQLite they
+        come from a counter row that every insert goes through (see
+        create_generation), kept above the largest stored id. Stages changes
+        only; the caller owns the commit.
+        
+        Args:
+            count: Number of ids to reserve
+            
+        Returns:
+            The reserved ids, ascending
+        """
+        if self.db.get_bind().dialect.name == "postgresql":
+            return list(self.db.execute(
+                text("SELECT nextval(pg_get_serial_sequence('code_generations', 'id')) FROM generate_series(1, :count)"),
+                {"count": count}
+            ).scalars())
+        
+        self.db.execute(
+            sqlite_insert(IdSequence).values(name=CodeGeneration.__tablename__, next_id=1)
+            .on_conflict_do_nothing(index_elements=[IdSequence.name])
+        )
+        # Rows inserted without the counter (e.g. by a migration) push it up, never down
+        stored = select(func.coalesce(func.max(CodeGeneration.id), 0) + 1).scalar_subquery()
+        next_id = self.db.execute(
+            update(IdSequence)
+            .where(IdSequence.name == CodeGeneration.__tablename__)
+            .values(next_id=func.max(IdSequence.next_id, stored) + count)
+            .returning(IdSequence.next_id)
+        ).scalar_one()
+        return list(range(next_id - count, next_id))
     
     def create_generation(
         self, 
@@ -52,7 +109,9 @@ class CodeGenerationRepository(BaseRepository[CodeGeneration, CodeGenerationCrea
         model_name: str,
         prompt: str,
         generated_code: str,
-        credits_used: float
+        credits_used: float,
+        language: Optional[str] = None,
+        reused_from: Optional[int] = None
     ) -> CodeGeneration:
         """
         Create a new code generation record.
@@ -63,18 +122,29 @@ class CodeGenerationRepository(BaseRepository[CodeGeneration, CodeGenerationCrea
             prompt: The code generation prompt
             generated_code: The generated code
             credits_used: Credits used for the generation
+            language: Programming language requested for the generation
+            reused_from: ID of the generation whose stored code was reused, if any
             
         Returns:
             Created CodeGeneration object
         """
         try:
+            # Store the code once per distinct content and reference it by hash
+            code_hash = None
+            if generated_code is not None:
+                code_hash = CodeBlobRepository(self.db).acquire(generated_code)
+            
             code_gen = CodeGeneration(
+                # On SQLite the id must come from the same counter as reserved ids
+                id=None if self.db.get_bind().dialect.name == "postgresql" else self.reserve_ids(1)[0],
                 user_id=user_id,
                 model_name=model_name,
                 prompt=prompt,
-                generated_code=generated_code,
+                code_hash=code_hash,
                 credits_used=credits_used,
-                timestamp=datetime.utcnow().isoformat()
+                timestamp=datetime.utcnow().isoformat(),
+                language=language,
+                reused_from=reused_from
             )
             
             self.db.add(code_gen)
@@ -86,4 +156,76 @@ class CodeGenerationRepository(BaseRepository[CodeGeneration, CodeGenerationCrea
             # Rollback transaction on error
             self.db.rollback()
             print(f"Error creating code generation record: {str(e)}")
+            raise
+    
+    def create_generations_bulk(self, records: List[Dict[str, Any]]) -> List[int]:
+        """
+        Create many code generation records with one multi-row INSERT and a single commit.
+        
+        Args:
+            records: Dicts with user_id, model_name, prompt, generated_code,
+                credits_used, timestamp, language and optionally reused_from, and
+                the id reserved for the row; records without one get an id here
+            
+        Returns:
+            IDs of the created records, in the order of records
+        """
+        if not records:
+            return []
+        try:
+            # One blob upsert per distinct piece of code in the batch
+            blob_repository = CodeBlobRepository(self.db)
+            unreserved = [r for r in records if r.get("id") is None]
+            for record, code_gen_id in zip(unreserved, self.reserve_ids(len(unreserved)) if unreserved else []):
+                record["id"] = code_gen_id
+            code_counts = Counter(r["generated_code"] for r in records if r["generated_code"] is not None)
+            code_hashes = {code: blob_repository.acquire(code, count) for code, count in code_counts.items()}
+            
+            rows = [
+                {
+                    "id": r["id"],
+                    "user_id": r["user_id"],
+                    "model_name": r["model_name"],
+                    "prompt": r["prompt"],
+                    "code_hash": code_hashes.get(r["generated_code"]),
+                    "credits_used": r["credits_used"],
+                    "timestamp": r["timestamp"],
+                    "language": r.get("language"),
+                    "reused_from": r.get("reused_from")
+                }
+                for r in records
+            ]
+            ids = self.db.scalars(
+                insert(CodeGeneration).returning(CodeGeneration.id, sort_by_parameter_order=True),
+                rows
+            ).all()
+            self.db.commit()
+            return list(ids)
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error creating code generation records: {str(e)}")
+            raise
+    
+    def delete(self, *, id: int) -> CodeGeneration:
+        """
+        Delete a code generation record and drop its reference to the code blob.
+        
+        Args:
+            id: Code generation ID
+            
+        Returns:
+            Deleted CodeGeneration object
+        """
+        try:
+            code_gen = self.get(id)
+            self.db.delete(code_gen)
+            # The row must be gone before its blob can be removed
+            self.db.flush()
+            if code_gen.code_hash:
+                CodeBlobRepository(self.db).release(code_gen.code_hash)
+            self.db.commit()
+            return code_gen
+        except Exception as e:
+            self.db.rollback()
+            print(f"Error deleting code generation record: {str(e)}")
             raise
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+Repository for full-text search over code generation history.
+"""
+import re
+import logging
+from typing import List, Dict, Any
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger("code_search_repository")
+
+SNIPPET_START = "<mark>"
+SNIPPET_END = "</mark>"
+
+
+# Generated code lives in code_blobs, except for rows not yet migrated off the inline column
+def _code_of(row: str) -> str:
+    return f"COALESCE((SELECT content FROM code_blobs WHERE hash = {row}.code_hash), {row}.generated_code)"
+
+
+# SQLite: a standalone FTS5 table whose rowid is the code generation id,
+# kept in sync with code_generations by triggers
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS code_generations_fts
+    USING fts5(prompt, generated_code, tokenize='unicode61')
+    """,
+    "DROP TRIGGER IF EXISTS code_generations_fts_ai",
+    f"""
+    CREATE TRIGGER code_generations_fts_ai AFTER INSERT ON code_generations BEGIN
+        INSERT INTO code_generations_fts(rowid, prompt, generated_code)
+        VALUES (new.id, new.prompt, {_code_of("new")});
+    END
+    """,
+    "DROP TRIGGER IF EXISTS code_generations_fts_ad",
+    """
+    CREATE TRIGGER code_generations_fts_ad AFTER DELETE ON code_generations BEGIN
+        DELETE FROM code_generations_fts WHERE rowid = old.id;
+    END
+    """,
+    "DROP TRIGGER IF EXISTS code_generations_fts_au",
+    f"""
+    CREATE TRIGGER code_generations_fts_au AFTER UPDATE OF prompt, generated_code, code_hash ON code_generations BEGIN
+        DELETE FROM code_generations_fts WHERE rowid = old.id;
+        INSERT INTO code_generations_fts(rowid, prompt, generated_code)
+        VALUES (new.id, new.prompt, {_code_of("new")});
+    END
+    """,
+]
+
+SQLITE_BACKFILL = f"""
+    INSERT INTO code_generations_fts(rowid, prompt, generated_code)
+    SELECT c.id, c.prompt, {_code_of("c")} FROM code_generations c
+"""
+
+# Postgres: a tsvector column maintained by a trigger, with a GIN index.
+# The prompt is weighted above the code so prompt matches rank first.
+POSTGRES_DDL = [
+    "ALTER TABLE code_generations ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    f"""
+    CREATE OR REPLACE FUNCTION code_generations_search_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.prompt, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce({_code_of("NEW")}, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS code_generations_search_trigger ON code_generations",
+    """
+    CREATE TRIGGER code_generations_search_trigger
+    BEFORE INSERT OR UPDATE OF prompt, generated_code, code_hash ON code_generations
+    FOR EACH ROW EXECUTE FUNCTION code_generations_search_update()
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_code_generations_search_vector ON code_generations USING GIN (search_vector)",
+]
+
+POSTGRES_BACKFILL = f"""
+    UPDATE code_generations c SET search_vector =
+        setweight(to_tsvector('simple', coalesce(c.prompt, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce({_code_of("c")}, '')), 'B')
+    WHERE c.search_vector IS NULL
+"""
+
+SQLITE_SEARCH = f"""
+    SELECT c.id, c.model_name, c.prompt, c.credits_used, c.timestamp,
+           snippet(code_generations_fts, -1, '{SNIPPET_START}', '{SNIPPET_END}', '...', 24) AS snippet,
+           -bm25(code_generations_fts, 2.0, 1.0) AS rank
+    FROM code_generations_fts
+    JOIN code_generations c ON c.id = code_generations_fts.rowid
+    WHERE code_generations_fts MATCH :query AND c.user_id = :user_id
+    ORDER BY rank DESC, c.id DESC
+    LIMIT :limit OFFSET :skip
+"""
+
+POSTGRES_SEARCH = f"""
+    SELECT c.id, c.model_name, c.prompt, c.credits_used, c.timestamp,
+           ts_headline('simple', coalesce(c.prompt, '') || ' ' || coalesce({_code_of("c")}, ''), q,
+                       'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, MaxFragments=1, MinWords=8, MaxWords=24') AS snippet,
+           ts_rank(c.search_vector, q) AS rank
+    FROM code_generations c, to_tsquery('simple', :query) q
+    WHERE c.user_id = :user_id AND c.search_vector @@ q
+    ORDER BY rank DESC, c.id DESC
+    LIMIT :limit OFFSET :skip
+"""
+
+
+class CodeSearchRepository:
+    """Full-text search over the prompts and generated code of a user's history."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def install(engine: Engine) -> None:
+        """
+        Create the search index and its sync triggers if they don't exist yet,
+        and index any rows that were written before the index existed.
+
+        Args:
+            engine: Database engine
+        """
+        dialect = engine.dialect.name
+        with engine.begin() as conn:
+            if dialect == "sqlite":
+                exists = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'code_generations_fts'"
+                )).first()
+                for statement in SQLITE_DDL:
+                    conn.execute(text(statement))
+                if not exists:
+                    conn.execute(text(SQLITE_BACKFILL))
+                    logger.info("Built code_generations_fts index from existing history")
+            elif dialect == "postgresql":
+                for statement in POSTGRES_DDL:
+                    conn.execute(text(statement))
+                conn.execute(text(POSTGRES_BACKFILL))
+            else:
+                logger.warning(f"Full-text search is not supported on dialect '{dialect}'")
+
+    @staticmethod
+    def _to_match_query(query: str, dialect: str) -> str:
+        """
+        Turn free text into a safe prefix-matching query where every term must match.
+        Only word characters are kept, so user input can't inject query syntax.
+        """
+        terms = re.findall(r"\w+", query.lower())
+        if dialect == "postgresql":
+            return " & ".join(f"{term}:*" for term in terms)
+        return " ".join(f'"{term}"*' for term in terms)
+
+    def search(self, user_id: int, query: str, skip: int = 0, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Search a user's code generation history.
+
+        Args:
+            user_id: ID of the user
+            query: Free-text search query
+            skip: Number of results to skip
+            limit: Maximum number of results to return
+
+        Returns:
+            List of matches ordered by relevance, each with a highlighted snippet
+        """
+        dialect = self.db.get_bind().dialect.name
+        match_query = self._to_match_query(query, dialect)
+        if not match_query:
+            return []
+
+        statement = POSTGRES_SEARCH if dialect == "postgresql" else SQLITE_SEARCH
+        rows = self.db.execute(
+            text(statement),
+            {"query": match_query, "user_id": user_id, "skip": skip, "limit": limit}
+        ).mappings().all()
+        return [dict(row) for row in rows]
@@ -0,0 +1,289 @@
+"""
+Repository for monthly range partitioning of the history tables on Postgres.
+"""
+import re
+import threading
+import time
+import logging
+from datetime import date, datetime
+from typing import Dict, List, Optional, Any
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from config import Config
+from database import Base
+
+logger = logging.getLogger("partition_repository")
+
+# Partitioned tables and their partition key. Keys are ISO timestamp strings,
+# so a month is the string range ['YYYY-MM-01', next month's 'YYYY-MM-01').
+PARTITIONED_TABLES = {
+    "code_generations": "timestamp",
+    "payment_transactions": "created_at",
+}
+
+# Unique columns that can't stay unique through the partitioned table's own indexes,
+# which must include the partition key, and the plain key table that enforces them instead.
+# The application writes the key row in the same transaction as the row itself.
+GLOBAL_UNIQUE_KEYS = {
+    "payment_transactions": ("transaction_id", "payment_transaction_keys"),
+}
+
+_PARTITION_NAME = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})(?P<month>\d{2})$")
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _parse_month(value: Optional[str]) -> Optional[date]:
+    try:
+        return datetime.strptime(value[:7], "%Y-%m").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def partition_name(table: str, month: date) -> str:
+    """Name of the partition holding a table's rows for a month"""
+    return f"{table}_p{month:%Y%m}"
+
+
+class PartitionRepository:
+    """
+    Declarative monthly range partitions for code_generations and payment_transactions.
+    Only active on Postgres with DB_PARTITIONING enabled; other setups are left untouched.
+    """
+
+    @staticmethod
+    def enabled(engine: Engine) -> bool:
+        """Whether partitioning applies to this database"""
+        return Config.PARTITION.ENABLED and engine.dialect.name == "postgresql"
+
+    @staticmethod
+    def install(engine: Engine) -> None:
+        """
+        Convert the history tables to partitioned tables if they aren't yet,
+        then create upcoming partitions and apply retention.
+
+        Args:
+            engine: Database engine
+        """
+        if not PartitionRepository.enabled(engine):
+            return
+        with engine.begin() as conn:
+            # Serialize conversion between workers starting at the same time
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('partition_install'))"))
+            for table, column in PARTITIONED_TABLES.items():
+                if not PartitionRepository._is_partitioned(conn, table):
+                    PartitionRepository._convert(conn, table, column)
+        PartitionRepository.maintain(engine)
+
+    @staticmethod
+    def _is_partitioned(conn: Connection, table: str) -> bool:
+        return conn.execute(
+            text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+            {"table": table}
+        ).first() is not None
+
+    @staticmethod
+    def _create_partition(conn: Connection, table: str, column: str, month: date) -> bool:
+        """Create a month's partition if it doesn't exist; returns whether it was created"""
+        name = partition_name(table, month)
+        if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+            return False
+        try:
+            # A savepoint keeps one failed partition from aborting the rest of the run
+            with conn.begin_nested():
+                conn.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+                ))
+        except Exception as e:
+            # Usually rows for this month already sit in the default partition
+            logger.error(f"Error creating partition {name} for {table}.{column}: {str(e)}")
+            return False
+        return True
+
+    @staticmethod
+    def _convert(conn: Connection, table: str, column: str) -> None:
+        """
+        Rebuild a plain table as a partitioned one in a single transaction.
+        The table is locked for the copy, so run this in a maintenance window for large tables.
+        """
+        staging = f"{table}_partitioned"
+        first, last = conn.execute(text(f'SELECT min("{column}"), max("{column}") FROM {table}')).first()
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+
+        conn.execute(text(
+            f'CREATE TABLE {staging} (LIKE {table} INCLUDING DEFAULTS INCLUDING STORAGE) '
+            f'PARTITION BY RANGE ("{column}")'
+        ))
+        conn.execute(text(f"CREATE TABLE {staging}_default PARTITION OF {staging} DEFAULT"))
+        current = date.today().replace(day=1)
+        month = min(filter(None, [_parse_month(first), current]))
+        end = max(filter(None, [_parse_month(last), current]))
+        while month <= end:
+            PartitionRepository._create_partition(conn, staging, column, month)
+            month = _add_months(month, 1)
+
+        conn.execute(text(f"INSERT INTO {staging} SELECT * FROM {table}"))
+        if sequence:
+            # Keep the id sequence alive when the old table is dropped
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {staging}.id"))
+        conn.execute(text(f"DROP TABLE {table}"))
+        conn.execute(text(f"ALTER TABLE {staging} RENAME TO {table}"))
+        conn.execute(text(f"ALTER TABLE {staging}_default RENAME TO {table}_default"))
+        for name in conn.execute(
+            text("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                 "WHERE i.inhparent = to_regclass(:table)"),
+            {"table": table}
+        ).scalars().all():
+            if name.startswith(staging + "_p"):
+                conn.execute(text(f"ALTER TABLE {name} RENAME TO {table}{name[len(staging):]}"))
+
+        global_key = GLOBAL_UNIQUE_KEYS.get(table)
+        if global_key:
+            key_column, key_table = global_key
+            conn.execute(text(
+                f'INSERT INTO {key_table} ("{key_column}") SELECT "{key_column}" FROM {table} '
+                f'WHERE "{key_column}" IS NOT NULL ON CONFLICT DO NOTHING'
+            ))
+
+        # Unique constraints on a partitioned table must include the partition key
+        conn.execute(text(f'ALTER TABLE {table} ADD PRIMARY KEY (id, "{column}")'))
+        model_table = Base.metadata.tables[table]
+        for index in model_table.indexes:
+            names = [c.name for c in index.columns]
+            columns = [f'"{name}"' for name in names]
+            is_unique = index.unique
+            if is_unique and global_key and names == [global_key[0]]:
+                # The key table keeps it unique; a plain index still serves lookups
+                is_unique = False
+            elif is_unique and column not in names:
+                columns.append(f'"{column}"')
+            unique = "UNIQUE " if is_unique else ""
+            conn.execute(text(f"CREATE {unique}INDEX IF NOT EXISTS {index.name} ON {table} ({', '.join(columns)})"))
+        for foreign_key in model_table.foreign_keys:
+            conn.execute(text(
+                f'ALTER TABLE {table} ADD FOREIGN KEY ("{foreign_key.parent.name}") '
+                f'REFERENCES {foreign_key.column.table.name} ("{foreign_key.column.name}")'
+            ))
+        logger.info(f"Converted {table} to monthly partitions on {column}")
+
+    @staticmethod
+    def maintain(engine: Engine, today: Optional[date] = None) -> Dict[str, List[str]]:
+        """
+        Create partitions for the coming months and detach or drop expired ones.
+
+        Args:
+            engine: Database engine
+            today: Reference date (default: today)
+
+        Returns:
+            Names of created, detached and dropped partitions
+        """
+        result = {"created": [], "detached": [], "dropped": []}
+        if not PartitionRepository.enabled(engine):
+            return result
+
+        current = (today or date.today()).replace(day=1)
+        retention = Config.PARTITION.RETENTION_MONTHS
+        with engine.begin() as conn:
+            for table, column in PARTITIONED_TABLES.items():
+                if not PartitionRepository._is_partitioned(conn, table):
+                    continue
+                for offset in range(Config.PARTITION.MONTHS_AHEAD + 1):
+                    month = _add_months(current, offset)
+                    if PartitionRepository._create_partition(conn, table, column, month):
+                        result["created"].append(partition_name(table, month))
+
+                if not retention:
+                    continue
+                cutoff = _add_months(current, -retention)
+                for partition in PartitionRepository._partitions(conn, table):
+                    if partition["month"] is None or partition["month"] >= cutoff:
+                        continue
+                    name = partition["name"]
+                    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                    if Config.PARTITION.RETENTION_ACTION != "drop":
+                        result["detached"].append(name)
+                        continue
+                    PartitionRepository._drop_partition(conn, table, name)
+                    result["dropped"].append(name)
+
+        for action, names in result.items():
+            if names:
+                logger.info(f"Partitions {action}: {', '.join(names)}")
+        return result
+
+    @staticmethod
+    def maintain_in_background(engine: Engine) -> Optional[threading.Thread]:
+        """Run maintain() periodically on a daemon thread so upcoming partitions always exist"""
+        if not PartitionRepository.enabled(engine):
+            return None
+
+        def run():
+            while True:
+                time.sleep(Config.PARTITION.MAINTENANCE_INTERVAL_HOURS * 3600)
+                try:
+                    PartitionRepository.maintain(engine)
+                except Exception as e:
+                    logger.exception(f"Error maintaining partitions: {str(e)}")
+
+        thread = threading.Thread(target=run, daemon=True, name="partition-maintenance")
+        thread.start()
+        return thread
+
+    @staticmethod
+    def _drop_partition(conn: Connection, table: str, partition: str) -> None:
+        """Drop a detached partition, giving up the code blob references its rows held"""
+        if table == "code_generations":
+            conn.execute(text(f"""
+                UPDATE code_blobs b SET ref_count = b.ref_count - p.row_count
+                FROM (SELECT code_hash, count(*) AS row_count FROM {partition}
+                      WHERE code_hash IS NOT NULL GROUP BY code_hash) p
+                WHERE b.hash = p.code_hash
+            """))
+        conn.execute(text(f"DROP TABLE {partition}"))
+        if table == "code_generations":
+            conn.execute(text("DELETE FROM code_blobs WHERE ref_count <= 0"))
+
+    @staticmethod
+    def _partitions(conn: Connection, table: str) -> List[Dict[str, Any]]:
+        rows = conn.execute(
+            text("""
+                SELECT c.relname, c.reltuples::bigint
+                FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass(:table)
+                ORDER BY c.relname
+            """),
+            {"table": table}
+        ).all()
+        partitions = []
+        for name, estimated_rows in rows:
+            match = _PARTITION_NAME.match(name)
+            month = date(int(match["year"]), int(match["month"]), 1) if match and match["table"] == table else None
+            partitions.append({"name": name, "month": month, "estimated_rows": max(estimated_rows, 0)})
+        return partitions
+
+    @staticmethod
+    def list_partitions(engine: Engine) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        List the partitions of each partitioned table.
+
+        Args:
+            engine: Database engine
+
+        Returns:
+            Partitions per table with their month (None for the default partition) and estimated row count
+        """
+        if not PartitionRepository.enabled(engine):
+            return {}
+        with engine.connect() as conn:
+            return {
+                table: PartitionRepository._partitions(conn, table)
+                for table in PARTITIONED_TABLES
+                if PartitionRepository._is_partitioned(conn, table)
+            }
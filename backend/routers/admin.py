@@ -1,17 +1,30 @@
-from datetime import timedelta
-from typing import List, Dict, Any
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Literal, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from database import get_db
+from database import engine, get_db, get_read_db
 from models import User
 from schemas import User as UserSchema
 from schemas import ModelPricing, ModelPricingCreate, ModelPricingUpdate, UserUpdate, CodeGeneration, UserCreate, PaymentTransaction
+from schemas import PromptReuseSettings, PromptReuseStatus
 from core.security import get_current_admin_user
 from services.user_service import UserService
 from services.model_service import ModelService
 from services.code_history_service import CodeHistoryService
 from services.payment_service import PaymentService
+from services.export_service import ExportService, EXPORT_MEDIA_TYPES
+from services.archive_service import ArchiveService
+from services.prompt_similarity import PromptSimilarityIndex
+from services.mail_outbox import MailOutbox
+from services.payment_webhooks import PaymentWebhookInbox
+from services.payment_reconciler import PaymentReconciler
+from services.generation_scheduler import GenerationScheduler
+from services.api_clients import GoogleApiClient, OpenAIApiClient
+from core.dependency_injection import DIContainer
+from repositories.code_blob_repository import CodeBlobRepository
+from repositories.partition_repository import PartitionRepository
 
 router = APIRouter(
     prefix="/admin",
@@ -28,7 +41,7 @@ router = APIRouter(
 def get_all_users(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     """Get all users (admin only)"""
@@ -37,7 +50,7 @@ def get_all_users(
 
 @router.get("/users/count", response_model=dict)
 def get_all_users_count(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     """Get the count of all users (admin only)"""
@@ -48,7 +61,7 @@ def get_all_users_count(
 @router.get("/users/{user_id}", response_model=UserSchema)
 def get_user_by_id(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     """Get user details by ID (admin only)"""
@@ -144,48 +157,229 @@ def delete_model(
 def get_all_code_history(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     """Get all code generation history across all users (admin only)"""
-    return CodeHistoryService.get_all_code_history(db, skip, limit)
+    return CodeHistoryService.get_all_code_history(db, skip, limit, start, end)
 
 
 @router.get("/code-history/count", response_model=dict)
 def get_all_code_history_count(
-    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     """Get the count of all code generation history (admin only)"""
-    count = CodeHistoryService.get_all_code_history_count(db)
+    count = CodeHistoryService.get_all_code_history_count(db, start, end)
     return {"count": count}
 
 
+@router.post("/archive/code-history", response_model=dict)
+def archive_code_history(
+    older_than_days: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Move old code generations into compressed archive segments (admin only)"""
+    return ArchiveService.archive_old_generations(db, older_than_days)
+
+
+@router.post("/code-blobs/migrate", response_model=dict)
+def migrate_code_blobs(
+    db: Session = Depends(get_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Move inline generated code of existing rows into deduplicated blobs (admin only)"""
+    migrated = CodeBlobRepository(db).migrate_legacy_rows()
+    return {"migrated": migrated}
+
+
+@router.get("/code-blobs/statistics", response_model=Dict[str, Any])
+def get_code_blob_statistics(
+    db: Session = Depends(get_read_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Get deduplicated code storage statistics (admin only)"""
+    return CodeBlobRepository(db).get_statistics()
+
+
+# Mail outbox endpoints
+@router.get("/mail-outbox/statistics", response_model=Dict[str, Any])
+def get_mail_outbox_statistics(
+    db: Session = Depends(get_read_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Get outbox backlog and mail delivery throughput and latency (admin only)"""
+    return MailOutbox.get_statistics(db)
+
+
+# Payment webhook inbox endpoints
+@router.get("/payment-webhooks/statistics", response_model=Dict[str, Any])
+def get_payment_webhook_statistics(
+    db: Session = Depends(get_read_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Get webhook inbox backlog and processing latency (admin only)"""
+    return PaymentWebhookInbox.get_statistics(db)
+
+
+@router.post("/payment-webhooks/requeue-failed", response_model=Dict[str, int])
+def requeue_failed_payment_webhooks(
+    db: Session = Depends(get_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Retry webhook events that ran out of attempts (admin only)"""
+    return {"requeued": PaymentWebhookInbox.requeue_failed(db)}
+
+
+@router.get("/generation-scheduler/statistics", response_model=Dict[str, Any])
+def get_generation_scheduler_statistics(
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Get generation queue lengths and queue-wait percentiles per user tier (admin only)"""
+    return DIContainer.get_instance(GenerationScheduler).statistics()
+
+
+@router.get("/ai-providers/statistics", response_model=Dict[str, Any])
+def get_ai_provider_statistics(
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Get AI provider call counts, including calls abandoned on timeout or disconnect (admin only)"""
+    return {
+        "google": DIContainer.get_instance(GoogleApiClient).statistics(),
+        "openai": DIContainer.get_instance(OpenAIApiClient).statistics(),
+    }
+
+
+# Payment reconciliation endpoints
+@router.get("/payment-reconciliation", response_model=Dict[str, Any])
+def get_payment_reconciliation(
+    db: Session = Depends(get_read_db),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Get the current reconciliation backlog and the figures of the last sweep (admin only)"""
+    reconciler = DIContainer.get_instance(PaymentReconciler)
+    return {"backlog": reconciler.backlog(db), **reconciler.status()}
+
+
+@router.post("/payment-reconciliation/sweep", response_model=Dict[str, Any])
+def run_payment_reconciliation(
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Reconcile stale pending payments with PayOS now (admin only)"""
+    return DIContainer.get_instance(PaymentReconciler).sweep()
+
+
+# Partition endpoints
+@router.get("/partitions", response_model=Dict[str, Any])
+def get_partitions(
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """List the monthly partitions of the history tables (admin only)"""
+    return PartitionRepository.list_partitions(engine)
+
+
+@router.post("/partitions/maintain", response_model=Dict[str, Any])
+def maintain_partitions(
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Create upcoming partitions and detach or drop expired ones now (admin only)"""
+    return PartitionRepository.maintain(engine)
+
+
+# Prompt reuse endpoints
+@router.get("/prompt-reuse", response_model=PromptReuseStatus)
+def get_prompt_reuse_settings(
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Get the near-duplicate prompt reuse settings (admin only)"""
+    return DIContainer.get_instance(PromptSimilarityIndex).status()
+
+
+@router.put("/prompt-reuse", response_model=PromptReuseStatus)
+def update_prompt_reuse_settings(
+    settings: PromptReuseSettings,
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Update the near-duplicate prompt reuse settings (admin only)"""
+    prompt_index = DIContainer.get_instance(PromptSimilarityIndex)
+    prompt_index.update_settings(settings.enabled, settings.threshold, settings.credit_ratio,
+                                 settings.share_across_users)
+    return prompt_index.status()
+
+
+# Export endpoints
+@router.get("/export/code-history")
+def export_code_history(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    user_id: Optional[int] = None,
+    model_name: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Stream code generation history as NDJSON or CSV (admin only)"""
+    return StreamingResponse(
+        ExportService.stream_code_history(
+            format, user_id=user_id, model_name=model_name, start=start, end=end
+        ),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="code-history.{format}"'}
+    )
+
+
+@router.get("/export/payments")
+def export_payments(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    user_id: Optional[int] = None,
+    status: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Stream payment transactions as NDJSON or CSV (admin only)"""
+    return StreamingResponse(
+        ExportService.stream_payments(
+            format, user_id=user_id, status=status, start=start, end=end
+        ),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="payments.{format}"'}
+    )
+
+
 # Payment transaction endpoints
 @router.get("/payment-transactions", response_model=List[PaymentTransaction])
 def get_all_payment_transactions(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     """Lấy tất cả các giao dịch thanh toán (chỉ admin)"""
-    return PaymentService.get_all_payment_transactions(db, skip, limit)
+    return PaymentService.get_all_payment_transactions(db, skip, limit, start, end)
 
 
 @router.get("/payment-transactions/count", response_model=dict)
 def get_all_payment_transactions_count(
-    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     """Get the count of all payment transactions (admin only)"""
-    count = PaymentService.get_all_payment_transactions_count(db)
+    count = PaymentService.get_all_payment_transactions_count(db, start, end)
     return {"count": count}
 
 
 @router.get("/payment-statistics", response_model=Dict[str, Any])
 def get_payment_statistics(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     """Lấy thống kê tổng quan về các giao dịch thanh toán (chỉ admin)"""
@@ -214,8 +408,10 @@ def get_user_payment_transactions(
     user_id: int,
     skip: int = 0, 
     limit: int = 100,
-    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
     current_admin: User = Depends(get_current_admin_user)
 ):
     """Lấy lịch sử giao dịch của một người dùng cụ thể (chỉ admin)"""
-    return PaymentService.get_user_payment_transactions(db, user_id, skip, limit)
\ No newline at end of file
+    return PaymentService.get_user_payment_transactions(db, user_id, skip, limit, start, end)
\ No newline at end of file
@@ -2,7 +2,6 @@ from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from fastapi import BackgroundTasks
 
 from database import get_db
 from models import User  # Đảm bảo import User từ models, không phải từ schemas
@@ -46,8 +45,9 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # The tier is set at login; the rate limiter looks up the current one and only falls back to this
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "tier": UserService.get_tier(db, user)}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -83,9 +83,9 @@ def create_admin_user(
     )
 
 @router.post("/forgot-password")
-def forgot_password(request: ForgotPasswordRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def forgot_password(request: ForgotPasswordRequest, db: Session = Depends(get_db)):
     """Nhận email, tạo token và gửi email reset password"""
-    UserService.forgot_password(db, request.email, background_tasks)
+    UserService.forgot_password(db, request.email)
     return {"message": "Nếu email tồn tại, hướng dẫn đặt lại mật khẩu đã được gửi."}
 
 @router.post("/reset-password")
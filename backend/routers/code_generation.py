@@ -1,16 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import math
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request, Response
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from database import get_db
-from models import User
-from schemas import CodeGenerationCreate, CodeGeneration, CodeGenerationByUsername
+from database import get_db, get_read_db
+from models import User, CodeGeneration as CodeGenerationModel
+from schemas import CodeGenerationCreate, CodeGeneration, CodeGenerationByUsername, CodeSearchResult
 from core.security import get_current_active_user
+from core.deadline import Deadline, DeadlineExceeded, RequestCancelled, request_deadline, run_until_disconnected
 from services.code_generation_service import CodeGenerationService
 from services.code_history_service import CodeHistoryService
+from services.archive_service import ArchiveService
+from services.generation_scheduler import GenerationBusyError, GenerationScheduler
 from repositories.user_repository import UserRepository
 from repositories.code_repository import CodeGenerationRepository
+from repositories.code_search_repository import CodeSearchRepository
 from core.dependency_injection import DIContainer
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
 router = APIRouter(
     prefix="/code",
@@ -19,22 +26,37 @@ router = APIRouter(
 )
 
 
-@router.post("/generate-code", response_model=CodeGeneration)
-def generate_code(
-    code_request: CodeGenerationCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
-):
-    """Generate code based on a prompt using the specified model"""
+def _busy(e: GenerationBusyError) -> HTTPException:
+    """503 for a request the AI providers are too busy to take; no credits were charged"""
+    return HTTPException(
+        status_code=503,
+        detail="Code generation is busy, please retry later",
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
+
+async def _process_generation_request(request: Request, db: Session, deadline: Deadline, **kwargs) -> CodeGenerationModel:
+    """
+    Run a generation request on the scheduler's threads, cancelling it if the client disconnects,
+    and turn the ways it can fail into HTTP errors
+    """
     # Get service instance using DI
     code_gen_service = CodeGenerationService.get_instance(db)
+    # Queued requests block their thread; keep them off the threadpool the other endpoints share
+    scheduler = DIContainer.get_instance(GenerationScheduler)
     
-    code_gen = code_gen_service.process_generation_request(
-        user_id=current_user.id,
-        model_name=code_request.model_name,
-        prompt=code_request.prompt,
-        language=code_request.language
-    )
+    try:
+        code_gen = await run_until_disconnected(
+            request, deadline, code_gen_service.process_generation_request,
+            limiter=scheduler.thread_limiter, deadline=deadline, **kwargs
+        )
+    except GenerationBusyError as e:
+        raise _busy(e)
+    except RequestCancelled:
+        # Nobody receives this response; the status is for the access log
+        raise HTTPException(status_code=499, detail="Client closed the request")
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Code generation did not finish within the request deadline")
     
     if code_gen is None:
         raise HTTPException(
@@ -45,17 +67,39 @@ def generate_code(
     return code_gen
 
 
+@router.post("/generate-code", response_model=CodeGeneration)
+async def generate_code(
+    request: Request,
+    code_request: CodeGenerationCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+    deadline: Deadline = Depends(request_deadline)
+):
+    """Generate code based on a prompt using the specified model"""
+    return await _process_generation_request(
+        request, db, deadline,
+        user_id=current_user.id,
+        model_name=code_request.model_name,
+        prompt=code_request.prompt,
+        language=code_request.language,
+        allow_reuse=code_request.allow_reuse
+    )
+
+
 @router.post("/completion")
-def generate_code_by_username(
+async def generate_code_by_username(
+    request: Request,
+    response: Response,
     code_request: CodeGenerationByUsername,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    deadline: Deadline = Depends(request_deadline)
 ):
     """Generate code based on a prompt using the specified model and username for authentication"""
     # Initialize repositories
     user_repository = UserRepository(db)
     
     # Get user by username
-    user = user_repository.get_by_username(code_request.username)
+    user = await run_in_threadpool(user_repository.get_by_username, code_request.username)
     
     if not user:
         raise HTTPException(
@@ -63,22 +107,17 @@ def generate_code_by_username(
             detail="User not found"
         )
     
-    # Get service instance using DI
-    code_gen_service = CodeGenerationService.get_instance(db)
-    
-    code_gen = code_gen_service.process_generation_request(
+    code_gen = await _process_generation_request(
+        request, db, deadline,
         user_id=user.id,
         model_name=code_request.model_name,
         prompt=code_request.prompt,
-        language=code_request.language
+        language=code_request.language,
+        allow_reuse=code_request.allow_reuse
     )
-    
-    if code_gen is None:
-        raise HTTPException(
-            status_code=400,
-            detail="Code generation failed. Please check your credits and model name."
-        )
-    
+    # Only the code is returned, so say in a header when it's a stored result
+    if code_gen.reused_from is not None:
+        response.headers["X-Reused-From"] = str(code_gen.reused_from)
     return code_gen.generated_code
 
 
@@ -86,22 +125,53 @@ def generate_code_by_username(
 def get_code_generation_history(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get the code generation history for the current user with pagination"""
     # Initialize repository
     code_repository = CodeGenerationRepository(db)
-    return code_repository.get_by_user_id(current_user.id, skip, limit)
+    return code_repository.get_by_user_id(current_user.id, skip, limit, start, end)
 
 
 @router.get("/history/count", response_model=dict)
 def get_code_generation_history_count(
-    db: Session = Depends(get_db),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get the total count of code generation history items for the current user"""
     # Initialize repository
     code_repository = CodeGenerationRepository(db)
-    count = code_repository.count_by_user_id(current_user.id)
-    return {"count": count}
\ No newline at end of file
+    count = code_repository.count_by_user_id(current_user.id, start, end)
+    return {"count": count}
+
+
+@router.get("/history/search", response_model=List[CodeSearchResult])
+def search_code_generation_history(
+    q: str = Query(..., min_length=1),
+    skip: int = 0,
+    limit: int = Query(20, le=100),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Search the current user's code generation history by prompt and code, best matches first"""
+    search_repository = CodeSearchRepository(db)
+    return search_repository.search(current_user.id, q, skip, limit)
+
+
+
+@router.get("/history/{code_gen_id}", response_model=CodeGeneration)
+def get_code_generation_detail(
+    code_gen_id: int,
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Get a single code generation of the current user, including archived ones"""
+    code_gen = ArchiveService.get_generation(db, code_gen_id)
+    if code_gen is None or code_gen.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Code generation not found")
+    return code_gen
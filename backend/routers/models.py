@@ -2,7 +2,7 @@ from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
-from database import get_db
+from database import get_db, get_read_db
 from models import User
 from schemas import ModelPricing, ModelPricingCreate, ModelPricingUpdate
 from core.security import get_current_active_user
@@ -17,7 +17,7 @@ router = APIRouter(
 
 @router.get("/", response_model=List[ModelPricing])
 def get_all_models(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all available models"""
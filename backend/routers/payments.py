@@ -1,12 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+import base64
+import hashlib
+import logging
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
-from database import get_db
-from schemas import PaymentCreate, PaymentResponse, PaymentTransaction as PaymentTransactionSchema, PaymentVerify
+from database import SessionLocal, get_db, get_read_db
+from schemas import PaymentCreate, PaymentResponse, PaymentTransaction as PaymentTransactionSchema, PaymentVerify, PaymentStatus
 from models import PaymentTransaction
 from core.security import get_current_user, get_user_id_from_token
+from core.dependency_injection import DIContainer
 from services.payment_service import PaymentService
+from services.qr_renderer import QRRenderer
+from services.payment_webhooks import PaymentWebhookInbox
 
 router = APIRouter(
     prefix="/payment",
@@ -76,41 +86,144 @@ def verify_payment(
         )
 
 
+def _get_own_transaction(db: Session, transaction_id: str, user_id: int) -> PaymentTransaction:
+    transaction = db.query(PaymentTransaction).filter(
+        PaymentTransaction.transaction_id == transaction_id
+    ).first()
+    if not transaction or transaction.user_id != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Không tìm thấy giao dịch")
+    return transaction
+
+
+@router.get("/status/{transaction_id}", response_model=PaymentStatus)
+def get_payment_status(
+    transaction_id: str,
+    db: Session = Depends(get_db),
+    current_user_id: int = Depends(get_user_id_from_token)
+):
+    """
+    Lấy trạng thái giao dịch từ DB (chỉ hỏi PayOS khi trạng thái đã cũ)
+    """
+    _get_own_transaction(db, transaction_id, current_user_id)
+    try:
+        return PaymentService.refresh_status(db, transaction_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Lỗi khi kiểm tra trạng thái thanh toán: {str(e)}"
+        )
+
+
+@router.get("/status/{transaction_id}/events")
+async def stream_payment_status(
+    transaction_id: str,
+    current_user_id: int = Depends(get_user_id_from_token)
+):
+    """
+    Server-sent events: gửi trạng thái giao dịch ngay khi webhook cập nhật, thay cho polling
+    """
+    def check_ownership():
+        with SessionLocal() as db:
+            _get_own_transaction(db, transaction_id, current_user_id)
+
+    await run_in_threadpool(check_ownership)
+    return StreamingResponse(
+        PaymentService.stream_status(transaction_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/qr/{transaction_id}")
+def get_payment_qr(
+    transaction_id: str,
+    db: Session = Depends(get_read_db),
+    current_user_id: int = Depends(get_user_id_from_token)
+):
+    """
+    Ảnh mã QR của link thanh toán, cho trường hợp /create trả về khi QR chưa render xong
+    """
+    transaction = _get_own_transaction(db, transaction_id, current_user_id)
+    if not transaction.checkout_url:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Giao dịch không có link thanh toán")
+    renderer = DIContainer.get_instance(QRRenderer)
+    try:
+        image = renderer.render(transaction.checkout_url)
+    except Exception as e:
+        logging.error(f"Lỗi khi render mã QR cho giao dịch {transaction_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Chưa tạo được mã QR, vui lòng thử lại",
+            headers={"Retry-After": "1"}
+        )
+    return Response(
+        content=base64.b64decode(image),
+        media_type=renderer.media_type,
+        headers={"Cache-Control": "private, max-age=86400"}
+    )
+
+
 @router.get("/history", response_model=List[PaymentTransactionSchema])
 def get_payment_history(
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_read_db),
     current_user_id: int = Depends(get_user_id_from_token)
 ):
     """
-    Lấy lịch sử thanh toán của người dùng hiện tại
+    Lấy lịch sử thanh toán của người dùng hiện tại, mới nhất trước.
+    Trang sau được lấy bằng cursor trong header X-Next-Cursor. ETag đổi khi có giao dịch
+    mới hoặc giao dịch đổi trạng thái, nên client gửi If-None-Match sẽ thường nhận 304.
     """
-    transactions = db.query(PaymentTransaction).filter(
-        PaymentTransaction.user_id == current_user_id
-    ).all()
+    version = PaymentService.get_user_payment_history_version(db, current_user_id)
+    digest = hashlib.sha1(f"{current_user_id}|{version}|{request.url.query}".encode()).hexdigest()
+    etag = f'W/"{digest}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
     
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+    
+    try:
+        transactions, next_cursor = PaymentService.get_user_payment_history_page(
+            db, current_user_id, limit, cursor, skip, start, end
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    response.headers.update(cache_headers)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return transactions
 
 
 @router.post("/webhook")
-async def payment_webhook(
-    request: Request,
+def payment_webhook(
+    webhook_data: dict = Body(...),
     db: Session = Depends(get_db)
 ):
     """
-    Endpoint nhận các thông báo webhook từ PayOS khi có cập nhật trạng thái thanh toán
+    Endpoint nhận các thông báo webhook từ PayOS khi có cập nhật trạng thái thanh toán.
+    Chỉ xác minh chữ ký và lưu sự kiện rồi trả lời ngay; worker nền sẽ cập nhật giao dịch.
+    Chỉ xác nhận khi sự kiện đã được commit; lỗi lưu trả về 5xx để PayOS gửi lại.
     """
     try:
-        # Đọc dữ liệu webhook từ body request
-        webhook_data = await request.json()
-        
-        # Xử lý dữ liệu webhook
-        result = PaymentService.process_webhook(db, webhook_data)
-        
-        if result:
-            return {"status": "success", "message": "Webhook processed successfully"}
-        else:
-            return {"status": "error", "message": "Failed to process webhook"}
+        # Sự kiện trùng (PayOS gửi lại) cũng được xác nhận thành công
+        PaymentWebhookInbox.receive(db, webhook_data)
+        return {"status": "success", "message": "Webhook received"}
+    except ValueError as e:
+        # Chữ ký sai: gửi lại cũng không hợp lệ hơn
+        logging.warning(f"Webhook bị từ chối: {str(e)}")
+        return {"status": "error", "message": "Invalid webhook"}
     except Exception as e:
-        import logging
-        logging.error(f"Lỗi khi xử lý webhook: {str(e)}")
-        return {"status": "error", "message": f"Error processing webhook: {str(e)}"}
\ No newline at end of file
+        db.rollback()
+        logging.error(f"Lỗi khi lưu webhook: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Webhook could not be stored, please retry"
+        )
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
-from database import get_db
+from database import get_read_db
 from schemas import User
 from core.security import get_current_active_user
 from services.user_service import UserService
@@ -29,7 +29,7 @@ async def read_user_credits(current_user: User = Depends(get_current_active_user
 @router.get("/me/referrals")
 async def read_user_referrals(
     current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get referral statistics for current user"""
     # Get users who used this user's referral code
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional
 from datetime import datetime
 
@@ -70,7 +70,12 @@ class CodeGenerationBase(BaseModel):
     language: Optional[str] = None  # Optional language parameter, defaults to None (will use C++ if not specified)
 
 
-class CodeGenerationCreate(CodeGenerationBase):
+class CodeGenerationRequest(CodeGenerationBase):
+    # Accept a stored result for a near-identical earlier prompt, when prompt reuse is on
+    allow_reuse: bool = True
+
+
+class CodeGenerationCreate(CodeGenerationRequest):
     pass
 
 
@@ -82,7 +87,7 @@ class CodeGenerationUpdate(BaseModel):
     language: Optional[str] = None
 
 
-class CodeGenerationByUsername(CodeGenerationBase):
+class CodeGenerationByUsername(CodeGenerationRequest):
     username: str
 
 
@@ -92,11 +97,34 @@ class CodeGeneration(CodeGenerationBase):
     generated_code: Optional[str] = None
     credits_used: float
     timestamp: str
+    reused_from: Optional[int] = None  # Generation whose stored code this is, instead of a new generation
 
     class Config:
         from_attributes = True
 
 
+class CodeSearchResult(BaseModel):
+    id: int
+    model_name: str
+    prompt: str
+    snippet: str  # Matching excerpt with terms wrapped in <mark> tags
+    rank: float  # Higher is more relevant
+    credits_used: float
+    timestamp: str
+
+
+class PromptReuseSettings(BaseModel):
+    enabled: bool
+    threshold: float = Field(..., ge=0, le=1)  # Minimum estimated prompt similarity
+    credit_ratio: float = Field(..., ge=0, le=1)  # Fraction of the model cost charged on reuse
+    share_across_users: bool = False  # Whether a user may be given another user's stored code
+
+
+class PromptReuseStatus(PromptReuseSettings):
+    ready: bool  # Whether the index has finished loading history
+    indexed_prompts: int
+
+
 # Token schemas
 class Token(BaseModel):
     access_token: str
@@ -114,12 +142,19 @@ class PaymentCreate(BaseModel):
 
 class PaymentResponse(BaseModel):
     checkout_url: str  # URL to redirect user for payment
-    qr_code: str  # Base64 encoded QR code image
+    qr_code: Optional[str] = None  # Base64 encoded QR code image; None if it wasn't ready in time
+    qr_code_url: str  # Path of the QR code image, for when qr_code is None
     transaction_id: str  # PayOS transaction ID
     amount: int  # Amount in VND
     credits: int  # Number of credits purchased
 
 
+class PaymentStatus(BaseModel):
+    transaction_id: str
+    status: str  # pending, completed, failed
+    completed_at: Optional[str] = None
+
+
 class PaymentTransaction(BaseModel):
     id: int
     user_id: int
@@ -0,0 +1,102 @@
+"""
+Benchmark the per-request setup of Gemini model handles.
+
+Compares what each attempt used to do (genai.configure() with the attempt's
+key, a new GenerativeModel and the new default async client and gRPC channel
+generate_content_async then builds) with looking the handle up in
+GeminiModelCache, rotating through several keys the way the key manager does.
+Setup runs on an event loop thread, as provider calls do.
+
+With --live, also times real generate_content calls both ways using the keys
+from GOOGLE_API_KEYS; a fresh channel pays a new TCP and TLS handshake on
+every call, which a cached one doesn't.
+
+Usage (from the backend directory):
+    python -m scripts.bench_gemini_model_handles --iterations 500 --keys 4
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from typing import Callable, List, Optional
+
+
+def _summary(samples: List[float]) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"mean {statistics.mean(samples) * 1000:8.3f}ms  p50 {statistics.median(samples) * 1000:8.3f}ms  p95 {p95 * 1000:8.3f}ms"
+
+
+async def _time(iterations: int, keys: List[str], setup: Callable) -> List[float]:
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        await setup(keys[i % len(keys)])
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def _run(args) -> bool:
+    import google.generativeai as genai
+    from google.generativeai import client as genai_client
+    from config import Config
+    from services.api_clients.google_client import GeminiModelCache
+
+    live = args.live
+    keys = list(Config.AI.GOOGLE_API_KEYS) if live else [f"bench-key-{i}" for i in range(args.keys)]
+    if not keys:
+        print("No keys in GOOGLE_API_KEYS for --live")
+        return False
+    messages = ["Reply with the single word: ok"]
+    channels = []
+
+    async def per_call(api_key):
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel(args.model)
+        model._async_client = genai_client.get_default_generative_async_client()
+        channels.append(model._async_client.transport)
+        if live:
+            await model.generate_content_async(messages, request_options={"timeout": 30})
+
+    cache = GeminiModelCache()
+
+    async def cached(api_key):
+        model = cache.get(api_key, args.model)
+        if live:
+            await model.generate_content_async(messages, request_options={"timeout": 30})
+
+    iterations = args.iterations if not live else min(args.iterations, 20)
+    await _time(min(iterations, 10), keys, cached)  # Fill the cache, as warm_up() does at startup
+    before = await _time(iterations, keys, per_call)
+    after = await _time(iterations, keys, cached)
+    for transport in channels:
+        await transport.close()
+    await cache.close()
+
+    label = "call" if live else "setup"
+    print(f"{iterations} {'calls' if live else 'attempts'} rotating over {len(keys)} keys, model {args.model}")
+    print(f"per-call {label}:  {_summary(before)}  ({len(set(map(id, channels)))} channels created)")
+    print(f"cached {label}:    {_summary(after)}  ({len(keys)} channels, kept open)")
+    saved = statistics.mean(before) - statistics.mean(after)
+    print(f"saved per attempt: {saved * 1000:.3f}ms ({statistics.mean(before) / max(statistics.mean(after), 1e-9):.0f}x)")
+    return saved > 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark per-call Gemini client setup against cached model handles")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--keys", type=int, default=4, help="Fake API keys to rotate through (ignored with --live)")
+    parser.add_argument("--model", default="gemini-2.0-flash")
+    parser.add_argument("--live", action="store_true", help="Also send real requests with GOOGLE_API_KEYS (at most 20)")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    ok = asyncio.run(_run(args))
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
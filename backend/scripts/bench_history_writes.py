@@ -0,0 +1,146 @@
+"""
+Benchmark code history write throughput with and without write-behind batching.
+
+Writes the same records from several threads, as concurrent requests would,
+into a scratch database:
+    sync    CodeGenerationRepository.create_generation, one INSERT and commit per record
+    batched HistoryWriteBehindBuffer.submit, flushed as multi-row INSERTs
+and reports records/s and per-call latency on the request path. For the
+batched run, the time until every record is actually stored is reported too.
+
+Usage (from the backend directory):
+    python -m scripts.bench_history_writes --records 5000 --threads 8
+    python -m scripts.bench_history_writes --database-url postgresql://user:pw@localhost/bench
+
+Records are added to, never removed from, the given database; use a scratch one.
+"""
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+def _record(i: int) -> dict:
+    return {
+        "user_id": 1,
+        "model_name": "gemini-2.0-flash",
+        "prompt": f"Given an array of {i} integers, print the maximum subarray sum",
+        # A few distinct programs, as repeated problems produce
+        "generated_code": f"int main() {{ return {i % 50}; }}",
+        "credits_used": 1.0,
+        "language": "cpp",
+    }
+
+
+def _run_threads(records: int, threads: int, write: Callable[[dict], None]) -> List[float]:
+    """Call write() for every record from `threads` threads; returns each call's latency"""
+    samples: List[float] = []
+    lock = threading.Lock()
+    counter = iter(range(records))
+
+    def worker():
+        local = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            started = time.perf_counter()
+            write(_record(i))
+            local.append(time.perf_counter() - started)
+        with lock:
+            samples.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return samples
+
+
+def _report(name: str, records: int, elapsed: float, samples: List[float], extra: str = "") -> float:
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{name:8} {records / elapsed:9.0f} records/s  call p50 {statistics.median(ordered) * 1000:7.3f}ms  "
+          f"p99 {p99 * 1000:7.3f}ms{extra}")
+    return records / elapsed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark history writes with and without write-behind batching")
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--flush-interval-ms", type=int, default=200)
+    parser.add_argument("--database-url", help="Scratch database (default: a temporary SQLite file)")
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import create_engine, func
+    from sqlalchemy.orm import sessionmaker
+    from database import Base
+    from models import CodeGeneration
+    from repositories.code_repository import CodeGenerationRepository
+    from services.history_writer import HistoryWriteBehindBuffer
+
+    logging.disable(logging.INFO)
+    workdir = tempfile.mkdtemp(prefix="history-bench-")
+    url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 60} if url.startswith("sqlite") else {})
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+    def stored() -> int:
+        db = session_factory()
+        try:
+            return db.query(func.count(CodeGeneration.id)).scalar()
+        finally:
+            db.close()
+
+    try:
+        def sync_write(record):
+            db = session_factory()
+            try:
+                CodeGenerationRepository(db).create_generation(**record)
+            finally:
+                db.close()
+
+        started = time.perf_counter()
+        samples = _run_threads(args.records, args.threads, sync_write)
+        sync_rate = _report("sync", args.records, time.perf_counter() - started, samples)
+
+        buffer = HistoryWriteBehindBuffer(
+            session_factory, spill_dir=os.path.join(workdir, "spill"), batch_size=args.batch_size,
+            flush_interval_ms=args.flush_interval_ms, max_queue_size=args.records + 1,
+        )
+        buffer.start()
+        before = stored()
+        started = time.perf_counter()
+        samples = _run_threads(args.records, args.threads, lambda record: buffer.submit(**record))
+        queued = time.perf_counter() - started
+        buffer.close()
+        durable = time.perf_counter() - started
+        written = stored() - before
+        batched_rate = _report("batched", args.records, durable, samples,
+                               f"  (queued in {queued:.2f}s, stored in {durable:.2f}s)")
+    finally:
+        engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.records} records from {args.threads} threads on {engine.dialect.name}, "
+          f"batch size {args.batch_size}; batching is {batched_rate / sync_rate:.1f}x the sync throughput")
+    ok = written == args.records
+    if not ok:
+        print(f"Only {written} of {args.records} batched records were stored")
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Benchmark mail delivery through the outbox.
+
+Starts an aiosmtpd server on localhost, points the outbox at it without
+STARTTLS or login, enqueues --mails mails with MailOutbox.enqueue as the
+password-reset route does and runs the MailWorker on an event loop until every
+mail is sent. Reports throughput while sending, throughput from the first
+enqueue to the last delivery, the enqueue-to-send latency of each mail
+(from the created_at and sent_at the outbox stores) and how many SMTP sessions
+the server saw.
+
+Usage (from the backend directory):
+    python -m scripts.bench_mail_outbox --mails 204 --batch-size 50
+
+Needs aiosmtpd (pip install -r requirements-dev.txt). Passes if every mail was
+delivered, over a single SMTP session, at --min-rate mails/s or more.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+
+class _CountingHandler:
+    """aiosmtpd handler that accepts every mail and counts mails and sessions"""
+
+    def __init__(self):
+        self.delivered = 0
+        self.sessions = set()
+        self.lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.lock:
+            self.delivered += 1
+            self.sessions.add(id(session))
+        return "250 Message accepted for delivery"
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def _deliver(worker, mails: int, timeout: float) -> float:
+    """Enqueue the mails while the worker runs; returns seconds from the first enqueue to the last delivery"""
+    from database import SessionLocal
+    from services.mail_outbox import MailOutbox
+
+    def enqueue_all():
+        db = SessionLocal()
+        try:
+            for i in range(mails):
+                MailOutbox.enqueue(db, f"user-{i}@example.com", f"Reset your password ({i})",
+                                   f"Use this link to reset your password: https://example.com/reset/{i}")
+        finally:
+            db.close()
+
+    worker.start()
+    try:
+        started = time.monotonic()
+        await asyncio.to_thread(enqueue_all)
+        deadline = started + timeout
+        while worker.sent + worker.failed_attempts < mails and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        return time.monotonic() - started
+    finally:
+        await worker.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark outbox mail delivery against a local SMTP server")
+    parser.add_argument("--mails", type=int, default=204, help="Mails to enqueue")
+    parser.add_argument("--batch-size", type=int, default=50, help="Mails per worker batch (EMAIL_OUTBOX_BATCH_SIZE)")
+    parser.add_argument("--min-rate", type=float, default=50.0, help="Fail below this many mails/s while sending")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Give up after this many seconds")
+    args = parser.parse_args(argv)
+
+    from aiosmtpd.controller import Controller
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    handler = _CountingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+
+    workdir = tempfile.mkdtemp(prefix="mail-bench-")
+    # Config is read at import, so the scratch settings must be in place first
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'app.db')}",
+        DATABASE_REPLICA_URLS="",
+        EMAIL_SMTP_SERVER="127.0.0.1",
+        EMAIL_SMTP_PORT=str(port),
+        EMAIL_SMTP_USER="",
+        EMAIL_SMTP_STARTTLS="false",
+        EMAIL_FROM_ADDRESS="bench@example.com",
+        EMAIL_OUTBOX_BATCH_SIZE=str(args.batch_size),
+    )
+    # Required at startup; no request reaches PayOS or the AI providers
+    for name in ("SECRET_KEY", "GOOGLE_API_KEYS", "PAYOS_CLIENT_ID", "PAYOS_API_KEY", "PAYOS_CHECKSUM_KEY"):
+        os.environ.setdefault(name, "mail-bench")
+    logging.disable(logging.WARNING)
+
+    import models
+    from core.dependency_injection import DIContainer
+    from database import SessionLocal, engine
+    from services.mail_outbox import MailWorker
+
+    models.Base.metadata.create_all(engine)
+    worker = DIContainer.get_instance(MailWorker)
+    controller.start()
+    try:
+        elapsed = asyncio.run(_deliver(worker, args.mails, args.timeout))
+        db = SessionLocal()
+        try:
+            sent = db.query(models.EmailOutbox).filter(models.EmailOutbox.status == "sent").all()
+            latencies = sorted(
+                (datetime.fromisoformat(mail.sent_at) - datetime.fromisoformat(mail.created_at)).total_seconds()
+                for mail in sent
+            )
+        finally:
+            db.close()
+    finally:
+        controller.stop()
+        engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    status = worker.status()
+    print(f"{args.mails} mails enqueued, {len(latencies)} sent, {status['failed_attempts']} failed attempts, "
+          f"batch size {args.batch_size}")
+    print(f"server received {handler.delivered} mails over {len(handler.sessions)} SMTP sessions, "
+          f"worker opened {status['connections_opened']} connections")
+    print(f"sending    {status['mails_per_second']:7.1f} mails/s")
+    print(f"end to end {len(latencies) / elapsed if elapsed else 0.0:7.1f} mails/s "
+          f"({elapsed:.2f}s from first enqueue to last delivery)")
+    if latencies:
+        print(f"enqueue-to-send latency p50 {statistics.median(latencies) * 1000:7.1f}ms  "
+              f"p99 {_percentile(latencies, 0.99) * 1000:7.1f}ms  max {latencies[-1] * 1000:7.1f}ms")
+
+    ok = (len(latencies) == args.mails and handler.delivered == args.mails
+          and len(handler.sessions) == 1 and status["mails_per_second"] >= args.min_rate)
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Benchmark OpenAI calls on a persistent pooled client against a client per call.
+
+Runs the OpenAI-compatible stub in-process and sends the same chat completions
+three ways:
+    per-call   a new AsyncClient opened and closed for every request, as before
+    async      OpenAIApiClient.generate_code_async on its long-lived pool
+    sync       OpenAIApiClient.generate_code, through the background loop's pool
+and reports latency and how many TCP connections the stub saw for each. Against
+the real API every new connection also pays a TLS handshake, so the gap there
+is larger than on localhost.
+
+Usage (from the backend directory):
+    python -m scripts.bench_openai_client --requests 300 --concurrency 8
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from typing import Awaitable, Callable, List, Optional
+
+
+def _summary(samples: List[float]) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"mean {statistics.mean(samples) * 1000:7.2f}ms  p50 {statistics.median(samples) * 1000:7.2f}ms  p95 {p95 * 1000:7.2f}ms"
+
+
+async def _load(requests: int, concurrency: int, call: Callable[[int], Awaitable]) -> List[float]:
+    """Send `requests` calls from `concurrency` workers and return each call's latency"""
+    samples = []
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            if await call(i) is None:
+                raise RuntimeError(f"Request {i} failed")
+            samples.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+async def _run(args) -> bool:
+    import openai
+    from config import Config
+    from scripts.openai_stub import OpenAIStub, serve_in_thread
+    from services.api_clients import OpenAIApiClient
+
+    stub = OpenAIStub(latency_ms=args.latency_ms)
+    server, base_url = serve_in_thread(stub)
+    Config.AI.OPENAI_BASE_URL = base_url
+    client = OpenAIApiClient("stub-key")
+    await client.start()
+
+    async def per_call(i):
+        async with openai.AsyncClient(api_key="stub-key", base_url=base_url) as fresh:
+            response = await fresh.chat.completions.create(
+                model=args.model, messages=[{"role": "user", "content": f"request {i}"}], max_tokens=100,
+            )
+            return response.choices[0].message.content
+
+    async def pooled(i):
+        return await client.generate_code_async(args.model, "system", f"request {i}", max_tokens=100)
+
+    async def sync(i):
+        return await asyncio.to_thread(client.generate_code, args.model, "system", f"request {i}", max_tokens=100)
+
+    results = {}
+    try:
+        for name, call in (("per-call", per_call), ("async", pooled), ("sync", sync)):
+            await _load(min(args.requests, args.concurrency * 2), args.concurrency, call)  # Warm up
+            connections = len(stub.connections)
+            started = time.perf_counter()
+            samples = await _load(args.requests, args.concurrency, call)
+            elapsed = time.perf_counter() - started
+            results[name] = (samples, len(stub.connections) - connections)
+            print(f"{name:9} {_summary(samples)}  {args.requests / elapsed:7.1f} req/s  "
+                  f"{results[name][1]} new connections")
+    finally:
+        await client.close()
+        server.should_exit = True
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, stub latency {args.latency_ms}ms, "
+          f"HTTP/2 {'on' if client.http2 else 'off (h2 not installed)'}")
+    per_call_mean = statistics.mean(results["per-call"][0])
+    pooled_mean = statistics.mean(results["async"][0])
+    print(f"pooled async saves {(per_call_mean - pooled_mean) * 1000:.2f}ms per request")
+    return pooled_mean < per_call_mean and results["async"][1] <= args.concurrency and results["sync"][1] <= args.concurrency
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the pooled OpenAI client against a client per call")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean stub response latency")
+    parser.add_argument("--model", default="gpt-4o")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    ok = asyncio.run(_run(args))
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Benchmark what rendering the QR code adds to payment creation latency.
+
+Calls PaymentService.create_payment from several threads, as concurrent
+requests would. PayOS is replaced by a function that waits --payos-latency-ms
+and returns a checkout link, twice over:
+    payos     the link comes with a QR code, so nothing is rendered (baseline)
+    rendered  the link has no QR code and the application renders one
+Each checkout URL is distinct, so the render cache doesn't hide the cost.
+Reports p50/p99 latency of both runs and how many payments returned without
+their QR code, for the given number of render processes (QR_WORKERS; 0 renders
+in the request thread).
+
+Usage (from the backend directory):
+    python -m scripts.bench_payment_creation --qr-workers 2 --threads 8 --payments 400
+    python -m scripts.bench_payment_creation --database-url postgresql://user:pw@localhost/bench
+
+SQLite serializes writers, so with many threads its commits dominate the tail;
+pass a scratch Postgres database to measure closer to production. Records are
+added to, never removed from, the given database.
+
+Passes if no payment failed and rendering adds at most --max-added-p99-ms to the p99.
+"""
+import argparse
+import itertools
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def _run(create_payment: Callable[[], Dict], payments: int, threads: int) -> Dict:
+    """Create payments from threads; returns latencies, errors and payments returned without a QR code"""
+    samples: List[float] = []
+    errors: List[str] = []
+    without_qr = 0
+    lock = threading.Lock()
+    remaining = iter(range(payments))
+
+    def worker():
+        nonlocal without_qr
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            started = time.perf_counter()
+            try:
+                result = create_payment()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    samples.append(elapsed)
+                    without_qr += result["qr_code"] is None
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return {"samples": sorted(samples), "errors": errors, "without_qr": without_qr}
+
+
+def _report(name: str, result: Dict) -> float:
+    ordered = result["samples"]
+    if not ordered:
+        print(f"{name:8} no payment succeeded")
+        return float("inf")
+    p99 = _percentile(ordered, 0.99) * 1000
+    print(f"{name:8} p50 {statistics.median(ordered) * 1000:7.1f}ms  p99 {p99:7.1f}ms  "
+          f"max {ordered[-1] * 1000:7.1f}ms  {result['without_qr']} without QR code, {len(result['errors'])} failed")
+    for error in result["errors"][:5]:
+        print(f"  {error}")
+    return p99
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the latency QR rendering adds to payment creation")
+    parser.add_argument("--qr-workers", type=int, default=2, help="QR render processes; 0 renders inline")
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent requests")
+    parser.add_argument("--payments", type=int, default=400, help="Payments to create in each run")
+    parser.add_argument("--payos-latency-ms", type=float, default=20.0, help="Simulated PayOS round trip")
+    parser.add_argument("--max-added-p99-ms", type=float, default=250.0,
+                        help="Fail if rendering adds more than this to the p99")
+    parser.add_argument("--database-url", help="Scratch database (default: a temporary SQLite file)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="payment-bench-")
+    # Config is read at import, so the scratch settings must be in place first
+    os.environ.update(
+        DATABASE_URL=args.database_url or f"sqlite:///{os.path.join(workdir, 'app.db')}",
+        DATABASE_REPLICA_URLS="",
+        QR_WORKERS=str(args.qr_workers),
+    )
+    # Required at startup; no request reaches PayOS or the AI providers
+    for name in ("SECRET_KEY", "GOOGLE_API_KEYS", "PAYOS_CLIENT_ID", "PAYOS_API_KEY", "PAYOS_CHECKSUM_KEY"):
+        os.environ.setdefault(name, "payment-bench")
+    logging.disable(logging.WARNING)
+
+    import models
+    from core.dependency_injection import DIContainer
+    from database import SessionLocal, engine
+    from services import payment_service
+    from services.qr_renderer import QRRenderer
+
+    models.Base.metadata.create_all(engine)
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    link_ids = itertools.count()
+    payos_qr = False
+
+    class PaymentLink:
+        def __init__(self, i: int):
+            self.paymentLinkId = f"bench-{run_id}-{i}"
+            self.checkoutUrl = f"https://pay.payos.vn/web/{run_id}/{i:032x}"
+            self.qrCode = "payos-qr" if payos_qr else None
+
+    def create_payment_link(paymentData):
+        time.sleep(args.payos_latency_ms / 1000)
+        return PaymentLink(next(link_ids))
+
+    payment_service.payos_client.createPaymentLink = create_payment_link
+    db = SessionLocal()
+    user = models.User(username=f"bench-{run_id}", email=f"bench-{run_id}@example.com", credits=0,
+                       referral_code=f"BENCH-{run_id}")
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    db.close()
+
+    def create_payment() -> Dict:
+        db = SessionLocal()
+        try:
+            return payment_service.PaymentService.create_payment(db, user_id, 10)
+        finally:
+            db.close()
+
+    renderer = DIContainer.get_instance(QRRenderer)
+    try:
+        # Start the pool processes, as the application does at startup
+        renderer.submit("warm-up").result()
+        payos_qr = True
+        baseline = _run(create_payment, args.payments, args.threads)
+        payos_qr = False
+        rendered = _run(create_payment, args.payments, args.threads)
+    finally:
+        renderer.close()
+        engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.payments} payments per run from {args.threads} threads on {engine.dialect.name}, "
+          f"QR_WORKERS={args.qr_workers}, PayOS latency {args.payos_latency_ms:.0f}ms")
+    added = _report("rendered", rendered) - _report("payos", baseline)
+    if rendered["samples"] and baseline["samples"]:
+        added_p50 = (statistics.median(rendered["samples"]) - statistics.median(baseline["samples"])) * 1000
+        print(f"rendering adds {added_p50:.1f}ms to the p50 and {added:.1f}ms to the p99")
+    ok = not baseline["errors"] and not rendered["errors"] and added <= args.max_added_p99_ms
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
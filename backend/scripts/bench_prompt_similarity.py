@@ -0,0 +1,106 @@
+"""
+Benchmark near-duplicate prompt lookups in PromptSimilarityIndex.
+
+Indexes synthetic competitive-programming prompts (1M by default) spread over
+a few (language, model) keys, then times query() for two kinds of prompts:
+    near   a stored prompt with a word or two changed
+    novel  a prompt built from fresh text, which should find nothing
+and reports p50/p99 latency, hit rates and the process's peak memory. Whether
+a near prompt is reused depends on the threshold; --threshold 0.8 shows the
+hit rate a looser setting would give.
+
+Usage (from the backend directory):
+    python -m scripts.bench_prompt_similarity --prompts 1000000 --queries 2000
+"""
+import argparse
+import random
+import resource
+import statistics
+import sys
+import time
+from typing import List, Optional
+
+VERBS = ["given", "find", "compute", "count", "print", "determine", "output", "return", "check", "sort"]
+NOUNS = ["array", "string", "tree", "graph", "matrix", "sequence", "interval", "grid", "permutation", "queue",
+         "number", "subarray", "path", "node", "edge", "query", "segment", "digit", "pair", "cycle"]
+ADJECTIVES = ["maximum", "minimum", "shortest", "longest", "distinct", "sorted", "balanced", "prime",
+              "connected", "weighted", "increasing", "palindromic", "valid", "smallest", "largest"]
+KEYS = [("cpp", "gemini-2.0-flash"), ("python", "gemini-2.0-flash"), ("cpp", "gpt-4o"), ("java", "gemini-1.5-pro")]
+
+
+def _prompt(rng: random.Random, problem: int) -> str:
+    """A problem statement of 25-45 words, determined by `problem`"""
+    words = [f"problem{problem}"]
+    for _ in range(rng.randint(8, 15)):
+        words += [rng.choice(VERBS), rng.choice(ADJECTIVES), rng.choice(NOUNS)]
+    words.append(f"n{rng.randint(1, 10 ** 6)}")
+    return " ".join(words)
+
+
+def _edit(rng: random.Random, prompt: str) -> str:
+    """Change one or two words, as a user rewording a stored problem would"""
+    words = prompt.split()
+    for _ in range(rng.randint(1, 2)):
+        words[rng.randrange(1, len(words))] = rng.choice(ADJECTIVES)
+    return " ".join(words)
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark prompt similarity lookups over a large index")
+    parser.add_argument("--prompts", type=int, default=1_000_000, help="Prompts to index")
+    parser.add_argument("--queries", type=int, default=2000, help="Lookups of each kind")
+    parser.add_argument("--threshold", type=float, default=None, help="Reuse threshold (default from Config)")
+    parser.add_argument("--max-p99-ms", type=float, default=50.0, help="Fail if either p99 exceeds this")
+    args = parser.parse_args(argv)
+
+    from services.prompt_similarity import PromptSimilarityIndex
+
+    index = PromptSimilarityIndex()
+    threshold = args.threshold if args.threshold is not None else index.threshold
+    rng = random.Random(42)
+    started = time.perf_counter()
+    for i in range(args.prompts):
+        language, model_name = KEYS[i % len(KEYS)]
+        index.add(i, _prompt(random.Random(i), i), language, model_name, user_id=None)
+        if (i + 1) % 100_000 == 0:
+            print(f"indexed {i + 1} prompts in {time.perf_counter() - started:.0f}s")
+    build_seconds = time.perf_counter() - started
+    index.ready = True
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    results = {}
+    for kind in ("near", "novel"):
+        samples, hits, correct = [], 0, 0
+        for _ in range(args.queries):
+            if kind == "near":
+                target = rng.randrange(args.prompts)
+                prompt = _edit(rng, _prompt(random.Random(target), target))
+            else:
+                target = -1
+                prompt = _prompt(rng, args.prompts + rng.randrange(10 ** 6))
+            language, model_name = KEYS[max(target, 0) % len(KEYS)]
+            t = time.perf_counter()
+            match = index.query(prompt, language, model_name, threshold)
+            samples.append(time.perf_counter() - t)
+            if match is not None:
+                hits += 1
+                correct += match[0] == target
+        ordered = sorted(samples)
+        results[kind] = _percentile(ordered, 0.99) * 1000
+        print(f"{kind:5} lookups: p50 {statistics.median(ordered) * 1000:.3f}ms  "
+              f"p99 {results[kind]:.3f}ms  max {ordered[-1] * 1000:.3f}ms  "
+              f"hits {hits}/{args.queries}" + (f" ({correct} the edited prompt)" if kind == "near" else ""))
+
+    print(f"{len(index)} prompts indexed in {build_seconds:.0f}s "
+          f"({args.prompts / build_seconds:.0f}/s), threshold {threshold}, peak RSS {peak_mb:.0f}MB")
+    ok = all(p99 <= args.max_p99_ms for p99 in results.values())
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+Check that queued generation requests don't starve the rest of the application.
+
+Serves the application with uvicorn on a scratch SQLite database and sends
+--free-requests generation requests from distinct free users to
+/code/generate-code, more than anyio's shared threadpool has threads (40),
+against a simulated provider that takes --service-ms per generation. While
+they are queued, it times a sync endpoint (/users/me) and a paid user's
+generation request. Both go through the real routes, dependencies and
+middleware, so a queued request that holds a shared threadpool thread shows up
+as a slow /users/me and a paid request stuck behind the free backlog.
+
+Usage (from the backend directory):
+    python -m scripts.check_generation_route --free-requests 60 --service-ms 100
+
+Passes if every request succeeded, /users/me answered within --sync-max-ms
+and the paid request within --paid-max-ms.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+def _seed(free_users: int) -> Dict[str, str]:
+    """Create free users and a paid user; returns a bearer token per username"""
+    from core.security import create_access_token
+    from database import SessionLocal
+    from models import ModelPricing, PaymentTransaction, PaymentTransactionKey, User
+
+    db = SessionLocal()
+    try:
+        db.add(ModelPricing(model_name="gemini-2.0-flash", credit_cost_per_request=1))
+        names = [f"free-{i}" for i in range(free_users)] + ["paid"]
+        for name in names:
+            db.add(User(username=name, email=f"{name}@example.com", credits=100, referral_code=name.upper()))
+        db.commit()
+        paid = db.query(User).filter(User.username == "paid").one()
+        now = datetime.now().isoformat()
+        db.add(PaymentTransaction(user_id=paid.id, amount=1000, credits=1, transaction_id="route-check",
+                                  order_code=1, status="completed", created_at=now, updated_at=now))
+        db.add(PaymentTransactionKey(transaction_id="route-check"))
+        db.commit()
+        return {name: create_access_token({"sub": name}) for name in names}
+    finally:
+        db.close()
+
+
+def _serve(app):
+    """Start uvicorn on a free port in a thread; returns the server and its base URL"""
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def _load(url: str, tokens: Dict[str, str], scheduler, free_requests: int) -> Dict:
+    import httpx
+
+    def headers(name: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {tokens[name]}"}
+
+    async def generate(client, name: str, i: int):
+        body = {"model_name": "gemini-2.0-flash", "prompt": f"Request {i}: print {i} squared", "language": "cpp"}
+        started = time.perf_counter()
+        response = await client.post("/code/generate-code", json=body, headers=headers(name))
+        return response.status_code, time.perf_counter() - started
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=url, timeout=300, limits=limits) as client:
+        free = [asyncio.ensure_future(generate(client, f"free-{i}", i)) for i in range(free_requests)]
+        # Wait until every free request has reached the scheduler; ones stuck before it never do
+        def arrived() -> int:
+            stats = scheduler.statistics()
+            return stats["queued"] + sum(tier["dispatched"] for tier in stats["tiers"].values())
+
+        settle = time.monotonic() + 5
+        while arrived() < free_requests and time.monotonic() < settle:
+            await asyncio.sleep(0.05)
+        backlog = scheduler.statistics()
+
+        started = time.perf_counter()
+        me = await client.get("/users/me", headers=headers("paid"))
+        sync_elapsed = time.perf_counter() - started
+        paid_status, paid_elapsed = await generate(client, "paid", free_requests)
+        free_results = await asyncio.gather(*free)
+    return {
+        "queued": backlog["queued"],
+        "threads": backlog["threads"],
+        "sync": (me.status_code, sync_elapsed),
+        "paid": (paid_status, paid_elapsed),
+        "free": free_results,
+    }
+
+
+def check(free_requests: int, service_ms: float, sync_max_ms: float, paid_max_ms: float) -> bool:
+    """
+    Run the load through the application and print the latencies.
+
+    Returns:
+        True if every request succeeded and /users/me and the paid request were answered in time
+    """
+    import main as app_main
+    from core.dependency_injection import DIContainer
+    from services.code_generation_service import DirectAPICodeGenerator
+    from services.generation_scheduler import GenerationScheduler
+
+    def generate_code(model_name, prompt, language=None, deadline=None):
+        time.sleep(service_ms / 1000)
+        return f"// {prompt}\nint main() {{ return 0; }}"
+
+    DirectAPICodeGenerator.generate_code = staticmethod(generate_code)
+    tokens = _seed(free_requests)
+    scheduler = DIContainer.get_instance(GenerationScheduler)
+    server, thread, url = _serve(app_main.app)
+    try:
+        result = asyncio.run(_load(url, tokens, scheduler, free_requests))
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    sync_status, sync_elapsed = result["sync"]
+    paid_status, paid_elapsed = result["paid"]
+    free_failed = sum(status != 200 for status, _ in result["free"])
+    free_ordered = sorted(elapsed for _, elapsed in result["free"])
+    print(f"{free_requests} free requests, {result['queued']} queued in the scheduler, "
+          f"simulated generation {service_ms:.0f}ms, concurrency {scheduler.concurrency}, "
+          f"{result['threads']['busy']} of the scheduler's {result['threads']['total']} threads busy")
+    print(f"/users/me           {sync_status}  {sync_elapsed * 1000:8.1f}ms (limit {sync_max_ms:.0f}ms)")
+    print(f"paid generate-code  {paid_status}  {paid_elapsed * 1000:8.1f}ms (limit {paid_max_ms:.0f}ms)")
+    print(f"free generate-code  {free_failed} failed, slowest {free_ordered[-1] * 1000:.1f}ms")
+
+    ok = True
+    if sync_status != 200 or sync_elapsed * 1000 > sync_max_ms:
+        print("/users/me waited behind the queued generation requests")
+        ok = False
+    if paid_status != 200 or paid_elapsed * 1000 > paid_max_ms:
+        print("The paid request waited behind the free backlog")
+        ok = False
+    if free_failed:
+        print(f"{free_failed} free requests failed")
+        ok = False
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check that queued generations leave threads for other requests")
+    parser.add_argument("--free-requests", type=int, default=60, help="Concurrent free-tier generation requests")
+    parser.add_argument("--service-ms", type=float, default=100, help="Simulated generation time")
+    parser.add_argument("--sync-max-ms", type=float, default=500, help="Slowest acceptable /users/me")
+    parser.add_argument("--paid-max-ms", type=float, default=1000, help="Slowest acceptable paid generation")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="generation-route-")
+    # Config is read at import, so the scratch settings must be in place first. The
+    # whole backlog is admitted, so it has to wait in the scheduler.
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'app.db')}",
+        DATABASE_REPLICA_URLS="",
+        ARCHIVE_DIR=os.path.join(workdir, "archive"),
+        HISTORY_SPILL_DIR=os.path.join(workdir, "spill"),
+        RATE_LIMIT_ENABLED="false",
+        QR_WORKERS="0",
+        GENERATION_CONCURRENCY="1",
+        GENERATION_MAX_QUEUE_DEPTH=str(args.free_requests + 1),
+        GENERATION_WAIT_BUDGET_SECONDS="600",
+        GENERATION_MAX_QUEUE_WAIT_SECONDS="600",
+    )
+    # Required at startup; the providers and PayOS are never called
+    for name in ("SECRET_KEY", "GOOGLE_API_KEYS", "PAYOS_CLIENT_ID", "PAYOS_API_KEY", "PAYOS_CHECKSUM_KEY"):
+        os.environ.setdefault(name, "generation-route-check")
+    logging.disable(logging.WARNING)
+    try:
+        ok = check(args.free_requests, args.service_ms, args.sync_max_ms, args.paid_max_ms)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
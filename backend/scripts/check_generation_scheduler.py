@@ -0,0 +1,107 @@
+"""
+Saturation check for the generation scheduler.
+
+Simulates a crowd of free users and a few paid users sending generation requests
+faster than a simulated provider can serve them, and reports the queue wait per
+tier. Under saturation paid requests should keep a short, bounded wait while free
+requests absorb the backlog, and once the estimated wait exceeds the budget new
+requests are rejected on arrival. --stall-after makes the simulated provider hang
+part way through, like when every API key is rate limited, to check that new
+requests are shed instead of queueing behind it. It drives the scheduler from
+plain threads; scripts/check_generation_route.py sends the load through the
+HTTP route instead.
+
+Usage (from the backend directory):
+    python -m scripts.check_generation_scheduler --free-users 40 --paid-users 4 --duration 20
+    GENERATION_MAX_QUEUE_WAIT_SECONDS=5 python -m scripts.check_generation_scheduler --stall-after 5
+
+Passes if the paid tier's p95 wait stays below --paid-p95-ms, or with --stall-after
+if requests were shed during the stall. The scheduler
+reads its other settings (GENERATION_WAIT_BUDGET_SECONDS, ...) from the environment.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from typing import List, Optional
+
+
+def _user(scheduler, user_id: int, tier: str, service_ms, think_ms: float, stop: threading.Event) -> None:
+    """One client: send a request, wait for the result, think, repeat"""
+    from services.generation_scheduler import GenerationBusyError
+
+    while not stop.is_set():
+        try:
+            with scheduler.slot(user_id, tier):
+                time.sleep(random.expovariate(1000 / service_ms()))
+        except GenerationBusyError:
+            pass
+        time.sleep(random.uniform(0, think_ms) / 1000)
+
+
+def check(free_users: int, paid_users: int, concurrency: int, service_ms: float, think_ms: float,
+          duration: float, paid_p95_ms: float, stall_after: Optional[float] = None, stall_ms: float = 0) -> bool:
+    """
+    Run the simulated load and print the scheduler statistics.
+
+    Returns:
+        True if the paid tier's p95 queue wait is within paid_p95_ms
+    """
+    from services.generation_scheduler import GenerationScheduler
+
+    scheduler = GenerationScheduler(concurrency=concurrency)
+    stop = threading.Event()
+    started = time.monotonic()
+
+    def current_service_ms() -> float:
+        stalled = stall_after is not None and time.monotonic() - started >= stall_after
+        return stall_ms if stalled else service_ms
+
+    users = [(i, "free") for i in range(free_users)] + [(free_users + i, "paid") for i in range(paid_users)]
+    threads = [threading.Thread(target=_user, args=(scheduler, user_id, tier, current_service_ms, think_ms, stop), daemon=True)
+               for user_id, tier in users]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    statistics = scheduler.statistics()
+    print(json.dumps(statistics, indent=2))
+    paid = statistics["tiers"]["paid"]
+    free = statistics["tiers"]["free"]
+    capacity = duration * concurrency * 1000 / service_ms
+    print(f"Capacity ~{capacity:.0f} requests; served {paid['dispatched']} paid and {free['dispatched']} free")
+    print(f"Queue wait p95: paid {paid['wait_ms']['p95']} ms, free {free['wait_ms']['p95']} ms")
+    print(f"Rejected on arrival: paid {paid['rejected']}, free {free['rejected']}; "
+          f"timed out: paid {paid['timed_out']}, free {free['timed_out']}")
+    if stall_after is not None:
+        # Queue waits are meaningless while the provider hangs; shedding is what counts
+        return paid["rejected"] + free["rejected"] > 0
+    return paid["wait_ms"]["p95"] <= paid_p95_ms
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check per-tier queue waits of the generation scheduler under load")
+    parser.add_argument("--free-users", type=int, default=40)
+    parser.add_argument("--paid-users", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=1, help="Provider slots")
+    parser.add_argument("--service-ms", type=float, default=50, help="Mean simulated generation time")
+    parser.add_argument("--think-ms", type=float, default=100, help="Longest pause between a user's requests")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to run")
+    parser.add_argument("--paid-p95-ms", type=float, default=1000, help="Largest acceptable paid p95 wait")
+    parser.add_argument("--stall-after", type=float, help="Seconds after which the simulated provider stalls")
+    parser.add_argument("--stall-ms", type=float, default=20000, help="Mean generation time while stalled")
+    args = parser.parse_args(argv)
+
+    ok = check(args.free_users, args.paid_users, args.concurrency, args.service_ms, args.think_ms,
+               args.duration, args.paid_p95_ms, args.stall_after, args.stall_ms)
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
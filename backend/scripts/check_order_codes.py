@@ -0,0 +1,163 @@
+"""
+Concurrency check for the order code generator.
+
+Starts several processes that lease worker ids from a shared database the same
+way application workers do, generates order codes from several threads in each,
+and verifies that no code repeats, that every code fits PayOS's limit and that
+each thread saw strictly increasing codes. Then checks that a worker id released
+by a generator that ran ahead of the clock is taken over without reissuing its codes.
+
+Usage (from the backend directory):
+    python -m scripts.check_order_codes --processes 4 --threads 4 --count 1000000
+
+By default the leases live in a temporary SQLite database; pass --database to
+use another one.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from typing import List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+logger = logging.getLogger("check_order_codes")
+
+
+def _generate(database_url: str, threads: int, count: int, queue: multiprocessing.Queue) -> None:
+    """Process body: generate count codes over threads and send them back as one array"""
+    from core.order_codes import OrderCodeGenerator
+
+    engine = create_engine(database_url, connect_args={"timeout": 30} if database_url.startswith("sqlite") else {})
+    generator = OrderCodeGenerator(session_factory=sessionmaker(bind=engine))
+    per_thread = [count // threads + (1 if i < count % threads else 0) for i in range(threads)]
+    results: List[array] = [array("q") for _ in range(threads)]
+    unordered = []
+
+    def run(index: int) -> None:
+        codes = results[index]
+        next_code = generator.next_code
+        for _ in range(per_thread[index]):
+            codes.append(next_code())
+        if any(a >= b for a, b in zip(codes, codes[1:])):
+            unordered.append(index)
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    codes = array("q")
+    for part in results:
+        codes.extend(part)
+    queue.put((generator.worker_id, len(unordered), codes.tobytes()))
+    generator.release()
+
+
+def check_handover(database_url: str, ahead_seconds: float = 2.0) -> bool:
+    """
+    Release a worker id from a generator that ran ahead of the clock, as a burst
+    of more codes per millisecond than the sequence holds makes it, and verify
+    that the next holder of the same id continues above its codes.
+    """
+    import types
+    from core import order_codes
+
+    engine = create_engine(database_url)
+    session_factory = sessionmaker(bind=engine)
+    try:
+        # The first holder's clock reads ahead_seconds late, standing in for the burst
+        order_codes.time = types.SimpleNamespace(time=lambda: time.time() + ahead_seconds, monotonic=time.monotonic)
+        try:
+            first = order_codes.OrderCodeGenerator(session_factory=session_factory)
+            last_code = first.next_code()
+            worker_id = first.worker_id
+            first.release()
+        finally:
+            order_codes.time = time
+        second = order_codes.OrderCodeGenerator(session_factory=session_factory)
+        next_code = second.next_code()
+        next_worker_id = second.worker_id
+        second.release()
+    finally:
+        engine.dispose()
+
+    print(f"Handover of worker id {worker_id} -> {next_worker_id}: last code {last_code} "
+          f"({order_codes.decode_order_code(last_code)}), next holder's first code {next_code} "
+          f"({order_codes.decode_order_code(next_code)}); increasing: {next_code > last_code}")
+    return next_worker_id == worker_id and next_code > last_code
+
+
+def check(database_url: str, processes: int, threads: int, count: int) -> bool:
+    """
+    Generate processes * count codes concurrently and verify them.
+
+    Returns:
+        True if all codes are unique, within range and increasing per thread
+    """
+    from core.order_codes import MAX_ORDER_CODE, decode_order_code
+    from models import OrderCodeWorker
+
+    engine = create_engine(database_url)
+    OrderCodeWorker.__table__.create(engine, checkfirst=True)
+    engine.dispose()
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    started = time.monotonic()
+    children = [context.Process(target=_generate, args=(database_url, threads, count, queue)) for _ in range(processes)]
+    for child in children:
+        child.start()
+    reports = [queue.get() for _ in children]
+    for child in children:
+        child.join()
+    elapsed = time.monotonic() - started
+
+    seen = set()
+    total = 0
+    largest = 0
+    for worker_id, unordered_threads, payload in reports:
+        codes = array("q")
+        codes.frombytes(payload)
+        total += len(codes)
+        seen.update(codes)
+        largest = max(largest, max(codes, default=0))
+        logger.info(f"Worker id {worker_id}: {len(codes)} codes, {unordered_threads} threads out of order")
+
+    worker_ids = [report[0] for report in reports]
+    duplicates = total - len(seen)
+    unordered = sum(report[1] for report in reports)
+    print(f"{total} codes from {processes} processes x {threads} threads in {elapsed:.2f}s "
+          f"({total / elapsed:,.0f}/s)")
+    print(f"Worker ids: {sorted(worker_ids)}; largest code {largest} ({decode_order_code(largest)})")
+    print(f"Duplicates: {duplicates}; threads out of order: {unordered}; "
+          f"within PayOS limit: {largest <= MAX_ORDER_CODE}")
+    return duplicates == 0 and unordered == 0 and largest <= MAX_ORDER_CODE \
+        and len(set(worker_ids)) == len(worker_ids)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check order codes for collisions across processes")
+    parser.add_argument("--processes", type=int, default=4, help="Generator processes")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per process")
+    parser.add_argument("--count", type=int, default=1000000, help="Codes per process")
+    parser.add_argument("--database", help="Database URL for worker id leases (default: temporary SQLite)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database or f"sqlite:///{os.path.join(directory, 'order_codes.db')}"
+        ok = check(database_url, args.processes, args.threads, args.count)
+        ok = check_handover(database_url) and ok
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
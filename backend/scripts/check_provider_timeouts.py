@@ -0,0 +1,180 @@
+"""
+Check that a hung AI provider doesn't hold up later requests.
+
+OpenAI: runs the OpenAI-compatible stub in-process with its first request hung,
+sends a generation that times out, then several that should succeed right away.
+Verifies that the hung HTTP request was aborted on the stub's side and that no
+call is left running in the client.
+
+Google: replaces the Gemini model with one whose first call never answers and
+checks the same through GoogleApiClient, including that a cancelled request
+deadline stops a hung call at once.
+
+Runner: times calls out exactly as they finish and verifies that none stays
+counted as still running.
+
+Usage (from the backend directory):
+    python -m scripts.check_provider_timeouts --timeout 1
+"""
+import argparse
+import asyncio
+import sys
+import threading
+import time
+from typing import List, Optional
+
+
+def _report(name: str, hung_seconds: float, timeout: float, follow_ups: List[float], statistics) -> bool:
+    slowest = max(follow_ups)
+    print(f"{name}: hung call returned after {hung_seconds:.2f}s (timeout {timeout}s); "
+          f"{len(follow_ups)} follow-up calls, slowest {slowest:.3f}s")
+    print(f"{name}: client statistics {statistics}")
+    return hung_seconds < timeout + 1 and slowest < timeout and statistics["abandoned_running"] == 0
+
+
+def check_openai(timeout: float, follow_ups: int) -> bool:
+    from scripts.openai_stub import OpenAIStub, serve_in_thread
+
+    stub = OpenAIStub(hang_first=1)
+    server, base_url = serve_in_thread(stub)
+    from config import Config
+    from services.api_clients import OpenAIApiClient
+    Config.AI.OPENAI_BASE_URL = base_url
+    client = OpenAIApiClient("stub-key")
+    try:
+        started = time.monotonic()
+        hung = client.generate_code("gpt-4o", "system", "hung", timeout=timeout)
+        hung_seconds = time.monotonic() - started
+        durations = []
+        for i in range(follow_ups):
+            started = time.monotonic()
+            code = client.generate_code("gpt-4o", "system", f"request {i}", timeout=timeout)
+            durations.append(time.monotonic() - started)
+            if code is None:
+                print(f"openai: follow-up call {i} failed")
+                return False
+        time.sleep(0.3)  # Let the stub notice the aborted connection
+        print(f"openai: stub saw {stub.hung} hung requests, {stub.aborted} aborted by the client")
+        return hung is None and stub.aborted == 1 and \
+            _report("openai", hung_seconds, timeout, durations, client.statistics())
+    finally:
+        asyncio.run(client.close())
+        server.should_exit = True
+
+
+class _HungOnceModel:
+    """Stands in for genai.GenerativeModel; the first call never answers"""
+    calls = 0
+    cancelled = 0
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    async def generate_content_async(self, messages, request_options=None):
+        cls = type(self)
+        cls.calls += 1
+        if cls.calls == 1 or "hang" in messages[-1]:
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cls.cancelled += 1
+                raise
+
+        class Response:
+            text = "int main() { return 0; }"
+        return Response()
+
+
+def check_google(timeout: float, follow_ups: int) -> bool:
+    from core.deadline import Deadline, RequestCancelled
+    from services.api_clients import GoogleApiClient, GoogleAPIKeyManager
+    from services.api_clients import google_client
+
+    google_client.genai.configure = lambda **kwargs: None
+    google_client.genai.GenerativeModel = _HungOnceModel
+    key_manager = GoogleAPIKeyManager()
+    key_manager.initialize(["stub-key"])
+    client = GoogleApiClient(key_manager, max_retries=1, retry_delay=0, timeout=timeout)
+    try:
+        started = time.monotonic()
+        hung = client.generate_content("gemini-2.0-flash", ["system", "first"])
+        hung_seconds = time.monotonic() - started
+        durations = []
+        for i in range(follow_ups):
+            started = time.monotonic()
+            text = client.generate_content("gemini-2.0-flash", ["system", f"request {i}"])
+            durations.append(time.monotonic() - started)
+            if text is None:
+                print(f"google: follow-up call {i} failed")
+                return False
+
+        # A disconnect cancels a hung call without waiting for its timeout
+        deadline = Deadline(timeout * 10)
+        threading.Timer(0.2, deadline.cancel).start()
+        started = time.monotonic()
+        try:
+            client.generate_content("gemini-2.0-flash", ["system", "hang"], deadline)
+            print("google: cancelled call returned instead of raising")
+            return False
+        except RequestCancelled:
+            print(f"google: cancelled call stopped after {time.monotonic() - started:.2f}s")
+        time.sleep(0.1)
+        print(f"google: hung model calls cancelled: {_HungOnceModel.cancelled}")
+        return hung is None and _HungOnceModel.cancelled == 2 and \
+            _report("google", hung_seconds, timeout, durations, client.statistics())
+    finally:
+        client.close()
+
+
+def check_runner_race(calls: int, threads: int = 8) -> bool:
+    """
+    Time calls out at the moment they finish on their own, without a grace period,
+    so giving up on a call races with its completion; no call may stay counted as running.
+    """
+    import random
+    from services.api_clients.async_runner import AsyncCallRunner
+
+    runner = AsyncCallRunner("race-check")
+    runner.CANCEL_GRACE_SECONDS = 0
+
+    async def call():
+        await asyncio.sleep(random.uniform(0.008, 0.012))
+
+    def worker():
+        for _ in range(calls // threads):
+            try:
+                runner.run(call, 0.01)
+            except TimeoutError:
+                pass
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    time.sleep(0.2)
+    statistics = runner.statistics()
+    runner.close()
+    print(f"runner: statistics after racing timeouts with completion {statistics}")
+    return statistics["in_flight"] == 0 and statistics["abandoned_running"] == 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check that hung provider calls are aborted and don't block others")
+    parser.add_argument("--timeout", type=float, default=1.0, help="Provider call timeout in seconds")
+    parser.add_argument("--follow-ups", type=int, default=5, help="Calls sent after the hung one")
+    parser.add_argument("--race-calls", type=int, default=2400, help="Calls timed out as they finish")
+    args = parser.parse_args(argv)
+
+    results = {"openai": check_openai(args.timeout, args.follow_ups),
+               "google": check_google(args.timeout, args.follow_ups),
+               "runner": check_runner_race(args.race_calls)}
+    for name, ok in results.items():
+        print(f"{name}: {'passed' if ok else 'FAILED'}")
+    ok = all(results.values())
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Query budget check for the read endpoints.
+
+Seeds a scratch SQLite database with users, code history and payments, calls
+each endpoint through TestClient and fails if a request runs more queries than
+its budget, so a query per returned row (an N+1 lazy load, say) is caught when
+it is introduced rather than in production. The repository calls behind the
+history pages are checked in-process the same way.
+
+Usage (from the backend directory):
+    python -m scripts.check_query_counts --rows 50
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from typing import List, Optional
+
+# (path, caller, most queries one request may run). None of them depend on the
+# number of rows returned; authentication accounts for one query each.
+ENDPOINT_BUDGETS = [
+    ("/users/me", "user", 1),
+    ("/users/me/credits", "user", 1),
+    ("/users/me/referrals", "user", 2),
+    ("/code/history", "user", 2),
+    ("/code/history/count", "user", 2),
+    ("/code/history/{code_gen_id}", "user", 2),
+    ("/payment/history", "user", 3),
+    ("/models/", "user", 2),
+    ("/admin/users", "admin", 2),
+    ("/admin/code-history", "admin", 2),
+    ("/admin/payment-transactions", "admin", 2),
+    ("/admin/users/{user_id}/transactions", "admin", 2),
+]
+
+
+def _seed(rows: int):
+    """Create an admin and a user with rows history records and payments; returns the user's ids"""
+    from core.security import get_password_hash
+    from database import SessionLocal
+    from models import ModelPricing, PaymentTransaction, PaymentTransactionKey, User
+    from repositories.code_repository import CodeGenerationRepository
+
+    db = SessionLocal()
+    try:
+        db.add(ModelPricing(model_name="gemini-2.0-flash", credit_cost_per_request=1))
+        for name, is_admin in [("admin", True), ("user", False)]:
+            db.add(User(username=name, email=f"{name}@example.com", hashed_password=get_password_hash("password"),
+                        is_admin=is_admin, credits=100, referral_code=name.upper()))
+        db.commit()
+        user = db.query(User).filter(User.username == "user").one()
+
+        repository = CodeGenerationRepository(db)
+        for i in range(rows):
+            code_gen = repository.create_generation(user.id, "gemini-2.0-flash", f"Problem {i}: sum of an array",
+                                                    f"int main() {{ return {i % 5}; }}", 1.0, "cpp")
+            now = datetime.now().isoformat()
+            db.add(PaymentTransaction(user_id=user.id, amount=1000, credits=1, transaction_id=f"link-{i}",
+                                      order_code=i + 1, status="completed", created_at=now, updated_at=now))
+            db.add(PaymentTransactionKey(transaction_id=f"link-{i}"))
+        db.commit()
+        return user.id, code_gen.id
+    finally:
+        db.close()
+
+
+def check(rows: int) -> bool:
+    """
+    Seed the database, then compare every endpoint's query count with its budget.
+
+    Returns:
+        True if every request stayed within its budget
+    """
+    from fastapi.testclient import TestClient
+    from core.query_stats import assert_max_queries, assert_response_max_queries
+    from database import SessionLocal
+    from repositories.code_repository import CodeGenerationRepository
+    import main as app_main
+
+    user_id, code_gen_id = _seed(rows)
+    failures = []
+    with TestClient(app_main.app) as client:
+        headers = {}
+        for name in ("admin", "user"):
+            token = client.post("/token", data={"username": name, "password": "password"}).json()["access_token"]
+            headers[name] = {"Authorization": f"Bearer {token}"}
+
+        for path, caller, limit in ENDPOINT_BUDGETS:
+            path = path.format(user_id=user_id, code_gen_id=code_gen_id)
+            response = client.get(path, headers=headers[caller])
+            print(f"{path:40} {response.status_code} {response.headers.get('x-db-query-count')} queries (budget {limit})")
+            if response.status_code != 200:
+                failures.append(f"{path} returned {response.status_code}")
+                continue
+            try:
+                assert_response_max_queries(response, limit)
+            except AssertionError as e:
+                failures.append(str(e))
+
+    db = SessionLocal()
+    try:
+        repository = CodeGenerationRepository(db)
+        # Reading the code too catches a lazy load of each row's blob
+        for name, call in [("get_by_user_id", lambda: [g.generated_code for g in repository.get_by_user_id(user_id)]),
+                           ("count_by_user_id", lambda: repository.count_by_user_id(user_id))]:
+            try:
+                with assert_max_queries(1) as stats:
+                    call()
+                print(f"CodeGenerationRepository.{name:26} {stats.count} queries (budget 1)")
+            except AssertionError as e:
+                failures.append(f"CodeGenerationRepository.{name}: {e}")
+    finally:
+        db.close()
+
+    for failure in failures:
+        print(failure)
+    return not failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check that read endpoints stay within their query budgets")
+    parser.add_argument("--rows", type=int, default=50, help="History records and payments to seed")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="query-counts-")
+    # Config is read at import, so the scratch settings must be in place first
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'app.db')}",
+        DATABASE_REPLICA_URLS="",
+        ARCHIVE_DIR=os.path.join(workdir, "archive"),
+        HISTORY_SPILL_DIR=os.path.join(workdir, "spill"),
+        QUERY_STATS_HEADERS="true",
+        RATE_LIMIT_ENABLED="false",
+        QR_WORKERS="0",
+    )
+    # Required at startup; no generation or payment requests are sent
+    for name in ("SECRET_KEY", "GOOGLE_API_KEYS", "PAYOS_CLIENT_ID", "PAYOS_API_KEY", "PAYOS_CHECKSUM_KEY"):
+        os.environ.setdefault(name, "query-count-check")
+    logging.disable(logging.INFO)
+    try:
+        ok = check(args.rows)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("Check passed" if ok else "Check FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
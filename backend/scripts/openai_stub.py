@@ -0,0 +1,123 @@
+"""
+Local OpenAI-compatible chat completions endpoint, for offline and load testing.
+
+Answers POST /v1/chat/completions with a fixed program. Latency can be added,
+and some requests can be made to hang until the client gives up, to exercise
+timeouts and cancellation; /stub/stats reports how many hung requests were
+aborted by their client.
+
+Usage (from the backend directory):
+    python -m scripts.openai_stub --port 8200 --latency-ms 50
+
+and point the application at it with OPENAI_BASE_URL=http://localhost:8200/v1.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import socket
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+
+logger = logging.getLogger("openai_stub")
+
+STUB_CODE = "#include <iostream>\nint main() {\n    std::cout << \"stub\";\n    return 0;\n}"
+
+
+class OpenAIStub:
+    """Counters and the settings that shape the stub's behaviour."""
+
+    def __init__(self, latency_ms: float = 0.0, hang_first: int = 0, hang_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.hang_first = hang_first
+        self.hang_rate = hang_rate
+        self.requests = 0
+        self.hung = 0
+        self.aborted = 0  # Hung requests whose client closed the connection
+        self.connections = set()
+        self._ids = itertools.count(1)
+
+    def should_hang(self) -> bool:
+        return self.requests <= self.hang_first or (self.hang_rate and random.random() < self.hang_rate)
+
+
+def create_app(stub: OpenAIStub) -> FastAPI:
+    app = FastAPI(title="OpenAI stub")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        stub.requests += 1
+        client = request.scope.get("client")
+        if client:
+            stub.connections.add(tuple(client))
+        body = await request.json()
+        if stub.should_hang():
+            stub.hung += 1
+            while not await request.is_disconnected():
+                await asyncio.sleep(0.05)
+            stub.aborted += 1
+            return {}
+        if stub.latency_ms:
+            await asyncio.sleep(random.expovariate(1000 / stub.latency_ms))
+        return {
+            "id": f"chatcmpl-stub{next(stub._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": STUB_CODE},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30},
+        }
+
+    @app.get("/stub/stats")
+    async def stats():
+        return {"requests": stub.requests, "hung": stub.hung, "aborted": stub.aborted,
+                "connections": len(stub.connections)}
+
+    return app
+
+
+def serve_in_thread(stub: OpenAIStub, host: str = "127.0.0.1") -> Tuple["uvicorn.Server", str]:
+    """
+    Run the stub on a free port in a background thread.
+
+    Returns:
+        The server (set `should_exit` to stop it) and the base URL for OPENAI_BASE_URL
+    """
+    import uvicorn
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(stub), host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://{host}:{port}/v1"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean response latency")
+    parser.add_argument("--hang-first", type=int, default=0, help="Hang the first N requests until aborted")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests that hang until aborted")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    stub = OpenAIStub(args.latency_ms, args.hang_first, args.hang_rate)
+    uvicorn.run(create_app(stub), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Local stand-in for the PayOS payment link API, for offline and load testing.
+
+Implements create, get information and cancel with signed responses, so the
+application's PayOS client runs unchanged against it. Payment links become PAID
+after --pay-after seconds; with --webhook-url the stub then posts a signed
+webhook like PayOS does. Latency and server errors can be injected to exercise
+timeouts and retries.
+
+Usage (from the backend directory):
+    python -m scripts.payos_stub --port 8100 --checksum-key test --pay-after 5 \\
+        --webhook-url http://localhost:8000/payment/webhook
+
+and start the application with PAYOS_BASE_URL=http://localhost:8100 and the
+same PAYOS_CHECKSUM_KEY.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from payos.utils import createSignatureFromObj
+
+logger = logging.getLogger("payos_stub")
+
+
+class PayOSStub:
+    """In-memory payment links and the settings that shape the stub's behaviour."""
+
+    def __init__(self, checksum_key: str, pay_after: Optional[float] = None, webhook_url: Optional[str] = None,
+                 latency_ms: float = 0.0, error_rate: float = 0.0):
+        self.checksum_key = checksum_key
+        self.pay_after = pay_after
+        self.webhook_url = webhook_url
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.links: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+        self._ids = itertools.count(1)
+
+    def next_link_id(self) -> str:
+        return f"stub{next(self._ids):012d}"
+
+    def signed(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return {"code": "00", "desc": "success", "data": data,
+                "signature": createSignatureFromObj(data, self.checksum_key)}
+
+    def information(self, link: Dict[str, Any]) -> Dict[str, Any]:
+        # Links past their pay time are paid when they're next looked at
+        if link["status"] == "PENDING" and self.pay_after is not None \
+                and time.time() - link["created"] >= self.pay_after:
+            link["status"] = "PAID"
+            link["amountPaid"], link["amountRemaining"] = link["amount"], 0
+        return {key: link[key] for key in (
+            "id", "orderCode", "amount", "amountPaid", "amountRemaining", "status",
+            "createdAt", "cancellationReason", "canceledAt"
+        )} | {"transactions": []}
+
+    async def delay(self) -> Optional[JSONResponse]:
+        """Apply the configured latency and maybe fail the request"""
+        self.requests += 1
+        if self.latency_ms:
+            await asyncio.sleep(random.expovariate(1000 / self.latency_ms))
+        if self.error_rate and random.random() < self.error_rate:
+            return JSONResponse({"code": "500", "desc": "Injected error"}, status_code=503)
+        return None
+
+    async def send_webhook(self, link: Dict[str, Any]) -> None:
+        """Post a signed success webhook once the link's pay time has passed"""
+        await asyncio.sleep(self.pay_after)
+        self.information(link)
+        if link["status"] != "PAID":
+            return
+        data = {
+            "orderCode": link["orderCode"], "amount": link["amount"], "description": link["description"],
+            "accountNumber": "0000000000", "reference": f"STUB{link['orderCode']}",
+            "transactionDateTime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "currency": "VND", "paymentLinkId": link["id"], "code": "00", "desc": "success",
+            "counterAccountBankId": "", "counterAccountBankName": "", "counterAccountName": "",
+            "counterAccountNumber": "", "virtualAccountName": "", "virtualAccountNumber": "",
+        }
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                await client.post(self.webhook_url, json={
+                    "code": "00", "desc": "success", "success": True, "data": data,
+                    "signature": createSignatureFromObj(data, self.checksum_key)
+                })
+        except httpx.HTTPError as e:
+            logger.warning(f"Webhook for {link['id']} failed: {e!r}")
+
+
+def create_app(stub: PayOSStub) -> FastAPI:
+    app = FastAPI(title="PayOS stub")
+    webhooks: Set[asyncio.Task] = set()
+
+    @app.post("/v2/payment-requests")
+    async def create_payment_link(request: Request):
+        if (error := await stub.delay()) is not None:
+            return error
+        body = await request.json()
+        if any(link["orderCode"] == body["orderCode"] for link in stub.links.values()):
+            return {"code": "231", "desc": "Đơn thanh toán đã tồn tại", "data": None, "signature": None}
+        link_id = stub.next_link_id()
+        link = stub.links[link_id] = {
+            "id": link_id, "orderCode": body["orderCode"], "amount": body["amount"],
+            "description": body.get("description", ""), "amountPaid": 0, "amountRemaining": body["amount"],
+            "status": "PENDING", "createdAt": datetime.now().isoformat(), "created": time.time(),
+            "cancellationReason": None, "canceledAt": None,
+        }
+        if stub.webhook_url and stub.pay_after is not None:
+            task = asyncio.create_task(stub.send_webhook(link))
+            webhooks.add(task)
+            task.add_done_callback(webhooks.discard)
+        return stub.signed({
+            "bin": "970422", "accountNumber": "0000000000", "accountName": "PAYOS STUB",
+            "amount": link["amount"], "description": link["description"], "orderCode": link["orderCode"],
+            "currency": "VND", "paymentLinkId": link_id, "status": "PENDING",
+            "checkoutUrl": f"http://payos.stub/web/{link_id}", "qrCode": "",
+        })
+
+    @app.get("/v2/payment-requests/{link_id}")
+    async def get_payment_link_information(link_id: str):
+        if (error := await stub.delay()) is not None:
+            return error
+        link = stub.links.get(link_id)
+        if link is None:
+            return {"code": "101", "desc": "Không tìm thấy đơn thanh toán", "data": None, "signature": None}
+        return stub.signed(stub.information(link))
+
+    @app.post("/v2/payment-requests/{link_id}/cancel")
+    async def cancel_payment_link(link_id: str, request: Request):
+        if (error := await stub.delay()) is not None:
+            return error
+        link = stub.links.get(link_id)
+        if link is None:
+            return {"code": "101", "desc": "Không tìm thấy đơn thanh toán", "data": None, "signature": None}
+        if stub.information(link)["status"] == "PENDING":
+            body = await request.json() if await request.body() else {}
+            link.update(status="CANCELLED", cancellationReason=body.get("cancellationReason"),
+                        canceledAt=datetime.now().isoformat())
+        return stub.signed(stub.information(link))
+
+    @app.get("/stub/stats")
+    async def stats():
+        statuses: Dict[str, int] = {}
+        for link in stub.links.values():
+            status = stub.information(link)["status"]
+            statuses[status] = statuses.get(status, 0) + 1
+        return {"requests": stub.requests, "links": len(stub.links), "statuses": statuses}
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a local PayOS stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--checksum-key", required=True, help="Must match PAYOS_CHECKSUM_KEY of the application")
+    parser.add_argument("--pay-after", type=float, help="Seconds until a new link is paid (default: never)")
+    parser.add_argument("--webhook-url", help="Post a webhook here when a link is paid")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean response latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    stub = PayOSStub(args.checksum_key, args.pay_after, args.webhook_url, args.latency_ms, args.error_rate)
+    uvicorn.run(create_app(stub), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
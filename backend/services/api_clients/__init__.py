@@ -4,5 +4,6 @@ API clients for external services.
 from .google_client import GoogleApiClient
 from .openai_client import OpenAIApiClient
 from .google_key_manager import GoogleAPIKeyManager
+from .payos_client import PayOSClient
 
-__all__ = ['GoogleApiClient', 'OpenAIApiClient', 'GoogleAPIKeyManager']
\ No newline at end of file
+__all__ = ['GoogleApiClient', 'OpenAIApiClient', 'GoogleAPIKeyManager', 'PayOSClient']
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Cancellable provider calls for synchronous callers.
+
+Provider SDK calls made from a worker thread can't be stopped once they've
+started: a timed-out call keeps its thread, and its connection, busy until
+the upstream answers. AsyncCallRunner instead runs the SDK's async variant on
+a background event loop. A timeout or a cancelled request deadline cancels the
+coroutine, which aborts the HTTP/gRPC request underneath, so a hung upstream
+holds nothing once its caller has given up.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from core.deadline import Deadline, RequestCancelled
+
+logger = logging.getLogger("async_runner")
+
+
+class _Call:
+    """State of one call, shared by its coroutine and its caller; guarded by the runner's lock"""
+    __slots__ = ("started", "finished", "abandoned")
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.abandoned = False
+
+
+class AsyncCallRunner:
+    """Runs coroutines on a dedicated event loop thread, bounded by a timeout and a deadline."""
+
+    # Time allowed beyond a call's timeout for the loop to notice it and clean up
+    CANCEL_GRACE_SECONDS = 1.0
+
+    def __init__(self, name: str):
+        """
+        Args:
+            name: Name of the loop thread and of the calls in logs
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._timed_out = 0
+        self._cancelled = 0
+        # Calls given up on whose coroutines haven't finished yet; stays at 0 as
+        # long as cancellation reaches the transport
+        self._abandoned_running = 0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The background loop, started on first use"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, daemon=True, name=self.name)
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coroutine: Awaitable) -> concurrent.futures.Future:
+        """Schedule a coroutine on the loop without waiting for it"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, make_call: Callable[[], Awaitable], timeout: float, deadline: Optional[Deadline] = None) -> Any:
+        """
+        Run `make_call()` on the loop and wait for its result.
+
+        Args:
+            make_call: Creates the coroutine; called on the loop thread
+            timeout: Seconds after which the call is cancelled
+            deadline: Optional request deadline; its cancellation cancels the call
+
+        Raises:
+            TimeoutError: If the call didn't finish within `timeout`
+            RequestCancelled: If the deadline was cancelled first
+            Exception: Whatever the call raised
+        """
+        call = _Call()
+
+        async def guarded():
+            with self._lock:
+                call.started = True
+                self._in_flight += 1
+            try:
+                return await asyncio.wait_for(make_call(), timeout)
+            finally:
+                with self._lock:
+                    call.finished = True
+                    self._in_flight -= 1
+                    if call.abandoned:
+                        self._abandoned_running -= 1
+
+        future = self.submit(guarded())
+        woken = threading.Event()
+        future.add_done_callback(lambda _: woken.set())
+        if deadline is not None:
+            deadline.on_cancel(woken.set)
+
+        # The coroutine enforces the timeout itself; the grace only covers a busy loop
+        if not woken.wait(timeout + self.CANCEL_GRACE_SECONDS):
+            self._abandon(call, future)
+            with self._lock:
+                self._timed_out += 1
+            raise TimeoutError(f"{self.name} call did not finish within {timeout:.1f} seconds")
+        if not future.done():
+            self._abandon(call, future)
+            with self._lock:
+                self._cancelled += 1
+            raise RequestCancelled(f"Client disconnected during a {self.name} call")
+
+        try:
+            result = future.result()
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timed_out += 1
+            raise TimeoutError(f"{self.name} call timed out after {timeout:.1f} seconds")
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        with self._lock:
+            self._completed += 1
+        return result
+
+    def _abandon(self, call: _Call, future: concurrent.futures.Future) -> None:
+        """Stop waiting for a call and cancel its coroutine"""
+        with self._lock:
+            # The future is only marked done after the coroutine's finally has run, so ask
+            # the coroutine itself. One cancelled before it started never runs its finally.
+            if call.started and not call.finished:
+                call.abandoned = True
+                self._abandoned_running += 1
+        future.cancel()
+
+    def statistics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "timed_out": self._timed_out,
+                "cancelled": self._cancelled,
+                "abandoned_running": self._abandoned_running,
+            }
+
+    def close(self) -> None:
+        """Cancel calls still running and stop the loop"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+
+        async def cancel_all():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(cancel_all(), loop).result(5)
+        except Exception as e:
+            logger.warning(f"Error cancelling {self.name} calls: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
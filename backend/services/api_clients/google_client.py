@@ -2,13 +2,20 @@
 API client for Google Generative AI services.
 """
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.ai.generativelanguage_v1beta.services.generative_service.transports.grpc_asyncio import (
+    GenerativeServiceGrpcAsyncIOTransport,
+)
+from google.api_core import gapic_v1
 from typing import Optional, List, Dict, Any, Tuple, Union
+import threading
 import time
 import logging
-import concurrent.futures
 from functools import wraps
 
 from config import Config
+from core.deadline import Deadline, DeadlineExceeded, RequestCancelled
+from .async_runner import AsyncCallRunner
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -22,11 +29,78 @@ class RateLimitError(ApiError):
     """Exception for rate limit errors"""
     pass
 
+class GeminiModelCache:
+    """
+    Model handles per (API key, model), built once and reused.
+    
+    genai.configure() is process-global, and every call to it drops the clients
+    made so far, so configuring a key per request re-created the gRPC channel
+    each time and raced with concurrent calls using other keys. Here each key
+    gets its own async client, with a keep-alive channel that all of that key's
+    models share, and handles are attached to it directly.
+    
+    Handles must be created, and used, on the event loop they'll run on.
+    """
+    
+    def __init__(self, keepalive_seconds: Optional[float] = None):
+        keepalive_seconds = keepalive_seconds if keepalive_seconds is not None else Config.AI.GOOGLE_API_KEEPALIVE_SECONDS
+        self._channel_options = [
+            ("grpc.keepalive_time_ms", int(keepalive_seconds * 1000)),
+            ("grpc.keepalive_timeout_ms", 10000),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+        ]
+        self._lock = threading.Lock()
+        self._clients: Dict[str, glm.GenerativeServiceAsyncClient] = {}
+        self._models: Dict[Tuple[str, str], Any] = {}
+    
+    def _make_transport(self, **kwargs) -> GenerativeServiceGrpcAsyncIOTransport:
+        def make_channel(*args, options=(), **channel_kwargs):
+            return GenerativeServiceGrpcAsyncIOTransport.create_channel(
+                *args, options=[*options, *self._channel_options], **channel_kwargs
+            )
+        return GenerativeServiceGrpcAsyncIOTransport(channel=make_channel, **kwargs)
+    
+    def _client(self, api_key: str) -> glm.GenerativeServiceAsyncClient:
+        client = self._clients.get(api_key)
+        if client is None:
+            client = glm.GenerativeServiceAsyncClient(
+                transport=self._make_transport,
+                client_options={"api_key": api_key},
+                client_info=gapic_v1.client_info.ClientInfo(user_agent=f"genai-py/{genai.__version__}"),
+            )
+            self._clients[api_key] = client
+        return client
+    
+    def get(self, api_key: str, model_name: str):
+        """The model handle for a key, created on first use"""
+        with self._lock:
+            model = self._models.get((api_key, model_name))
+            if model is None:
+                model = genai.GenerativeModel(model_name)
+                # Used by generate_content_async in place of the global default client
+                model._async_client = self._client(api_key)
+                self._models[(api_key, model_name)] = model
+            return model
+    
+    def __len__(self) -> int:
+        return len(self._models)
+    
+    async def close(self) -> None:
+        """Close every key's channel"""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+            self._models = {}
+        for client in clients:
+            await client.transport.close()
+
+
 class GoogleApiClient:
     """
     Client for interacting with Google's Generative AI API.
     Uses a key manager to handle API key rotation and rate limits.
     With retry mechanism for failed requests and request timeout.
+    Given a request deadline, attempts and retry delays fit within what is left of it.
     """
     
     def __init__(self, key_manager, max_retries=None, retry_delay=None, timeout=None):
@@ -43,36 +117,61 @@ class GoogleApiClient:
         self.max_retries = max_retries if max_retries is not None else Config.AI.GOOGLE_API_MAX_RETRIES
         self.retry_delay = retry_delay if retry_delay is not None else Config.AI.GOOGLE_API_RETRY_DELAY
         self.timeout = timeout if timeout is not None else Config.AI.GOOGLE_API_TIMEOUT
-        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # Calls run on the runner's event loop so that timeouts can abort them
+        self._runner = AsyncCallRunner("google-api")
+        self._models = GeminiModelCache()
         logger.info(f"GoogleApiClient initialized with timeout: {self.timeout}s, max_retries: {self.max_retries}, retry_delay: {self.retry_delay}s")
     
-    def __del__(self):
-        """Clean up resources when object is destroyed"""
-        if hasattr(self, '_executor'):
-            self._executor.shutdown(wait=False)
-            logger.debug("ThreadPoolExecutor shut down")
-    
-    def _with_timeout(self, func, *args, **kwargs) -> Tuple[Any, Optional[Exception]]:
+    def _with_timeout(self, make_call, timeout: Optional[float] = None,
+                      deadline: Optional[Deadline] = None) -> Tuple[Any, Optional[Exception]]:
         """
-        Execute a function with timeout control.
+        Execute an async API call with timeout control.
+        On timeout or cancellation the call is cancelled, which aborts its request.
         
         Args:
-            func: Function to execute
-            *args, **kwargs: Arguments to pass to the function
+            make_call: Function creating the API call's coroutine
+            timeout: Seconds to wait for the result (default: self.timeout)
+            deadline: Optional request deadline; stop the call as soon as it's cancelled
             
         Returns:
             Tuple of (result, exception). If successful, exception is None.
         """
-        future = self._executor.submit(func, *args, **kwargs)
+        timeout = self.timeout if timeout is None else timeout
         try:
-            result = future.result(timeout=self.timeout)
-            return result, None
-        except concurrent.futures.TimeoutError:
-            future.cancel()
-            return None, TimeoutError(f"API call timed out after {self.timeout} seconds")
+            return self._runner.run(make_call, timeout, deadline), None
         except Exception as e:
             return None, e
     
+    def warm_up(self, model_names: List[str]) -> None:
+        """
+        Create the model handles for every API key ahead of the first request.
+        
+        Args:
+            model_names: Models to prepare for each key
+        """
+        api_keys = list(self.key_manager.api_keys)
+        
+        async def build():
+            for api_key in api_keys:
+                for model_name in model_names:
+                    self._models.get(api_key, model_name)
+        
+        self._runner.submit(build()).result()
+        logger.info(f"Prepared {len(self._models)} Gemini model handles for {len(api_keys)} API keys")
+    
+    def statistics(self) -> Dict[str, Any]:
+        """Counts of API calls, including ones abandoned on timeout or disconnect"""
+        return {**self._runner.statistics(), "model_handles": len(self._models)}
+    
+    def close(self) -> None:
+        """Cancel API calls still running, close the connections and stop the client's event loop"""
+        if len(self._models):
+            try:
+                self._runner.submit(self._models.close()).result(5)
+            except Exception as e:
+                logger.warning(f"Error closing Google API connections: {str(e)}")
+        self._runner.close()
+    
     def _handle_api_error(self, error: Exception, key_index: int) -> Optional[RateLimitError]:
         """
         Handle API errors and determine if it's a rate limit error.
@@ -98,7 +197,16 @@ class GoogleApiClient:
             self.key_manager.rotate_key()
             return None
     
-    def generate_content(self, model_name: str, messages: List[str]) -> Optional[str]:
+    @staticmethod
+    def _sleep(seconds: float, deadline: Optional[Deadline]) -> None:
+        """Wait before a retry; with a deadline, give up instead if it would pass first"""
+        if deadline is None:
+            time.sleep(seconds)
+        else:
+            deadline.sleep(seconds)
+    
+    def generate_content(self, model_name: str, messages: List[str],
+                         deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         Generate content using Google's Generative AI API.
         If request fails with rate limit error, it will retry with the same key.
@@ -107,9 +215,13 @@ class GoogleApiClient:
         Args:
             model_name: The name of the model to use
             messages: List of message strings to send to the model
+            deadline: Optional request deadline bounding all attempts and delays
             
         Returns:
             Optional[str]: Generated content or None if all attempts failed
+            
+        Raises:
+            DeadlineExceeded: If the deadline passes before an attempt succeeds
         """
         max_rate_limit_retries = Config.AI.GOOGLE_API_RATE_LIMIT_MAX_RETRIES
         rate_limit_delay = Config.AI.GOOGLE_API_RATE_LIMIT_DELAY
@@ -120,6 +232,8 @@ class GoogleApiClient:
         rate_limit_retry_count = 0
         
         while attempt_count < self.max_retries and len(tried_keys) < total_keys:
+            if deadline is not None:
+                deadline.check()
             current_key = self.key_manager.get_current_key()
             current_key_index = self.key_manager.current_key_index
             
@@ -141,7 +255,7 @@ class GoogleApiClient:
             
             # Try to generate content with current key
             try:
-                result = self._try_generate_with_key(current_key, model_name, messages)
+                result = self._try_generate_with_key(current_key, model_name, messages, deadline)
                 
                 if result:
                     logger.info(f"Returning result to code generation service")
@@ -160,7 +274,7 @@ class GoogleApiClient:
                 
                 if rate_limit_retry_count <= max_rate_limit_retries:
                     logger.info(f"Rate limit reached, waiting {rate_limit_delay}s before retry #{rate_limit_retry_count}")
-                    time.sleep(rate_limit_delay)
+                    self._sleep(rate_limit_delay, deadline)
                     # Continue with the same key
                     continue
                 else:
@@ -171,7 +285,7 @@ class GoogleApiClient:
             
             # Delay before retry if needed (for non-rate limit retries)
             if rate_limit_retry_count == 0 and attempt_count < self.max_retries and len(tried_keys) < total_keys:
-                time.sleep(self.retry_delay)
+                self._sleep(self.retry_delay, deadline)
         
         if len(tried_keys) >= total_keys:
             logger.warning("All API keys have been tried without success")
@@ -180,7 +294,8 @@ class GoogleApiClient:
             
         return None
     
-    def _try_generate_with_key(self, api_key: str, model_name: str, messages: List[str]) -> Optional[str]:
+    def _try_generate_with_key(self, api_key: str, model_name: str, messages: List[str],
+                               deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         Try to generate content with a specific API key.
         
@@ -188,31 +303,39 @@ class GoogleApiClient:
             api_key: The API key to use
             model_name: The name of the model to use
             messages: List of message strings to send to the model
+            deadline: Optional request deadline; the attempt's timeout shrinks to fit it
             
         Returns:
             Optional[str]: Generated content or None if the attempt failed
         """
+        timeout = self.timeout if deadline is None else deadline.limit(self.timeout)
         try:
-            # Configure the API with the key
-            genai.configure(api_key=api_key)
-            
-            # Initialize the model
-            model = genai.GenerativeModel(model_name)
-            
             # Start timing
             start_time = time.time()
             
             # Call API with timeout
             logger.info(f"Sending request to Google API with key #{self.key_manager.current_key_index + 1}")
-            response, error = self._with_timeout(model.generate_content, messages)
+            # The transport timeout and the runner's cancellation both end a hung request.
+            # The key's model handle is looked up on the runner's loop, where its channel lives
+            response, error = self._with_timeout(
+                lambda: self._models.get(api_key, model_name).generate_content_async(
+                    messages, request_options={"timeout": timeout}
+                ),
+                timeout=timeout, deadline=deadline
+            )
             
             # Calculate elapsed time
             elapsed_time = time.time() - start_time
             
             # Handle errors
+            if isinstance(error, RequestCancelled):
+                logger.info(f"Client disconnected; abandoning request with API key #{self.key_manager.current_key_index + 1}")
+                raise error
             if error:
                 if isinstance(error, TimeoutError):
                     logger.warning(f"Request timed out after {elapsed_time:.1f} seconds with API key #{self.key_manager.current_key_index + 1}")
+                    if deadline is not None and deadline.expired:
+                        raise DeadlineExceeded("Request deadline passed during a Google API call")
                 else:
                     self._handle_api_error(error, self.key_manager.current_key_index)
                 return None
@@ -230,6 +353,8 @@ class GoogleApiClient:
             logger.warning(f"Empty response from API key #{self.key_manager.current_key_index + 1}, rotating to next key")
             return None
                 
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.exception(f"Unexpected error in _try_generate_with_key: {str(e)}")
             return None
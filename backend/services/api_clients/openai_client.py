@@ -1,12 +1,35 @@
 """
 API client for OpenAI services.
 """
+import asyncio
+import importlib.util
+import logging
+import threading
 import openai
 from typing import Optional, List, Dict, Any
 
+# The HTTP library the installed SDK is built on: httpx2 in recent releases, httpx before
+try:
+    import httpx2 as http
+except ImportError:
+    import httpx as http
+
+from config import Config
+from core.deadline import Deadline, RequestCancelled
+from .async_runner import AsyncCallRunner
+
+logger = logging.getLogger("openai_api_client")
+
 class OpenAIApiClient:
     """
     Client for interacting with OpenAI's API.
+    Synchronous calls run on a background event loop so that timeouts and
+    disconnects abort the HTTP request instead of leaving it running.
+    
+    Requests go through two long-lived SDK clients with keep-alive connection
+    pools: one on the background loop for synchronous callers, and one on the
+    application's event loop for generate_code_async. An httpx client's pool
+    can only be used from the loop it was created on, hence the two.
     """
     
     def __init__(self, api_key: str):
@@ -17,10 +40,54 @@ class OpenAIApiClient:
             api_key: OpenAI API key
         """
         self.api_key = api_key
-        openai.api_key = api_key
+        self._runner = AsyncCallRunner("openai-api")
+        self._lock = threading.Lock()
+        self._client: Optional[openai.AsyncClient] = None        # On the runner's loop
+        self._async_client: Optional[openai.AsyncClient] = None  # On the application's loop
+        self.http2 = Config.AI.OPENAI_HTTP2 and importlib.util.find_spec("h2") is not None
+    
+    def _make_client(self) -> openai.AsyncClient:
+        """An SDK client with its own tuned connection pool"""
+        timeout = http.Timeout(Config.AI.OPENAI_API_TIMEOUT, connect=Config.AI.OPENAI_CONNECT_TIMEOUT)
+        return openai.AsyncClient(
+            api_key=self.api_key,
+            base_url=Config.AI.OPENAI_BASE_URL,
+            timeout=timeout,
+            http_client=openai.DefaultAsyncHttpxClient(
+                http2=self.http2,
+                timeout=timeout,
+                limits=http.Limits(
+                    max_connections=Config.AI.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.AI.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=Config.AI.OPENAI_KEEPALIVE_SECONDS,
+                ),
+            ),
+        )
+    
+    def _loop_client(self) -> openai.AsyncClient:
+        """The client for the runner's loop; only call from that loop"""
+        with self._lock:
+            if self._client is None:
+                self._client = self._make_client()
+            return self._client
+    
+    async def start(self) -> None:
+        """Create both clients ahead of the first request; call from the application's event loop"""
+        if not self.api_key:
+            logger.info("No OpenAI API key configured; OpenAI models are unavailable")
+            return
+        if self._async_client is None:
+            self._async_client = self._make_client()
+        
+        async def make_loop_client():
+            self._loop_client()
+        
+        await asyncio.wrap_future(self._runner.submit(make_loop_client()))
+        logger.info(f"OpenAI clients ready (HTTP/2: {self.http2})")
     
     def generate_code(self, model_name: str, system_prompt: str, user_prompt: str,
-                     temperature: float = 0.2, max_tokens: int = 4000) -> Optional[str]:
+                     temperature: float = 0.2, max_tokens: int = 4000,
+                     timeout: Optional[float] = None, deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         Generate code using OpenAI API.
         
@@ -30,31 +97,68 @@ class OpenAIApiClient:
             user_prompt: The user prompt with specific request
             temperature: The randomness parameter (default: 0.2)
             max_tokens: Maximum tokens in the response (default: 4000)
-            
+            timeout: Seconds after which the request is aborted (default from Config)
+            deadline: Optional request deadline; its cancellation aborts the request
+        
         Returns:
             Optional[str]: Generated code or None if generation failed
+        
+        Raises:
+            RequestCancelled: If the deadline was cancelled during the request
         """
+        timeout = timeout if timeout is not None else Config.AI.OPENAI_API_TIMEOUT
         try:
-            response = openai.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=temperature,
-                max_tokens=max_tokens,
+            return self._runner.run(
+                lambda: self._generate(self._loop_client(), model_name, system_prompt, user_prompt,
+                                       temperature, max_tokens, timeout),
+                timeout, deadline
             )
-            
-            # Extract the generated code from the response
-            if response and response.choices and len(response.choices) > 0:
-                return response.choices[0].message.content.strip()
-            return None
+        except RequestCancelled:
+            raise
         except Exception as e:
             print(f"Error generating code with OpenAI: {str(e)}")
             return None
     
+    @staticmethod
+    async def _generate(client: openai.AsyncClient, model_name: str, system_prompt: str, user_prompt: str,
+                        temperature: float, max_tokens: int, timeout: float) -> Optional[str]:
+        response = await client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+        )
+        
+        # Extract the generated code from the response
+        if response and response.choices and len(response.choices) > 0:
+            return response.choices[0].message.content.strip()
+        return None
+    
+    def statistics(self) -> Dict[str, Any]:
+        """Counts of API calls, including ones abandoned on timeout or disconnect"""
+        return self._runner.statistics()
+    
+    async def close(self) -> None:
+        """Close both clients' connections, cancel API calls still running and stop the background loop"""
+        async_client, self._async_client = self._async_client, None
+        if async_client is not None:
+            await async_client.close()
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            try:
+                await asyncio.wait_for(asyncio.wrap_future(self._runner.submit(client.close())), 5)
+            except Exception as e:
+                logger.warning(f"Error closing OpenAI connections: {str(e)}")
+        self._runner.close()
+    
     async def generate_code_async(self, model_name: str, system_prompt: str, user_prompt: str,
-                               temperature: float = 0.2, max_tokens: int = 4000) -> Optional[str]:
+                               temperature: float = 0.2, max_tokens: int = 4000,
+                               timeout: Optional[float] = None) -> Optional[str]:
         """
         Generate code using OpenAI API asynchronously.
         
@@ -64,26 +168,17 @@ class OpenAIApiClient:
             user_prompt: The user prompt with specific request
             temperature: The randomness parameter (default: 0.2)
             max_tokens: Maximum tokens in the response (default: 4000)
-            
+            timeout: Seconds after which the request is aborted (default from Config)
+        
         Returns:
             Optional[str]: Generated code or None if generation failed
         """
+        if self._async_client is None:
+            self._async_client = self._make_client()
+        timeout = timeout if timeout is not None else Config.AI.OPENAI_API_TIMEOUT
         try:
-            async with openai.AsyncClient(api_key=self.api_key) as client:
-                response = await client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                )
-                
-                # Extract the generated code from the response
-                if response and response.choices and len(response.choices) > 0:
-                    return response.choices[0].message.content.strip()
-                return None
+            return await self._generate(self._async_client, model_name, system_prompt, user_prompt,
+                                        temperature, max_tokens, timeout)
         except Exception as e:
             print(f"Error generating code with OpenAI async: {str(e)}")
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,231 @@
+"""
+API client for PayOS on a shared keep-alive async HTTP connection pool.
+
+Requests run on one background event loop per process, so every caller, sync or
+async, shares the same pooled connections. Each call has a deadline covering all
+of its attempts; reads are retried with jittered backoff, and writes are sent once.
+The sync methods keep the payos SDK's names and return types so the client is a
+drop-in replacement for PayOS in PaymentService.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import random
+import threading
+from typing import Any, Awaitable, Dict, Optional
+
+import httpx
+from payos import PaymentData
+from payos.custom_error import PayOSError
+from payos.type import CreatePaymentResult, PaymentLinkInformation, Transaction, WebhookData
+from payos.utils import createSignatureFromObj, createSignatureOfPaymentRequest
+
+from config import Config
+
+logger = logging.getLogger("payos_client")
+
+
+class PayOSTimeoutError(PayOSError):
+    """Raised when a call doesn't finish before its deadline"""
+
+    def __init__(self, message: str):
+        super().__init__(code="TIMEOUT", message=message)
+
+
+class PayOSClient:
+    """
+    Client for the PayOS payment link API.
+    With connection pooling, per-call deadlines and retries for reads.
+    """
+
+    def __init__(self, client_id: Optional[str] = None, api_key: Optional[str] = None,
+                 checksum_key: Optional[str] = None, base_url: Optional[str] = None,
+                 timeout: Optional[float] = None, max_retries: Optional[int] = None):
+        """
+        Args:
+            client_id: PayOS client id (default from Config)
+            api_key: PayOS API key (default from Config)
+            checksum_key: Key for signing requests and checking responses (default from Config)
+            base_url: PayOS API address; point it at a stub for offline testing (default from Config)
+            timeout: Default deadline per call in seconds, retries included (default from Config)
+            max_retries: Retries for reads after the first attempt (default from Config)
+        """
+        self.client_id = client_id or Config.PAYMENT.PAYOS_CLIENT_ID
+        self.api_key = api_key or Config.PAYMENT.PAYOS_API_KEY
+        self.checksum_key = checksum_key or Config.PAYMENT.PAYOS_CHECKSUM_KEY
+        if not (self.client_id and self.api_key and self.checksum_key):
+            raise ValueError("PayOS client id, API key and checksum key are required")
+        self.base_url = (base_url or Config.PAYMENT.PAYOS_BASE_URL).rstrip("/")
+        self.timeout = timeout if timeout is not None else Config.PAYMENT.PAYOS_TIMEOUT
+        self.max_retries = max_retries if max_retries is not None else Config.PAYMENT.PAYOS_MAX_RETRIES
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    # Event loop and connection pool
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        """Start the background loop and HTTP client on first use"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    headers={"x-client-id": self.client_id, "x-api-key": self.api_key},
+                    limits=httpx.Limits(
+                        max_connections=Config.PAYMENT.PAYOS_MAX_CONNECTIONS,
+                        max_keepalive_connections=Config.PAYMENT.PAYOS_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=Config.PAYMENT.PAYOS_KEEPALIVE_SECONDS,
+                    ),
+                    timeout=httpx.Timeout(self.timeout, connect=Config.PAYMENT.PAYOS_CONNECT_TIMEOUT),
+                )
+                self._thread = threading.Thread(target=loop.run_forever, daemon=True, name="payos-client")
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+
+    def _submit(self, coroutine: Awaitable) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._start())
+
+    def _wait(self, coroutine: Awaitable, timeout: float) -> Any:
+        """Run a coroutine on the client loop and block until it finishes or the deadline passes"""
+        future = self._submit(coroutine)
+        try:
+            # The coroutine enforces the deadline itself; the margin only covers scheduling
+            return future.result(timeout + 1)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise PayOSTimeoutError(f"PayOS call did not finish within {timeout}s")
+
+    async def _await(self, coroutine: Awaitable) -> Any:
+        """Run a coroutine on the client loop from another event loop"""
+        return await asyncio.wrap_future(self._submit(coroutine))
+
+    def close(self) -> None:
+        """Close pooled connections and stop the background loop"""
+        with self._lock:
+            loop, client = self._loop, self._client
+            self._loop = self._client = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(5)
+        except Exception as e:
+            logger.warning(f"Error closing PayOS connections: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
+
+    # Requests
+
+    async def _request(self, method: str, path: str, timeout: float, retries: int,
+                       body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Send a request and return the verified response data.
+        Connection errors, timeouts and 5xx responses are retried up to `retries` times
+        with full-jitter backoff, as long as the deadline allows.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        attempt = 0
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise PayOSTimeoutError(f"PayOS {method} {path} did not finish within {timeout}s")
+            try:
+                # httpx timeouts apply per phase; wait_for bounds the whole exchange
+                response = await asyncio.wait_for(self._client.request(
+                    method, path, json=body,
+                    timeout=httpx.Timeout(remaining, connect=min(remaining, Config.PAYMENT.PAYOS_CONNECT_TIMEOUT))
+                ), remaining)
+                if response.status_code < 500:
+                    return self._parse(response)
+                error: Exception = PayOSError(code=str(response.status_code), message="PayOS server error")
+            except (httpx.TimeoutException, asyncio.TimeoutError) as e:
+                error = PayOSTimeoutError(f"PayOS {method} {path} timed out: {e!r}")
+            except httpx.TransportError as e:
+                error = PayOSError(code="CONNECTION_ERROR", message=f"PayOS {method} {path} failed: {e!r}")
+
+            if attempt >= retries:
+                raise error
+            attempt += 1
+            delay = random.uniform(0, Config.PAYMENT.PAYOS_RETRY_BASE_DELAY * 2 ** attempt)
+            remaining = deadline - loop.time()
+            if delay >= remaining:
+                raise error
+            logger.warning(f"Retrying PayOS {method} {path} in {delay:.2f}s (attempt {attempt}): {error}")
+            await asyncio.sleep(delay)
+
+    def _parse(self, response: httpx.Response) -> Dict[str, Any]:
+        """Check a PayOS response envelope and its signature and return its data"""
+        if response.status_code != 200:
+            raise PayOSError(code=str(response.status_code), message=response.text[:200])
+        payload = response.json()
+        if payload.get("code") != "00" or payload.get("data") is None:
+            raise PayOSError(code=payload.get("code"), message=payload.get("desc"))
+        if createSignatureFromObj(payload["data"], self.checksum_key) != payload.get("signature"):
+            raise PayOSError(code="DATA_NOT_INTEGRITY", message="PayOS response signature mismatch")
+        return payload["data"]
+
+    @staticmethod
+    def _payment_link_information(data: Dict[str, Any]) -> PaymentLinkInformation:
+        data["transactions"] = [Transaction(**transaction) for transaction in data.get("transactions") or []]
+        return PaymentLinkInformation(**data)
+
+    # Operations, run on the client loop
+
+    async def _create(self, payment_data: PaymentData, timeout: float) -> CreatePaymentResult:
+        # Sent once: PayOS rejects a repeated order code, so a retry can't create a second link
+        payment_data.signature = createSignatureOfPaymentRequest(payment_data, self.checksum_key)
+        data = await self._request("POST", "/v2/payment-requests", timeout, 0, payment_data.to_json())
+        return CreatePaymentResult(**data)
+
+    async def _get_information(self, order_id: str, timeout: float) -> PaymentLinkInformation:
+        data = await self._request("GET", f"/v2/payment-requests/{order_id}", timeout, self.max_retries)
+        return self._payment_link_information(data)
+
+    async def _cancel(self, order_id: str, reason: Optional[str], timeout: float) -> PaymentLinkInformation:
+        body = {"cancellationReason": reason} if reason is not None else None
+        data = await self._request("POST", f"/v2/payment-requests/{order_id}/cancel", timeout, 0, body)
+        return self._payment_link_information(data)
+
+    # Async API
+
+    async def create_payment_link(self, payment_data: PaymentData,
+                                  timeout: Optional[float] = None) -> CreatePaymentResult:
+        """Create a payment link"""
+        return await self._await(self._create(payment_data, timeout or self.timeout))
+
+    async def get_payment_link_information(self, order_id: str,
+                                           timeout: Optional[float] = None) -> PaymentLinkInformation:
+        """Get a payment link's status and transactions, retrying on failure"""
+        return await self._await(self._get_information(order_id, timeout or self.timeout))
+
+    async def cancel_payment_link(self, order_id: str, reason: Optional[str] = None,
+                                  timeout: Optional[float] = None) -> PaymentLinkInformation:
+        """Cancel a payment link"""
+        return await self._await(self._cancel(order_id, reason, timeout or self.timeout))
+
+    # Sync API, compatible with the payos SDK
+
+    def createPaymentLink(self, paymentData: PaymentData, timeout: Optional[float] = None) -> CreatePaymentResult:
+        timeout = timeout or self.timeout
+        return self._wait(self._create(paymentData, timeout), timeout)
+
+    def getPaymentLinkInformation(self, orderId: str, timeout: Optional[float] = None) -> PaymentLinkInformation:
+        timeout = timeout or self.timeout
+        return self._wait(self._get_information(orderId, timeout), timeout)
+
+    def cancelPaymentLink(self, orderId: str, cancellationReason: Optional[str] = None,
+                          timeout: Optional[float] = None) -> PaymentLinkInformation:
+        timeout = timeout or self.timeout
+        return self._wait(self._cancel(orderId, cancellationReason, timeout), timeout)
+
+    def verifyPaymentWebhookData(self, webhookBody: Dict[str, Any]) -> WebhookData:
+        """Check a webhook's signature locally; no request is made"""
+        data = webhookBody.get("data")
+        signature = webhookBody.get("signature")
+        if data is None or signature is None:
+            raise ValueError("Webhook body has no data or signature")
+        if createSignatureFromObj(data=data, key=self.checksum_key) != signature:
+            raise PayOSError(code="DATA_NOT_INTEGRITY", message="Webhook signature mismatch")
+        return WebhookData(**data)
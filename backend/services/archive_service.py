@@ -0,0 +1,106 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import logging
+
+from sqlalchemy.orm import Session
+
+from config import Config
+from core.dependency_injection import DIContainer
+from models import CodeGeneration
+from repositories.archive_repository import CodeArchiveRepository
+from repositories.code_blob_repository import CodeBlobRepository
+
+logger = logging.getLogger("archive_service")
+
+ARCHIVED_FIELDS = [
+    "id", "user_id", "model_name", "language", "prompt", "generated_code", "credits_used", "timestamp",
+    "reused_from"
+]
+
+# Keep IN lists well under SQLite's bound parameter limit
+DELETE_CHUNK_SIZE = 500
+
+
+class ArchiveService:
+    """
+    Service for moving old code generations out of the hot table into
+    compressed segment files, and for reading them back.
+    """
+
+    @staticmethod
+    def get_archive() -> CodeArchiveRepository:
+        """Get the shared archive repository"""
+        return DIContainer.get_instance(CodeArchiveRepository)
+
+    @staticmethod
+    def archive_old_generations(db: Session, older_than_days: Optional[int] = None) -> Dict[str, int]:
+        """
+        Archive every generation older than the cutoff, one segment per batch.
+        Each batch is written and fsynced before its rows are deleted, so a crash
+        can at worst leave a row in both places, never in neither.
+
+        Args:
+            db: Database session
+            older_than_days: Age cutoff in days (default from Config)
+
+        Returns:
+            Number of archived rows and written segments
+        """
+        if older_than_days is None:
+            older_than_days = Config.ARCHIVE.ARCHIVE_AFTER_DAYS
+        cutoff = (datetime.utcnow() - timedelta(days=older_than_days)).isoformat()
+        archive = ArchiveService.get_archive()
+        blob_repository = CodeBlobRepository(db)
+        columns = [getattr(CodeGeneration, field) for field in ARCHIVED_FIELDS] + [CodeGeneration.code_hash]
+
+        archived = 0
+        segments = 0
+        while True:
+            rows = db.query(*columns)\
+                .filter(CodeGeneration.timestamp < cutoff)\
+                .order_by(CodeGeneration.id)\
+                .limit(Config.ARCHIVE.SEGMENT_MAX_ROWS)\
+                .all()
+            if not rows:
+                break
+
+            # Segments hold the code itself, so archived rows give up their blob references
+            records = [dict(zip(ARCHIVED_FIELDS, row[:-1])) for row in rows]
+            blob_references = Counter(row[-1] for row in rows if row[-1])
+            archive.write_segment(records)
+
+            ids = [record["id"] for record in records]
+            try:
+                for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                    db.query(CodeGeneration)\
+                        .filter(CodeGeneration.id.in_(ids[start:start + DELETE_CHUNK_SIZE]))\
+                        .delete(synchronize_session=False)
+                for code_hash, count in blob_references.items():
+                    blob_repository.release(code_hash, count)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Error removing archived rows from code_generations: {str(e)}")
+                raise
+
+            archived += len(records)
+            segments += 1
+
+        logger.info(f"Archived {archived} code generations older than {cutoff} into {segments} segments")
+        return {"archived": archived, "segments": segments}
+
+    @staticmethod
+    def get_generation(db: Session, code_gen_id: int) -> Optional[CodeGeneration]:
+        """
+        Get a code generation from the hot table, falling back to the archive.
+        Archived records are returned as detached CodeGeneration objects.
+        """
+        code_gen = db.query(CodeGeneration).filter(CodeGeneration.id == code_gen_id).first()
+        if code_gen:
+            return code_gen
+
+        record = ArchiveService.get_archive().get(code_gen_id)
+        if record:
+            return CodeGeneration(**{field: record.get(field) for field in ARCHIVED_FIELDS})
+        return None
@@ -11,7 +11,14 @@ from repositories.user_repository import UserRepository
 from repositories.model_repository import ModelPricingRepository
 from repositories.code_repository import CodeGenerationRepository
 from services.api_clients import GoogleApiClient, OpenAIApiClient, GoogleAPIKeyManager
+from services.archive_service import ArchiveService
+from services.prompt_similarity import PromptSimilarityIndex
+from services.history_writer import HistoryWriteBehindBuffer
+from services.generation_scheduler import GenerationScheduler
+from services.user_service import UserService
+from database import SessionLocal
 from core.dependency_injection import DIContainer
+from core.deadline import Deadline, DeadlineExceeded, RequestCancelled
 
 # Configure logging
 logger = logging.getLogger("code_generation_service")
@@ -29,6 +36,8 @@ google_client = DIContainer.get_instance(
     google_key_manager
 )
 openai_client = DIContainer.get_instance(OpenAIApiClient, Config.AI.OPENAI_API_KEY)
+prompt_index = DIContainer.get_instance(PromptSimilarityIndex)
+scheduler = DIContainer.get_instance(GenerationScheduler)
 
 class DirectAPICodeGenerator:
     """
@@ -44,7 +53,8 @@ class DirectAPICodeGenerator:
         return Config.AI.CODE_PROMPT_TEMPLATE.format(language=language, prompt=prompt)
        
     @classmethod
-    def generate_code_with_openai(cls, model_name: str, prompt: str, language: Optional[str] = None) -> Optional[str]:
+    def generate_code_with_openai(cls, model_name: str, prompt: str, language: Optional[str] = None,
+                                  deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         Generate code using OpenAI API directly.
         
@@ -52,6 +62,7 @@ class DirectAPICodeGenerator:
             model_name: The specific OpenAI model to use
             prompt: The code generation prompt
             language: Optional programming language preference
+            deadline: Optional request deadline the API call must finish within
             
         Returns:
             Optional[str]: The generated code or None if generation failed
@@ -62,6 +73,9 @@ class DirectAPICodeGenerator:
             logger.info(f"Formatted Prompt for OpenAI: {formatted_prompt[:100]}...")
             
             system_prompt = "You are a code generation assistant. Provide only the code without comments, explanations, or markdown formatting."
+            timeout = Config.AI.OPENAI_API_TIMEOUT
+            if deadline is not None:
+                timeout = deadline.limit(timeout)
             
             # Use the OpenAI client to generate code
             return openai_client.generate_code(
@@ -69,14 +83,19 @@ class DirectAPICodeGenerator:
                 system_prompt=system_prompt,
                 user_prompt=formatted_prompt,
                 temperature=Config.AI.DEFAULT_TEMPERATURE,
-                max_tokens=Config.AI.DEFAULT_MAX_TOKENS
+                max_tokens=Config.AI.DEFAULT_MAX_TOKENS,
+                timeout=timeout,
+                deadline=deadline
             )
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error generating code with OpenAI: {str(e)}")
             return None
     
     @classmethod
-    def generate_code_with_google(cls, model_name: str, prompt: str, language: Optional[str] = None) -> Optional[str]:
+    def generate_code_with_google(cls, model_name: str, prompt: str, language: Optional[str] = None,
+                                  deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         Generate code using Google's Generative AI API directly.
         
@@ -84,6 +103,7 @@ class DirectAPICodeGenerator:
             model_name: The specific Google model to use
             prompt: The code generation prompt
             language: Optional programming language preference
+            deadline: Optional request deadline bounding the API calls and their retries
             
         Returns:
             Optional[str]: The generated code or None if generation failed
@@ -104,8 +124,10 @@ class DirectAPICodeGenerator:
             logger.info("Calling Google API client to generate content")
             # Wrap the API call in a try block to catch any errors
             try:
-                raw_response = google_client.generate_content(actual_model, messages)
+                raw_response = google_client.generate_content(actual_model, messages, deadline)
                 logger.info(f"Response received from Google client: {'Not None' if raw_response else 'None'}")
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 logger.error(f"Exception during Google API call: {str(e)}")
                 return None
@@ -131,12 +153,15 @@ class DirectAPICodeGenerator:
             
             logger.warning("No response received from Google API")
             return None
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error generating code with Google: {str(e)}")
             return None
     
     @classmethod
-    def generate_code(cls, model_name: str, prompt: str, language: Optional[str] = None) -> Optional[str]:
+    def generate_code(cls, model_name: str, prompt: str, language: Optional[str] = None,
+                      deadline: Optional[Deadline] = None) -> Optional[str]:
         """
         Generate code using either OpenAI or Google API based on the model name.
         
@@ -144,20 +169,30 @@ class DirectAPICodeGenerator:
             model_name: The name of the model to use for code generation
             prompt: The prompt describing the code to generate
             language: Optional programming language preference
+            deadline: Optional request deadline; provider calls and retries stop when it passes
             
         Returns:
             Optional[str]: The generated code or None if generation failed
+            
+        Raises:
+            DeadlineExceeded: If the deadline passed before code was generated
         """
         try:
             # Route to the appropriate API based on the model name
             if model_name.lower() in [m.lower() for m in Config.AI.OPENAI_MODELS]:
-                return cls.generate_code_with_openai(model_name, prompt, language)
+                code = cls.generate_code_with_openai(model_name, prompt, language, deadline)
             elif model_name.lower() in [m.lower() for m in Config.AI.GOOGLE_MODELS]:
-                return cls.generate_code_with_google(model_name, prompt, language)
+                code = cls.generate_code_with_google(model_name, prompt, language, deadline)
             else:
                 # Default to OpenAI for unrecognized models
                 logger.warning(f"Unrecognized model '{model_name}', defaulting to {Config.AI.DEFAULT_MODEL}")
-                return cls.generate_code_with_openai(Config.AI.DEFAULT_MODEL, prompt, language)
+                code = cls.generate_code_with_openai(Config.AI.DEFAULT_MODEL, prompt, language, deadline)
+            if code is None and deadline is not None and deadline.expired:
+                # The provider gave up on its own timeout, which the deadline had shortened
+                raise DeadlineExceeded("Request deadline passed during code generation")
+            return code
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             logger.error(f"Error in generate_code: {str(e)}")
             return None
@@ -202,12 +237,50 @@ class CodeGenerationService:
         
         return CodeGenerationService(user_repo, model_repo, code_repo)
     
+    def _find_similar_generation(
+        self,
+        user_id: int,
+        model_name: str,
+        prompt: str,
+        language: Optional[str]
+    ) -> Optional[CodeGeneration]:
+        """
+        Find a stored generation for a near-duplicate prompt with the same language and model.
+        Only the user's own history is searched unless sharing across users is on.
+        
+        Args:
+            user_id: ID of the user making the request
+            model_name: Name of the model requested
+            prompt: The code generation prompt
+            language: Optional programming language preference
+            
+        Returns:
+            Optional[CodeGeneration]: The similar generation, or None if reuse is off or nothing matches
+        """
+        if not (prompt_index.enabled and prompt_index.ready):
+            return None
+        try:
+            owner = None if prompt_index.share_across_users else user_id
+            match = prompt_index.query(prompt, language, model_name, user_id=owner)
+            if not match:
+                return None
+            code_gen_id, similarity = match
+            logger.info(f"Found similar prompt in generation {code_gen_id} (similarity {similarity:.2f})")
+            similar_gen = ArchiveService.get_generation(self.code_repository.db, code_gen_id)
+            if similar_gen and similar_gen.generated_code:
+                return similar_gen
+        except Exception as e:
+            logger.exception(f"Error looking up similar prompts: {str(e)}")
+        return None
+    
     def process_generation_request(
         self, 
         user_id: int, 
         model_name: str, 
         prompt: str,
-        language: Optional[str] = None
+        language: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        allow_reuse: bool = True
     ) -> Optional[CodeGeneration]:
         """
         Process a code generation request, check credits, and record the transaction.
@@ -217,9 +290,17 @@ class CodeGenerationService:
             model_name: Name of the model to use
             prompt: The code generation prompt
             language: Optional programming language preference
+            deadline: Optional request deadline for queueing and the provider calls
+            allow_reuse: Whether a stored result for a near-identical prompt may be returned instead
             
         Returns:
-            Optional[CodeGeneration]: The code generation record or None if failed
+            Optional[CodeGeneration]: The code generation record or None if failed; reused_from
+            is set when it holds a stored result rather than a new generation
+            
+        Raises:
+            GenerationBusyError: If the providers were too busy to take the request; no credits are charged
+            DeadlineExceeded: If the deadline passed before code was generated; no credits are charged
+            RequestCancelled: If the client disconnected before the result was recorded; no credits are charged
         """
         
         # Get the user
@@ -247,35 +328,78 @@ class CodeGenerationService:
             logger.warning(f"User {user_id} has insufficient credits: {user.credits} < {model_pricing.credit_cost_per_request}")
             return None
         
-        # Generate code using direct API calls
-        logger.info(f"Calling API to generate code with model: {model_name}")
-        try:
-            generated_code = DirectAPICodeGenerator.generate_code(model_name, prompt, language)
+        credits_cost = model_pricing.credit_cost_per_request
+        generated_code = None
+        
+        # Reuse a prior generation of a near-identical prompt at reduced cost
+        similar_gen = self._find_similar_generation(user_id, model_name, prompt, language) if allow_reuse else None
+        reused_from = similar_gen.id if similar_gen else None
+        if similar_gen:
+            generated_code = similar_gen.generated_code
+            credits_cost = model_pricing.credit_cost_per_request * prompt_index.credit_ratio
+            logger.info(f"Reusing code generation {similar_gen.id} for a similar prompt at {credits_cost} credits")
+        else:
+            # Generate code using direct API calls, once the scheduler gives this user's tier a slot
+            tier = UserService.get_tier(self.user_repository.db, user)
+            # End the read transaction so the session's connection goes back to the pool while
+            # queued; a long queue would otherwise hold every connection, including the ones the
+            # running generations need to record their results
+            self.user_repository.db.commit()
+            with scheduler.slot(user_id, tier, deadline) as ticket:
+                logger.info(f"Calling API to generate code with model: {model_name} "
+                            f"({tier} tier, queued {ticket.waited * 1000:.0f} ms)")
+                try:
+                    generated_code = DirectAPICodeGenerator.generate_code(model_name, prompt, language, deadline)
+                    
+                    # Log the generated code (truncated for brevity)
+                    if generated_code:
+                        code_preview = generated_code[:100] + "..." if len(generated_code) > 100 else generated_code
+                        logger.info(f"Code generation successful. Preview: {code_preview}")
+                    else:
+                        logger.warning("Code generation returned None")
+                    if deadline is not None and deadline.cancelled:
+                        # A provider call that couldn't be interrupted finished after the client left
+                        raise RequestCancelled("Client disconnected during code generation")
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    logger.exception(f"Exception during code generation: {str(e)}")
+                    return None
             
-            # Log the generated code (truncated for brevity)
-            if generated_code:
-                code_preview = generated_code[:100] + "..." if len(generated_code) > 100 else generated_code
-                logger.info(f"Code generation successful. Preview: {code_preview}")
-            else:
-                logger.warning("Code generation returned None")
-        except Exception as e:
-            logger.exception(f"Exception during code generation: {str(e)}")
-            return None
+            # If code generation failed, return None
+            if generated_code is None:
+                logger.warning("No code was generated, returning None")
+                return None
         
-        # If code generation failed, return None
-        if generated_code is None:
-            logger.warning("No code was generated, returning None")
-            return None
+        # Nobody will read the result of a request whose client has gone; don't charge for it
+        if deadline is not None and deadline.cancelled:
+            logger.info(f"Client of user {user_id} disconnected, skipping the charge and history record")
+            raise RequestCancelled("Client disconnected before the generation was recorded")
         
         # Deduct credits from user
-        logger.info(f"Deducting {model_pricing.credit_cost_per_request} credits from user {user_id}")
+        logger.info(f"Deducting {credits_cost} credits from user {user_id}")
         try:
-            self.user_repository.update_credits(user_id, -model_pricing.credit_cost_per_request)
-            logger.info(f"Credits updated successfully, new balance: {user.credits - model_pricing.credit_cost_per_request}")
+            self.user_repository.update_credits(user_id, -credits_cost)
+            logger.info(f"Credits updated successfully, new balance: {user.credits - credits_cost}")
         except Exception as e:
             logger.exception(f"Error updating user credits: {str(e)}")
             # Continue process even if credit update fails
         
+        # Queue the history record when write-behind is on; it's written synchronously otherwise
+        if Config.HISTORY.WRITE_BEHIND:
+            code_gen = DIContainer.get_instance(HistoryWriteBehindBuffer, SessionLocal).submit(
+                user_id=user_id,
+                model_name=model_name,
+                prompt=prompt,
+                generated_code=generated_code,
+                credits_used=credits_cost,
+                language=language,
+                reused_from=reused_from
+            )
+            if code_gen:
+                logger.info("Code generation record queued for write-behind")
+                return code_gen
+        
         # Create code generation record
         logger.info("Creating code generation record in database")
         try:
@@ -284,9 +408,13 @@ class CodeGenerationService:
                 model_name=model_name,
                 prompt=prompt,
                 generated_code=generated_code,
-                credits_used=model_pricing.credit_cost_per_request
+                credits_used=credits_cost,
+                language=language,
+                reused_from=reused_from
             )
             logger.info(f"Code generation record created successfully with ID: {code_gen.id if code_gen else 'Unknown'}")
+            if not similar_gen:
+                prompt_index.add(code_gen.id, prompt, language, model_name, user_id)
         except Exception as e:
             logger.exception(f"Error creating code generation record: {str(e)}")
             return None
@@ -1,8 +1,10 @@
+from datetime import datetime
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from fastapi import HTTPException
 
 from models import CodeGeneration
+from repositories.base import filter_time_range
 
 
 class CodeHistoryService:
@@ -23,9 +25,11 @@ class CodeHistoryService:
         ).order_by(CodeGeneration.id.desc()).offset(skip).limit(limit).all()
     
     @staticmethod
-    def get_all_code_history(db: Session, skip: int = 0, limit: int = 100) -> List[CodeGeneration]:
-        """Get all code generation history"""
-        return db.query(CodeGeneration).order_by(
+    def get_all_code_history(db: Session, skip: int = 0, limit: int = 100,
+                             start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[CodeGeneration]:
+        """Get all code generation history, optionally within [start, end)"""
+        query = filter_time_range(db.query(CodeGeneration), CodeGeneration.timestamp, start, end)
+        return query.order_by(
             CodeGeneration.id.desc()
         ).offset(skip).limit(limit).all()
     
@@ -35,6 +39,7 @@ class CodeHistoryService:
         return db.query(CodeGeneration).filter(CodeGeneration.user_id == user_id).count()
     
     @staticmethod
-    def get_all_code_history_count(db: Session) -> int:
-        """Get the count of all code generation history"""
-        return db.query(CodeGeneration).count()
\ No newline at end of file
+    def get_all_code_history_count(db: Session, start: Optional[datetime] = None,
+                                   end: Optional[datetime] = None) -> int:
+        """Get the count of all code generation history, optionally within [start, end)"""
+        return filter_time_range(db.query(CodeGeneration), CodeGeneration.timestamp, start, end).count()
\ No newline at end of file
@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+from sqlalchemy.orm import Session
+
+from config import Config
+from database import SessionLocal
+from models import CodeGeneration, PaymentTransaction
+from repositories.base import filter_time_range
+
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+class ExportService:
+    """
+    Service for streaming large admin exports.
+    Rows are read from a server-side cursor in fixed-size batches and written out
+    as they arrive, so memory use does not depend on the size of the export.
+    """
+
+    CODE_HISTORY_FIELDS = [
+        "id", "user_id", "model_name", "language", "prompt", "generated_code", "credits_used", "timestamp"
+    ]
+    PAYMENT_FIELDS = [
+        "id", "user_id", "amount", "credits", "transaction_id", "status", "created_at", "completed_at"
+    ]
+
+    @staticmethod
+    def code_history_query(
+        db: Session,
+        user_id: Optional[int] = None,
+        model_name: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ):
+        """Build the filtered code history query, selecting plain columns only"""
+        query = db.query(*[getattr(CodeGeneration, field) for field in ExportService.CODE_HISTORY_FIELDS])
+        if user_id is not None:
+            query = query.filter(CodeGeneration.user_id == user_id)
+        if model_name:
+            query = query.filter(CodeGeneration.model_name == model_name)
+        query = filter_time_range(query, CodeGeneration.timestamp, start, end)
+        return query.order_by(CodeGeneration.id)
+
+    @staticmethod
+    def payments_query(
+        db: Session,
+        user_id: Optional[int] = None,
+        status: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ):
+        """Build the filtered payment transaction query, selecting plain columns only"""
+        query = db.query(*[getattr(PaymentTransaction, field) for field in ExportService.PAYMENT_FIELDS])
+        if user_id is not None:
+            query = query.filter(PaymentTransaction.user_id == user_id)
+        if status:
+            query = query.filter(PaymentTransaction.status == status)
+        query = filter_time_range(query, PaymentTransaction.created_at, start, end)
+        return query.order_by(PaymentTransaction.id)
+
+    @staticmethod
+    def serialize(rows: Iterable, fields: List[str], fmt: str, batch_size: int) -> Iterator[str]:
+        """
+        Serialize rows to NDJSON or CSV, yielding one chunk per batch of rows.
+
+        Args:
+            rows: Iterable of row tuples in the order of fields
+            fields: Column names
+            fmt: "ndjson" or "csv"
+            batch_size: Number of rows per yielded chunk
+
+        Yields:
+            Encoded text chunks
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == "csv" else None
+        if writer:
+            writer.writerow(fields)
+
+        pending = 0
+        for row in rows:
+            if writer:
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(dict(zip(fields, row)), ensure_ascii=False))
+                buffer.write("\n")
+            pending += 1
+            if pending >= batch_size:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+                pending = 0
+
+        remaining = buffer.getvalue()
+        if remaining:
+            yield remaining
+
+    @staticmethod
+    def _stream(build_query, fields: List[str], fmt: str, **filters) -> Iterator[str]:
+        """
+        Run a query on a dedicated session and stream it out.
+        The session is owned by the generator rather than the request, because the
+        response body is produced after the request-scoped session has been closed.
+        Exports read from a replica when one is configured.
+        """
+        batch_size = Config.EXPORT.BATCH_SIZE
+        db = SessionLocal(info={"use_replica": True})
+        try:
+            rows = build_query(db, **filters).yield_per(batch_size)
+            yield from ExportService.serialize(rows, fields, fmt, batch_size)
+        finally:
+            db.close()
+
+    @staticmethod
+    def stream_code_history(fmt: str, **filters) -> Iterator[str]:
+        """Stream code generation history matching the filters"""
+        return ExportService._stream(
+            ExportService.code_history_query, ExportService.CODE_HISTORY_FIELDS, fmt, **filters
+        )
+
+    @staticmethod
+    def stream_payments(fmt: str, **filters) -> Iterator[str]:
+        """Stream payment transactions matching the filters"""
+        return ExportService._stream(
+            ExportService.payments_query, ExportService.PAYMENT_FIELDS, fmt, **filters
+        )
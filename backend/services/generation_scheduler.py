@@ -0,0 +1,327 @@
+"""
+Weighted fair scheduling of code generation requests onto the AI providers.
+
+Only CONCURRENCY generations run at once. Requests beyond that wait in one queue
+per user tier, and a freed slot goes to the tier that has received the least
+service relative to its weight (start-time fair queueing). With the default
+weights, waiting paid requests get four slots for every free one, so a burst of
+free requests can't hold up paying users; an idle tier doesn't bank credit for
+later. A user never has more than PER_USER_CONCURRENCY generations running, and
+their further requests wait without blocking other users of the same tier.
+
+Admission control sheds load before it queues: a new request is rejected at once
+when its tier's estimated wait, from the queue ahead of it and the recent time
+generations hold a slot, exceeds WAIT_BUDGET_SECONDS, or when the queue is full.
+When the providers stall (e.g. every Google key is rate limited and requests sit
+in retry sleeps) slots are held longer, the estimate grows and new requests are
+turned away instead of piling up behind them.
+
+Requests wait for their slot in a worker thread, so the routes run them on the
+scheduler's own thread_limiter rather than the shared threadpool: a full queue
+then can't take the threads every other sync endpoint needs.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional, Set
+
+from anyio import CapacityLimiter
+
+from config import Config
+from core.deadline import Deadline, DeadlineExceeded, RequestCancelled
+
+logger = logging.getLogger("generation_scheduler")
+
+
+class GenerationBusyError(Exception):
+    """The providers can't take a request now; retry after `retry_after` seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GenerationOverloadedError(GenerationBusyError):
+    """Raised when a request is rejected on arrival because the queue is too long"""
+
+
+class GenerationQueueTimeout(GenerationBusyError, TimeoutError):
+    """Raised when a request waits longer than the queue allows"""
+
+
+class SchedulerTicket:
+    """A request's place in the scheduler, from arrival until its slot is released."""
+    __slots__ = ("user_id", "tier", "enqueued", "started", "event", "granted")
+
+    def __init__(self, user_id: int, tier: str):
+        self.user_id = user_id
+        self.tier = tier
+        self.enqueued = time.monotonic()
+        self.started = 0.0
+        self.event = threading.Event()
+        self.granted = False
+
+    @property
+    def waited(self) -> float:
+        """Seconds spent in the queue"""
+        return self.started - self.enqueued
+
+
+class _TierStats:
+    __slots__ = ("waits", "dispatched", "timed_out", "rejected", "cancelled", "running", "last_dispatch")
+
+    def __init__(self, samples: int):
+        self.waits: Deque[float] = deque(maxlen=samples)
+        self.dispatched = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self.cancelled = 0  # Client disconnected while queued or generating
+        self.running = 0
+        self.last_dispatch = float("-inf")
+
+
+def _percentile(ordered, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class GenerationScheduler:
+    """Admits generation requests to the providers by tier weight and per-user limits."""
+
+    # Weight of the newest sample in the moving average of slot hold times
+    SERVICE_TIME_ALPHA = 0.2
+    # A tier that took a slot this recently still competes for capacity, even if its
+    # users are between requests right now
+    ACTIVE_SECONDS = 10.0
+
+    def __init__(self, concurrency: Optional[int] = None, weights: Optional[Dict[str, float]] = None,
+                 per_user: Optional[int] = None, max_wait: Optional[float] = None,
+                 wait_budget: Optional[float] = None, max_queue: Optional[int] = None):
+        """
+        Args:
+            concurrency: Generations running at once (default from Config)
+            weights: Tier -> share of capacity under contention (default from Config)
+            per_user: Generations one user may have running at once (default from Config)
+            max_wait: Seconds a request may wait for a slot (default from Config)
+            wait_budget: Largest estimated wait at which requests are still admitted (default from Config)
+            max_queue: Waiting requests at which new ones are rejected (default from Config)
+        """
+        self.concurrency = concurrency or Config.SCHEDULER.CONCURRENCY
+        self.weights = dict(weights or Config.SCHEDULER.TIER_WEIGHTS)
+        self.per_user = per_user or Config.SCHEDULER.PER_USER_CONCURRENCY
+        self.max_wait = max_wait if max_wait is not None else Config.SCHEDULER.MAX_QUEUE_WAIT_SECONDS
+        self.wait_budget = wait_budget if wait_budget is not None else Config.SCHEDULER.WAIT_BUDGET_SECONDS
+        self.max_queue = max_queue if max_queue is not None else Config.SCHEDULER.MAX_QUEUE_DEPTH
+        self._lock = threading.Lock()
+        self._queues: Dict[str, Deque[SchedulerTicket]] = {}
+        self._pass: Dict[str, float] = {}
+        self._stats: Dict[str, _TierStats] = {}
+        self._virtual_time = 0.0
+        self._running = 0
+        self._active: Set[SchedulerTicket] = set()
+        self._user_running: Dict[int, int] = {}
+        self._service_time: Optional[float] = None
+        # Worker threads for generation requests, separate from the shared threadpool.
+        # There are enough for every running and queued request plus THREAD_HEADROOM for
+        # requests being admitted, rejected or recording their result, so a queued paid
+        # request never waits behind free ones for a thread
+        self.thread_limiter = CapacityLimiter(self.concurrency + self.max_queue + Config.SCHEDULER.THREAD_HEADROOM)
+        for tier in self.weights:
+            self._add_tier(tier)
+
+    def _add_tier(self, tier: str) -> None:
+        # Tiers without a configured weight get the smallest one
+        self.weights.setdefault(tier, min(self.weights.values(), default=1))
+        self._queues[tier] = deque()
+        self._pass[tier] = self._virtual_time
+        self._stats[tier] = _TierStats(Config.SCHEDULER.WAIT_SAMPLES)
+
+    @contextmanager
+    def slot(self, user_id: int, tier: str, deadline: Optional[Deadline] = None) -> Iterator[SchedulerTicket]:
+        """
+        Hold a provider slot for the duration of the block.
+        A request with a deadline waits no longer than its deadline allows, and
+        requests cancelled because their client disconnected are counted.
+
+        Yields:
+            The request's ticket; ticket.waited is the time spent queueing
+
+        Raises:
+            GenerationOverloadedError: If the request was shed on arrival
+            GenerationQueueTimeout: If no slot was free within max_wait
+            DeadlineExceeded: If the deadline passed while waiting
+            RequestCancelled: If the deadline was cancelled while waiting
+        """
+        ticket = self.acquire(user_id, tier, deadline)
+        try:
+            yield ticket
+        except RequestCancelled:
+            with self._lock:
+                self._stats[tier].cancelled += 1
+            raise
+        finally:
+            self.release(ticket)
+
+    def acquire(self, user_id: int, tier: str, deadline: Optional[Deadline] = None) -> SchedulerTicket:
+        """Admit a request and wait for a provider slot; release() must follow"""
+        ticket = SchedulerTicket(user_id, tier)
+        wait = self.max_wait if deadline is None else min(self.max_wait, deadline.check())
+        with self._lock:
+            if tier not in self._queues:
+                self._add_tier(tier)
+            self._admit(tier, wait)
+            queue = self._queues[tier]
+            if not queue:
+                # A tier that was idle starts at the current virtual time rather than
+                # catching up on the service it didn't use
+                self._pass[tier] = max(self._pass[tier], self._virtual_time)
+            queue.append(ticket)
+            self._dispatch()
+
+        if deadline is not None:
+            deadline.on_cancel(ticket.event.set)
+        if not ticket.event.wait(wait) or not ticket.granted:
+            with self._lock:
+                if not ticket.granted:
+                    self._queues[tier].remove(ticket)
+                    stats = self._stats[tier]
+                    if deadline is not None and deadline.cancelled:
+                        stats.cancelled += 1
+                        raise RequestCancelled("Client disconnected while queued for a generation slot")
+                    stats.timed_out += 1
+                    if deadline is not None and deadline.expired:
+                        raise DeadlineExceeded("Request deadline passed while queued for a generation slot")
+                    retry_after = max(1.0, _percentile(sorted(stats.waits), 0.5))
+                    raise GenerationQueueTimeout(
+                        f"No generation slot for {tier} user {user_id} within {self.max_wait}s",
+                        retry_after
+                    )
+        with self._lock:
+            self._stats[tier].waits.append(ticket.waited)
+        return ticket
+
+    def release(self, ticket: SchedulerTicket) -> None:
+        """Give back a slot taken by acquire()"""
+        held = time.monotonic() - ticket.started
+        with self._lock:
+            self._active.discard(ticket)
+            self._running -= 1
+            self._stats[ticket.tier].running -= 1
+            remaining = self._user_running.get(ticket.user_id, 1) - 1
+            if remaining > 0:
+                self._user_running[ticket.user_id] = remaining
+            else:
+                self._user_running.pop(ticket.user_id, None)
+            if self._service_time is None:
+                self._service_time = held
+            else:
+                self._service_time += self.SERVICE_TIME_ALPHA * (held - self._service_time)
+            self._dispatch()
+
+    def _estimated_service_time(self, now: float) -> float:
+        """Seconds a generation holds a slot; called with the lock held"""
+        service = self._service_time or 0.0
+        if self._active:
+            # Generations that are stuck right now count before they finish
+            service = max(service, sum(now - t.started for t in self._active) / len(self._active))
+        return service
+
+    def _estimated_wait(self, tier: str, now: float) -> float:
+        """Seconds a request arriving now in `tier` would wait; called with the lock held"""
+        queued = len(self._queues[tier])
+        if self._running < self.concurrency and not queued:
+            return 0.0
+        # While this tier's queue drains, the other active tiers keep taking slots in
+        # proportion to their weight
+        busy_weight = self.weights[tier] + sum(
+            self.weights[other] for other, queue in self._queues.items()
+            if other != tier and (queue or now - self._stats[other].last_dispatch < self.ACTIVE_SECONDS)
+        )
+        share = self.weights[tier] / busy_weight
+        return (queued + 1) * self._estimated_service_time(now) / (self.concurrency * share)
+
+    def _admit(self, tier: str, wait: float) -> None:
+        """
+        Shed a new request if the queue is full or it would wait too long, either
+        beyond the budget or beyond the `wait` it can afford; called with the lock held
+        """
+        now = time.monotonic()
+        depth = sum(len(queue) for queue in self._queues.values())
+        estimated = self._estimated_wait(tier, now)
+        if depth < self.max_queue and estimated <= min(self.wait_budget, wait):
+            return
+        self._stats[tier].rejected += 1
+        service = self._estimated_service_time(now)
+        # Roughly when enough of the backlog will have drained to admit this request again
+        retry_after = max(1.0, estimated - self.wait_budget,
+                          (depth - self.max_queue + 1) * service / self.concurrency)
+        raise GenerationOverloadedError(
+            f"Rejected {tier} request: {depth} queued, estimated wait {estimated:.1f}s", retry_after
+        )
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting requests; called with the lock held"""
+        while self._running < self.concurrency:
+            chosen: Optional[SchedulerTicket] = None
+            for tier, queue in self._queues.items():
+                waiter = next((w for w in queue if self._user_running.get(w.user_id, 0) < self.per_user), None)
+                if waiter is None:
+                    continue
+                if chosen is None or (self._pass[tier], -self.weights[tier]) < \
+                        (self._pass[chosen.tier], -self.weights[chosen.tier]):
+                    chosen = waiter
+            if chosen is None:
+                return
+
+            tier = chosen.tier
+            self._queues[tier].remove(chosen)
+            self._virtual_time = self._pass[tier]
+            self._pass[tier] += 1 / self.weights[tier]
+            self._running += 1
+            self._user_running[chosen.user_id] = self._user_running.get(chosen.user_id, 0) + 1
+            stats = self._stats[tier]
+            stats.running += 1
+            stats.dispatched += 1
+            chosen.granted = True
+            chosen.started = stats.last_dispatch = time.monotonic()
+            self._active.add(chosen)
+            chosen.event.set()
+
+    def statistics(self) -> Dict[str, Any]:
+        """Queue lengths and queue-wait percentiles per tier over the recent requests"""
+        with self._lock:
+            now = time.monotonic()
+            tiers = {}
+            for tier, stats in self._stats.items():
+                waits = sorted(stats.waits)
+                tiers[tier] = {
+                    "weight": self.weights[tier],
+                    "queued": len(self._queues[tier]),
+                    "running": stats.running,
+                    "dispatched": stats.dispatched,
+                    "timed_out": stats.timed_out,
+                    "rejected": stats.rejected,
+                    "cancelled": stats.cancelled,
+                    "estimated_wait_seconds": round(self._estimated_wait(tier, now), 2),
+                    "wait_ms": {
+                        "samples": len(waits),
+                        "mean": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                        "p50": round(1000 * _percentile(waits, 0.5), 1),
+                        "p95": round(1000 * _percentile(waits, 0.95), 1),
+                        "p99": round(1000 * _percentile(waits, 0.99), 1),
+                        "max": round(1000 * waits[-1], 1) if waits else 0.0,
+                    },
+                }
+            return {
+                "concurrency": self.concurrency,
+                "per_user_concurrency": self.per_user,
+                "max_queue_wait_seconds": self.max_wait,
+                "wait_budget_seconds": self.wait_budget,
+                "max_queue_depth": self.max_queue,
+                "threads": {"total": self.thread_limiter.total_tokens, "busy": self.thread_limiter.borrowed_tokens},
+                "running": self._running,
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "service_seconds": round(self._estimated_service_time(now), 3),
+                "tiers": tiers,
+            }
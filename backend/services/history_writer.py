@@ -0,0 +1,279 @@
+"""
+Write-behind buffer for code generation history.
+
+Records are appended to a local spill file and queued in memory; a background
+thread inserts them in multi-row batches every FLUSH_INTERVAL_MS or as soon as
+BATCH_SIZE records are waiting. Ids are reserved in blocks ahead of time, so a
+queued record already has the id its row will be stored under. Each batch gets
+its own spill file, which is deleted only after the batch is committed, and
+spill files left behind by a crashed process are replayed on startup.
+"""
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from core.dependency_injection import DIContainer
+from models import CodeGeneration
+from repositories.code_repository import CodeGenerationRepository
+from services.prompt_similarity import PromptSimilarityIndex
+
+logger = logging.getLogger("history_writer")
+
+# Keep IN lists well under SQLite's bound parameter limit
+REPLAY_LOOKUP_CHUNK_SIZE = 500
+
+
+class HistoryWriteBehindBuffer:
+    """Bounded in-memory queue of history records, flushed in batches by a background thread."""
+
+    def __init__(self, session_factory: Callable, spill_dir: Optional[str] = None,
+                 batch_size: Optional[int] = None, flush_interval_ms: Optional[int] = None,
+                 max_queue_size: Optional[int] = None):
+        """
+        Args:
+            session_factory: Callable returning a new database session
+            spill_dir: Directory for spill files (default from Config)
+            batch_size: Records that trigger an early flush and rows per INSERT (default from Config)
+            flush_interval_ms: Maximum time a record waits before being flushed (default from Config)
+            max_queue_size: Records held in memory before callers must write synchronously (default from Config)
+        """
+        self.session_factory = session_factory
+        self.spill_dir = spill_dir or Config.HISTORY.SPILL_DIR
+        self.batch_size = batch_size or Config.HISTORY.BATCH_SIZE
+        self.flush_interval = (flush_interval_ms or Config.HISTORY.FLUSH_INTERVAL_MS) / 1000
+        self.max_queue_size = max_queue_size or Config.HISTORY.QUEUE_SIZE
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._queue: deque = deque()
+        self._id_lock = threading.Lock()
+        self._reserved_ids: deque = deque()
+        self._retry: List[Tuple[List[Dict[str, Any]], Any]] = []
+        self._spill_sequence = 0
+        self._spill_path = None
+        self._spill_file = None
+        self._thread = None
+        self._running = False
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+    def _open_spill_file(self) -> None:
+        """Start a new spill file, locked so other processes won't replay it while we're alive."""
+        self._spill_sequence += 1
+        self._spill_path = os.path.join(self.spill_dir, f"history-{os.getpid()}-{self._spill_sequence}.ndjson")
+        self._spill_file = open(self._spill_path, "a", encoding="utf-8")
+        fcntl.flock(self._spill_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def start(self) -> None:
+        """Replay spill files left by earlier processes and start the flush thread"""
+        self.replay_orphans()
+        with self._lock:
+            self._open_spill_file()
+            self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="history-write-behind")
+        self._thread.start()
+        logger.info(f"History write-behind started: batch_size={self.batch_size}, interval={self.flush_interval}s")
+
+    def submit(self, user_id: int, model_name: str, prompt: str, generated_code: str,
+               credits_used: float, language: Optional[str] = None,
+               reused_from: Optional[int] = None) -> Optional[CodeGeneration]:
+        """
+        Queue a history record.
+
+        Returns:
+            A detached CodeGeneration carrying the id its row will have once flushed,
+            or None if the buffer isn't running or is full, or no id could be reserved,
+            and the caller should write synchronously
+        """
+        if not self._running:
+            return None
+        try:
+            code_gen_id = self._next_id()
+        except Exception as e:
+            logger.error(f"Error reserving history ids, writing synchronously: {str(e)}")
+            return None
+        record = {
+            "id": code_gen_id,
+            "user_id": user_id,
+            "model_name": model_name,
+            "prompt": prompt,
+            "generated_code": generated_code,
+            "credits_used": credits_used,
+            "timestamp": datetime.utcnow().isoformat(),
+            "language": language,
+            "reused_from": reused_from,
+        }
+        with self._lock:
+            if not self._running or len(self._queue) >= self.max_queue_size:
+                return None
+            self._spill_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._spill_file.flush()
+            self._queue.append(record)
+            queued = len(self._queue)
+        if queued >= self.batch_size:
+            self._wakeup.set()
+        return CodeGeneration(**record)
+
+    def _next_id(self) -> int:
+        """Hand out the next reserved id, reserving a new block of batch_size ids when none are left"""
+        with self._id_lock:
+            if not self._reserved_ids:
+                db = self.session_factory()
+                try:
+                    ids = CodeGenerationRepository(db).reserve_ids(self.batch_size)
+                    db.commit()
+                finally:
+                    db.close()
+                self._reserved_ids.extend(ids)
+            return self._reserved_ids.popleft()
+
+    def _run(self) -> None:
+        while self._running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write every queued record to the database.
+
+        Returns:
+            Number of records written
+        """
+        with self._lock:
+            if self._queue:
+                batch = list(self._queue)
+                self._queue.clear()
+                # The batch's spill file stays open, and so locked, until the batch is stored
+                self._spill_file.flush()
+                os.fsync(self._spill_file.fileno())
+                self._retry.append((batch, self._spill_file))
+                self._spill_file = None
+                if self._running:
+                    self._open_spill_file()
+            pending, self._retry = self._retry, []
+
+        written = 0
+        for index, (batch, spill_file) in enumerate(pending):
+            batch_size = len(batch)
+            try:
+                self._insert(batch)
+            except Exception as e:
+                written += batch_size - len(batch)
+                logger.error(f"Error flushing {len(batch)} history records, will retry: {str(e)}")
+                with self._lock:
+                    self._retry = pending[index:] + self._retry
+                break
+            os.remove(spill_file.name)
+            spill_file.close()
+            written += batch_size
+        return written
+
+    def _insert(self, records: List[Dict[str, Any]]) -> None:
+        """
+        Insert records in chunks of batch_size and add them to the prompt similarity index,
+        except reused results, which the synchronous write path doesn't index either.
+        Committed chunks are removed from records, so a failed call can simply be retried.
+        """
+        db = self.session_factory()
+        try:
+            repository = CodeGenerationRepository(db)
+            prompt_index = DIContainer.get_instance(PromptSimilarityIndex)
+            while records:
+                chunk = records[:self.batch_size]
+                ids = repository.create_generations_bulk(chunk)
+                del records[:len(chunk)]
+                for code_gen_id, record in zip(ids, chunk):
+                    if record.get("reused_from") is not None:
+                        continue
+                    prompt_index.add(code_gen_id, record["prompt"], record["language"], record["model_name"],
+                                     record["user_id"])
+        finally:
+            db.close()
+
+    def replay_orphans(self) -> int:
+        """
+        Insert records from spill files whose owning process is gone.
+        Records already in the table (same user and timestamp) are skipped, which
+        covers a crash between a batch's commit and the removal of its spill file.
+
+        Returns:
+            Number of records replayed
+        """
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "history-*.ndjson"))):
+            if path == self._spill_path:
+                continue
+            with open(path, "r", encoding="utf-8") as spill_file:
+                try:
+                    fcntl.flock(spill_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # Still owned by a live process
+                # A crash can leave a torn last line
+                records = []
+                for line in spill_file:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipping unreadable line in {path}")
+
+                try:
+                    missing = self._unstored(records)
+                    count = len(missing)
+                    self._insert(missing)
+                except Exception as e:
+                    logger.error(f"Error replaying history spill file {path}: {str(e)}")
+                    continue
+                replayed += count
+            os.remove(path)
+
+        if replayed:
+            logger.info(f"Replayed {replayed} history records from spill files")
+        return replayed
+
+    def _unstored(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Filter out records that are already in the table"""
+        stored = set()
+        timestamps = sorted({r["timestamp"] for r in records})
+        db = self.session_factory()
+        try:
+            for start in range(0, len(timestamps), REPLAY_LOOKUP_CHUNK_SIZE):
+                stored.update(
+                    db.query(CodeGeneration.user_id, CodeGeneration.timestamp)
+                    .filter(CodeGeneration.timestamp.in_(timestamps[start:start + REPLAY_LOOKUP_CHUNK_SIZE]))
+                    .all()
+                )
+        finally:
+            db.close()
+        return [r for r in records if (r["user_id"], r["timestamp"]) not in stored]
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop the flush thread and write out everything still queued"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while self.flush() or self._retry:
+            if time.monotonic() > deadline:
+                logger.error("History records left unflushed at shutdown; they will be replayed from spill files")
+                break
+            time.sleep(self.flush_interval)
+
+        # Drop the current spill file if nothing was written to it after the last flush
+        with self._lock:
+            if self._spill_file:
+                self._spill_file.close()
+                if os.path.getsize(self._spill_path) == 0:
+                    os.remove(self._spill_path)
+                self._spill_file = None
@@ -0,0 +1,288 @@
+"""
+Persistent outbox for outgoing mail and the worker that delivers it.
+
+Mail is written to the email_outbox table in the request's transaction and sent
+later by a single asyncio worker per process. The worker keeps one authenticated
+SMTP connection open across batches and retries failed mail with exponential
+backoff, so a burst of mail costs one TLS handshake instead of one per message.
+"""
+import asyncio
+import smtplib
+import time
+import logging
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from config import Config
+from core.dependency_injection import DIContainer
+from models import EmailOutbox
+
+logger = logging.getLogger("mail_outbox")
+
+
+class MailOutbox:
+    """Service for queueing mail and inspecting the outbox."""
+
+    @staticmethod
+    def enqueue(db: Session, recipient: str, subject: str, text_body: str,
+                html_body: Optional[str] = None) -> EmailOutbox:
+        """
+        Store a mail for delivery by the outbox worker.
+
+        Args:
+            db: Database session
+            recipient: Recipient address
+            subject: Subject line
+            text_body: Plain text body
+            html_body: Optional HTML alternative
+
+        Returns:
+            The stored outbox entry
+        """
+        now = datetime.utcnow().isoformat()
+        mail = EmailOutbox(
+            recipient=recipient,
+            subject=subject,
+            text_body=text_body,
+            html_body=html_body,
+            status="pending",
+            attempts=0,
+            next_attempt_at=now,
+            created_at=now
+        )
+        db.add(mail)
+        db.commit()
+        db.refresh(mail)
+        DIContainer.get_instance(MailWorker).notify()
+        return mail
+
+    @staticmethod
+    def get_statistics(db: Session) -> Dict[str, Any]:
+        """
+        Get outbox counts per status and this process's delivery figures.
+
+        Returns:
+            Counts of pending, sent and failed mail plus worker throughput and latency
+        """
+        counts = dict(db.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all())
+        oldest_pending = db.query(func.min(EmailOutbox.created_at))\
+            .filter(EmailOutbox.status == "pending")\
+            .scalar()
+        return {
+            "pending": counts.get("pending", 0),
+            "sent": counts.get("sent", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_pending_at": oldest_pending,
+            "worker": DIContainer.get_instance(MailWorker).status()
+        }
+
+
+class MailWorker:
+    """Delivers outbox mail in batches over a reused SMTP connection."""
+
+    def __init__(self, session_factory: Optional[Callable] = None):
+        """
+        Args:
+            session_factory: Callable returning a new database session (default: SessionLocal)
+        """
+        if session_factory is None:
+            from database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Delivery figures for this process
+        self.sent = 0
+        self.failed_attempts = 0
+        self.connections_opened = 0
+        self._latency_total = 0.0
+        self._sending_seconds = 0.0
+
+    def status(self) -> Dict[str, Any]:
+        """Delivery throughput and latency since the worker started"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "sent": self.sent,
+            "failed_attempts": self.failed_attempts,
+            "connections_opened": self.connections_opened,
+            "mails_per_second": self.sent / self._sending_seconds if self._sending_seconds else 0.0,
+            "mean_latency_ms": self._latency_total / self.sent * 1000 if self.sent else 0.0,
+        }
+
+    def start(self) -> None:
+        """Start delivering on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Mail outbox worker started")
+
+    def notify(self) -> None:
+        """Wake the worker now instead of at its next poll; safe to call from any thread"""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def close(self) -> None:
+        """Stop the worker and close the SMTP connection"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self._disconnect)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await asyncio.to_thread(self.process_batch)
+            except Exception as e:
+                logger.exception(f"Error processing mail outbox: {str(e)}")
+                processed = 0
+            # A full batch means more mail may be due right away
+            if processed >= Config.EMAIL.OUTBOX_BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), Config.EMAIL.OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _claim(self, db: Session) -> List[EmailOutbox]:
+        """
+        Lease due mail to this worker by pushing next_attempt_at past the lease period.
+        The compare-and-set on next_attempt_at keeps two workers from claiming the same mail.
+        """
+        now = datetime.utcnow()
+        due = db.query(EmailOutbox)\
+            .filter(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now.isoformat())\
+            .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)\
+            .limit(Config.EMAIL.OUTBOX_BATCH_SIZE)\
+            .all()
+        lease_until = (now + timedelta(seconds=Config.EMAIL.OUTBOX_LEASE_SECONDS)).isoformat()
+        claimed = []
+        for mail in due:
+            updated = db.query(EmailOutbox)\
+                .filter(
+                    EmailOutbox.id == mail.id,
+                    EmailOutbox.status == "pending",
+                    EmailOutbox.next_attempt_at == mail.next_attempt_at
+                )\
+                .update({EmailOutbox.next_attempt_at: lease_until}, synchronize_session=False)
+            if updated:
+                claimed.append(mail)
+        db.commit()
+        return claimed
+
+    def process_batch(self) -> int:
+        """
+        Send one batch of due mail, committing the outcome of each mail as it's sent.
+
+        Returns:
+            Number of mails attempted
+        """
+        db = self.session_factory()
+        try:
+            mails = self._claim(db)
+            if not mails:
+                return 0
+            started = time.monotonic()
+            for mail in mails:
+                try:
+                    self._send(mail)
+                except Exception as e:
+                    self._schedule_retry(mail, e)
+                else:
+                    sent_at = datetime.utcnow()
+                    mail.status = "sent"
+                    mail.sent_at = sent_at.isoformat()
+                    mail.attempts += 1
+                    self.sent += 1
+                    self._latency_total += (sent_at - datetime.fromisoformat(mail.created_at)).total_seconds()
+                db.commit()
+            self._sending_seconds += time.monotonic() - started
+            return len(mails)
+        finally:
+            db.close()
+
+    def _schedule_retry(self, mail: EmailOutbox, error: Exception) -> None:
+        mail.attempts += 1
+        mail.last_error = str(error)[:1000]
+        self.failed_attempts += 1
+        # A refused recipient won't be accepted on a later attempt either
+        if isinstance(error, smtplib.SMTPRecipientsRefused) or mail.attempts >= Config.EMAIL.OUTBOX_MAX_ATTEMPTS:
+            mail.status = "failed"
+            logger.error(f"Giving up on mail {mail.id} to {mail.recipient} after {mail.attempts} attempts: {error}")
+            return
+        delay = Config.EMAIL.OUTBOX_RETRY_BASE_SECONDS * 2 ** (mail.attempts - 1)
+        mail.next_attempt_at = (datetime.utcnow() + timedelta(seconds=delay)).isoformat()
+        logger.warning(f"Mail {mail.id} to {mail.recipient} failed, retrying in {delay:.0f}s: {error}")
+
+    def _connection(self) -> smtplib.SMTP:
+        """Get the open SMTP connection, checking it with NOOP after it's been idle"""
+        if self._smtp is not None and time.monotonic() - self._last_used > Config.EMAIL.SMTP_IDLE_CHECK_SECONDS:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self._disconnect()
+            except (smtplib.SMTPException, OSError):
+                self._disconnect()
+
+        if self._smtp is None:
+            server = smtplib.SMTP(Config.EMAIL.SMTP_SERVER, Config.EMAIL.SMTP_PORT, timeout=30)
+            try:
+                server.ehlo()
+                if Config.EMAIL.SMTP_STARTTLS:
+                    server.starttls()
+                    server.ehlo()
+                if Config.EMAIL.SMTP_USER:
+                    server.login(Config.EMAIL.SMTP_USER, Config.EMAIL.SMTP_PASSWORD)
+            except Exception:
+                server.close()
+                raise
+            self._smtp = server
+            self.connections_opened += 1
+        return self._smtp
+
+    def _disconnect(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+    def _send(self, mail: EmailOutbox) -> None:
+        msg = MIMEMultipart("alternative")
+        msg["Subject"] = mail.subject
+        msg["From"] = Config.EMAIL.FROM_ADDRESS
+        msg["To"] = mail.recipient
+        msg.attach(MIMEText(mail.text_body, "plain"))
+        if mail.html_body:
+            msg.attach(MIMEText(mail.html_body, "html"))
+
+        try:
+            self._connection().sendmail(Config.EMAIL.FROM_ADDRESS, [mail.recipient], msg.as_string())
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # The server may drop idle connections at any time; reconnect once
+            self._disconnect()
+            self._connection().sendmail(Config.EMAIL.FROM_ADDRESS, [mail.recipient], msg.as_string())
+        except smtplib.SMTPException:
+            # Leave the connection usable for the next mail in the batch
+            if self._smtp is not None:
+                try:
+                    self._smtp.rset()
+                except (smtplib.SMTPException, OSError):
+                    self._disconnect()
+            raise
+        finally:
+            self._last_used = time.monotonic()
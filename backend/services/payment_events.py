@@ -0,0 +1,59 @@
+"""
+In-process publish/subscribe for payment status changes.
+
+Status changes are published after they are committed, from any thread, and
+wake the event-stream requests waiting on that transaction in this process.
+Waiters in other worker processes catch up through their periodic DB check.
+"""
+import asyncio
+import threading
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Set, Tuple
+
+logger = logging.getLogger("payment_events")
+
+
+class PaymentStatusBroker:
+    """Fans payment status changes out to the asyncio queues subscribed to each transaction."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def publish(self, transaction_id: str, status: str) -> int:
+        """
+        Notify the subscribers of a transaction; safe to call from any thread.
+
+        Returns:
+            Number of subscribers notified
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(transaction_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, status)
+            except RuntimeError:
+                # The subscriber's loop is already closed
+                pass
+        return len(subscribers)
+
+    @asynccontextmanager
+    async def subscribe(self, transaction_id: str) -> AsyncIterator[asyncio.Queue]:
+        """Receive the statuses published for a transaction while the block runs"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers.setdefault(transaction_id, set()).add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(transaction_id)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._subscribers[transaction_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
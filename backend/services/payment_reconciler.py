@@ -0,0 +1,178 @@
+"""
+Reconciliation of payments that never received a webhook.
+
+A sweep walks stale pending transactions in (created_at, id) order through the
+(status, created_at) index, checks each with PayOS from a bounded thread pool
+under a rate limit, and applies the result with the same logic as the verify
+endpoint. Payments pending for longer than EXPIRE_AFTER_SECONDS are cancelled.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, text
+from sqlalchemy.orm import Session
+
+from config import Config
+from core.rate_limit import TokenBucket
+from models import PaymentTransaction
+from services.payment_service import PaymentService
+
+logger = logging.getLogger("payment_reconciler")
+
+
+class PaymentReconciler:
+    """Periodically settles stale pending payments against PayOS."""
+
+    def __init__(self, session_factory: Optional[Callable] = None):
+        """
+        Args:
+            session_factory: Callable returning a new database session (default: SessionLocal)
+        """
+        if session_factory is None:
+            from database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+        self.last_sweep: Dict[str, Any] = {}
+
+    def status(self) -> Dict[str, Any]:
+        """Figures of the last sweep in this process"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_seconds": Config.PAYMENT.RECONCILE_INTERVAL_SECONDS,
+            "last_sweep": self.last_sweep,
+        }
+
+    def start(self) -> None:
+        """Start sweeping on the running event loop"""
+        if Config.PAYMENT.RECONCILE_INTERVAL_SECONDS <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info("Payment reconciler started")
+
+    async def close(self) -> None:
+        """Stop sweeping; a sweep in progress finishes its current batch in the background"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(Config.PAYMENT.RECONCILE_INTERVAL_SECONDS)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.exception(f"Error reconciling payments: {str(e)}")
+
+    @staticmethod
+    def _stale_filter(cutoff: str):
+        return and_(PaymentTransaction.status == "pending", PaymentTransaction.created_at <= cutoff)
+
+    def backlog(self, db: Session, now: Optional[datetime] = None) -> int:
+        """Number of pending payments old enough to be reconciled"""
+        now = now or datetime.now()
+        cutoff = (now - timedelta(seconds=Config.PAYMENT.RECONCILE_AFTER_SECONDS)).isoformat()
+        return db.query(func.count(PaymentTransaction.id)).filter(self._stale_filter(cutoff)).scalar()
+
+    def sweep(self) -> Dict[str, Any]:
+        """
+        Check every stale pending payment once.
+
+        Returns:
+            Sweep figures: duration, backlog before the sweep and outcome counts
+        """
+        started = time.monotonic()
+        now = datetime.now()
+        cutoff = (now - timedelta(seconds=Config.PAYMENT.RECONCILE_AFTER_SECONDS)).isoformat()
+        expire_before = (now - timedelta(seconds=Config.PAYMENT.EXPIRE_AFTER_SECONDS)).isoformat()
+        limiter = TokenBucket(Config.PAYMENT.RECONCILE_RATE, max(1.0, Config.PAYMENT.RECONCILE_RATE))
+        outcomes: Dict[str, int] = {
+            "completed": 0, "failed": 0, "expired": 0, "pending": 0, "skipped": 0, "error": 0
+        }
+
+        db = self.session_factory()
+        try:
+            if not self._try_lock(db):
+                logger.info("Another worker is reconciling payments, skipping this sweep")
+                return self.last_sweep
+            backlog = self.backlog(db, now)
+            last: Optional[Tuple[str, int]] = None
+            with ThreadPoolExecutor(max_workers=Config.PAYMENT.RECONCILE_CONCURRENCY,
+                                    thread_name_prefix="payment-reconcile") as pool:
+                while True:
+                    batch = self._next_batch(db, cutoff, last)
+                    if not batch:
+                        break
+                    last = batch[-1]
+                    results = pool.map(
+                        lambda row: self._reconcile(row[1], row[0] <= expire_before, limiter), batch
+                    )
+                    for outcome in results:
+                        outcomes[outcome] += 1
+            db.commit()
+        finally:
+            db.close()
+
+        self.last_sweep = {
+            "started_at": now.isoformat(),
+            "duration_seconds": round(time.monotonic() - started, 3),
+            "backlog": backlog,
+            "checked": sum(outcomes.values()),
+            **outcomes,
+        }
+        logger.info(f"Payment reconciliation sweep: {self.last_sweep}")
+        return self.last_sweep
+
+    def _try_lock(self, db: Session) -> bool:
+        """On PostgreSQL, let only one worker sweep at a time; the lock ends with the transaction"""
+        if db.get_bind().dialect.name != "postgresql":
+            return True
+        return db.execute(text("SELECT pg_try_advisory_xact_lock(hashtext('payment_reconcile'))")).scalar()
+
+    def _next_batch(self, db: Session, cutoff: str, last: Optional[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        """Next (created_at, id) keys after last, oldest first"""
+        query = db.query(PaymentTransaction.created_at, PaymentTransaction.id)\
+            .filter(self._stale_filter(cutoff))
+        if last is not None:
+            query = query.filter(or_(
+                PaymentTransaction.created_at > last[0],
+                and_(PaymentTransaction.created_at == last[0], PaymentTransaction.id > last[1])
+            ))
+        rows = query.order_by(PaymentTransaction.created_at, PaymentTransaction.id)\
+            .limit(Config.PAYMENT.RECONCILE_BATCH_SIZE)\
+            .all()
+        return [tuple(row) for row in rows]
+
+    def _reconcile(self, transaction_pk: int, expired: bool, limiter: TokenBucket) -> str:
+        """Check one payment with PayOS in its own session and return the outcome"""
+        db = self.session_factory()
+        try:
+            transaction = db.get(PaymentTransaction, transaction_pk)
+            # Settled by a webhook or the verify endpoint since the batch was read
+            if transaction is None or transaction.status != "pending":
+                return "skipped"
+            limiter.acquire()
+            payos_status = PaymentService.sync_with_payos(db, transaction)
+            if payos_status == "PAID":
+                return "completed"
+            if payos_status in ("CANCELLED", "EXPIRED"):
+                return "failed"
+            if expired:
+                limiter.acquire()
+                PaymentService.cancel_payment(db, transaction, "Payment not completed in time")
+                return "expired"
+            return "pending"
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to reconcile payment {transaction_pk}: {str(e)}")
+            return "error"
+        finally:
+            db.close()
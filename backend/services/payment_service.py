@@ -1,33 +1,40 @@
-import base64
+import asyncio
+import json
 from datetime import datetime
-from typing import Dict, Any
-import qrcode
-from io import BytesIO
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 import logging
 
 # Import PayOS SDK và các kiểu dữ liệu cần thiết
-from payos import PayOS, PaymentData, ItemData
+from payos import PaymentData, ItemData
 
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from models import PaymentTransaction, User
+from starlette.concurrency import run_in_threadpool
+from models import PaymentTransaction, PaymentTransactionKey, User
+from repositories.base import filter_time_range, paginate_newest_first
 from config import Config
+from core.dependency_injection import DIContainer
+from core.order_codes import OrderCodeGenerator
+from core.rate_limit import TokenBucket
+from database import SessionLocal
+from services.payment_events import PaymentStatusBroker
+from services.qr_renderer import QRRenderer
+from services.api_clients.payos_client import PayOSClient
 
 # Thiết lập logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Khởi tạo PayOS SDK client
+# Khởi tạo PayOS client (dùng chung connection pool, có deadline cho mỗi lần gọi)
 try:
-    payos_client = PayOS(
-        client_id=Config.PAYMENT.PAYOS_CLIENT_ID,
-        api_key=Config.PAYMENT.PAYOS_API_KEY,
-        checksum_key=Config.PAYMENT.PAYOS_CHECKSUM_KEY
-    )
-    logger.info("PayOS SDK đã được khởi tạo thành công")
+    payos_client = PayOSClient()
+    logger.info("PayOS client đã được khởi tạo thành công")
 except Exception as e:
-    logger.error(f"Không thể khởi tạo PayOS SDK: {str(e)}")
-    raise ValueError(f"Không thể khởi tạo PayOS SDK: {str(e)}")
+    logger.error(f"Không thể khởi tạo PayOS client: {str(e)}")
+    raise ValueError(f"Không thể khởi tạo PayOS client: {str(e)}")
+
+# Giới hạn số lần hỏi trạng thái từ PayOS trong mỗi process
+payos_verify_limiter = TokenBucket(Config.PAYMENT.PAYOS_VERIFY_RATE, Config.PAYMENT.PAYOS_VERIFY_BURST)
 
 class PaymentService:
     @staticmethod
@@ -47,8 +54,8 @@ class PaymentService:
         if not user:
             raise ValueError("Không tìm thấy người dùng")
         
-        # Tạo mã đơn hàng duy nhất
-        order_code = int(f"{user_id}{int(datetime.now().timestamp())}")
+        # Tạo mã đơn hàng duy nhất giữa các worker (timestamp, worker id, sequence)
+        order_code = DIContainer.get_instance(OrderCodeGenerator).next_code()
         
         # Tạo dữ liệu item theo mô hình ItemData của PayOS
         item = ItemData(
@@ -68,183 +75,357 @@ class PaymentService:
         )
         
         try:
-            # Gọi API tạo link thanh toán qua PayOS SDK
-            logger.info(f"Tạo thanh toán với PayOS SDK: orderCode={order_code}, amount={amount}")
+            # Gọi API tạo link thanh toán qua PayOS
+            logger.info(f"Tạo thanh toán với PayOS: orderCode={order_code}, amount={amount}")
             result = payos_client.createPaymentLink(paymentData=payment_data)
-            logger.info(f"Kết quả từ PayOS SDK: {result.to_json() if hasattr(result, 'to_json') else result}")
+            logger.info(f"Kết quả từ PayOS: {result.to_json() if hasattr(result, 'to_json') else result}")
             
             # Lấy thông tin từ kết quả thanh toán
             payment_link_id = result.paymentLinkId
             checkout_url = result.checkoutUrl
             qr_code_data = result.qrCode
             
+            # Nếu PayOS không trả mã QR, bắt đầu render (process pool, có cache) để chạy song song với việc ghi DB
+            qr_future = None if qr_code_data else DIContainer.get_instance(QRRenderer).submit(checkout_url)
+            
             # Lưu thông tin giao dịch vào cơ sở dữ liệu
+            now = datetime.now().isoformat()
             transaction = PaymentTransaction(
                 user_id=user_id,
                 amount=amount,
                 credits=credits,
                 transaction_id=payment_link_id,
+                order_code=order_code,
+                checkout_url=checkout_url,
                 status="pending",
-                created_at=datetime.now().isoformat(),
+                created_at=now,
+                updated_at=now,
                 completed_at=None
             )
             
             db.add(transaction)
+            # Giữ transaction_id duy nhất kể cả khi bảng payment_transactions được phân vùng
+            db.add(PaymentTransactionKey(transaction_id=payment_link_id))
             db.commit()
             db.refresh(transaction)
             
-            # Tạo mã QR từ dữ liệu QR nếu không có sẵn
-            if not qr_code_data:
-                qr = qrcode.QRCode(
-                    version=1,
-                    error_correction=qrcode.constants.ERROR_CORRECT_L,
-                    box_size=10,
-                    border=4,
-                )
-                qr.add_data(checkout_url)
-                qr.make(fit=True)
-                
-                img = qr.make_image(fill_color="black", back_color="white")
-                buffered = BytesIO()
-                img.save(buffered)
-                qr_code_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            else:
-                qr_code_base64 = qr_code_data
-            
-            # Trả về thông tin thanh toán
-            return {
-                "checkout_url": checkout_url,
-                "qr_code": qr_code_base64,
-                "transaction_id": payment_link_id,
-                "amount": amount,
-                "credits": credits
-            }
-            
         except Exception as e:
             logger.error(f"Lỗi khi tạo thanh toán với PayOS: {str(e)}")
             raise ValueError(f"Lỗi khi tạo thanh toán: {str(e)}")
+        
+        # Giao dịch đã được lưu: nếu mã QR chưa xong hoặc render lỗi thì trả về không có QR,
+        # client lấy sau qua qr_code_url
+        if qr_future is not None:
+            try:
+                qr_code_data = qr_future.result(timeout=Config.PAYMENT.QR_PAYMENT_WAIT_SECONDS)
+            except Exception as e:
+                logger.warning(f"Mã QR cho giao dịch {payment_link_id} chưa sẵn sàng: {e!r}")
+        
+        # Trả về thông tin thanh toán
+        return {
+            "checkout_url": checkout_url,
+            "qr_code": qr_code_data or None,
+            "qr_code_url": f"/payment/qr/{payment_link_id}",
+            "transaction_id": payment_link_id,
+            "amount": amount,
+            "credits": credits
+        }
+    
+    @staticmethod
+    def _complete_transaction(db: Session, transaction: PaymentTransaction, commit: bool = True) -> bool:
+        """
+        Đánh dấu giao dịch thành công và cộng credits đúng một lần, kể cả khi webhook,
+        verify và worker khác cùng xử lý giao dịch này: chỉ câu UPDATE chuyển được
+        trạng thái sang completed mới cộng credits.
+
+        Args:
+            db: Database session
+            transaction: Giao dịch cần hoàn tất
+            commit: False để người gọi tự commit (và publish) theo lô
+
+        Returns:
+            True nếu lần gọi này đã hoàn tất giao dịch
+        """
+        now = datetime.now().isoformat()
+        updated = db.query(PaymentTransaction).filter(
+            PaymentTransaction.id == transaction.id,
+            PaymentTransaction.status != "completed"
+        ).update({
+            PaymentTransaction.status: "completed",
+            PaymentTransaction.completed_at: now,
+            PaymentTransaction.updated_at: now
+        })
+        
+        if updated:
+            # Cộng credits cho người dùng ngay trong câu UPDATE để không mất cập nhật đồng thời
+            db.query(User).filter(User.id == transaction.user_id).update({
+                User.credits: User.credits + transaction.credits
+            })
+            logger.info(f"Đã cộng {transaction.credits} credits cho người dùng {transaction.user_id}")
+        
+        if commit:
+            db.commit()
+            if updated:
+                DIContainer.get_instance(PaymentStatusBroker).publish(transaction.transaction_id, "completed")
+        return bool(updated)
+    
+    @staticmethod
+    def _fail_transaction(db: Session, transaction: PaymentTransaction) -> bool:
+        """
+        Đánh dấu giao dịch còn pending là thất bại và thông báo cho các client đang chờ.
+        Giao dịch đã hoàn tất không bị ghi đè.
+
+        Returns:
+            True nếu lần gọi này đã chuyển giao dịch sang failed
+        """
+        updated = db.query(PaymentTransaction).filter(
+            PaymentTransaction.id == transaction.id,
+            PaymentTransaction.status == "pending"
+        ).update({
+            PaymentTransaction.status: "failed",
+            PaymentTransaction.updated_at: datetime.now().isoformat()
+        })
+        db.commit()
+        if updated:
+            DIContainer.get_instance(PaymentStatusBroker).publish(transaction.transaction_id, "failed")
+        return bool(updated)
+    
+    @staticmethod
+    def _is_stale(transaction: PaymentTransaction) -> bool:
+        """Trạng thái pending chưa được kiểm tra với PayOS trong STATUS_STALE_SECONDS"""
+        if not transaction.last_checked_at:
+            return True
+        age = datetime.now() - datetime.fromisoformat(transaction.last_checked_at)
+        return age.total_seconds() >= Config.PAYMENT.STATUS_STALE_SECONDS
+    
+    @staticmethod
+    def refresh_status(db: Session, transaction_id: str) -> PaymentTransaction:
+        """
+        Lấy trạng thái giao dịch từ DB; chỉ hỏi PayOS khi giao dịch còn pending,
+        trạng thái đã cũ và còn quota gọi PayOS
+        """
+        transaction = db.query(PaymentTransaction).filter(
+            PaymentTransaction.transaction_id == transaction_id
+        ).first()
+        
+        if not transaction:
+            logger.warning(f"Không tìm thấy giao dịch với ID: {transaction_id}")
+            raise ValueError("Không tìm thấy giao dịch")
+        
+        # Giao dịch đã kết thúc hoặc vừa được kiểm tra: trả về trạng thái trong DB
+        if transaction.status != "pending" or not PaymentService._is_stale(transaction):
+            return transaction
+        if not payos_verify_limiter.try_acquire():
+            logger.info(f"Bỏ qua kiểm tra PayOS cho {transaction_id} do giới hạn tần suất")
+            return transaction
+        
+        PaymentService.sync_with_payos(db, transaction)
+        return transaction
+    
+    @staticmethod
+    def sync_with_payos(db: Session, transaction: PaymentTransaction) -> str:
+        """
+        Hỏi PayOS trạng thái của giao dịch và cập nhật DB theo đó (không kiểm tra giới hạn tần suất)
+
+        Returns:
+            Trạng thái PayOS của link thanh toán (PENDING, PAID, CANCELLED, EXPIRED...)
+        """
+        # Sử dụng PayOS để kiểm tra thông tin thanh toán
+        logger.info(f"Xác minh thanh toán với PayOS: {transaction.transaction_id}")
+        payment_info = payos_client.getPaymentLinkInformation(orderId=transaction.transaction_id)
+        logger.info(f"Thông tin thanh toán: {payment_info.to_json() if hasattr(payment_info, 'to_json') else payment_info}")
+        transaction.last_checked_at = datetime.now().isoformat()
+        
+        # Cập nhật trạng thái giao dịch dựa trên thông tin từ PayOS
+        payment_status = payment_info.status
+        if payment_status == "PAID":
+            PaymentService._complete_transaction(db, transaction)
+        elif payment_status in ["CANCELLED", "EXPIRED"]:
+            PaymentService._fail_transaction(db, transaction)
+        else:
+            db.commit()
+        return payment_status
+    
+    @staticmethod
+    def cancel_payment(db: Session, transaction: PaymentTransaction, reason: str) -> bool:
+        """
+        Hủy link thanh toán trên PayOS và đánh dấu giao dịch thất bại
+
+        Returns:
+            True nếu giao dịch đã được chuyển sang failed
+        """
+        payos_client.cancelPaymentLink(orderId=transaction.transaction_id, cancellationReason=reason)
+        return PaymentService._fail_transaction(db, transaction)
     
     @staticmethod
     def verify_payment(db: Session, transaction_id: str) -> bool:
         """
-        Xác minh trạng thái thanh toán với PayOS
+        Xác minh trạng thái thanh toán (từ DB, chỉ hỏi PayOS khi trạng thái đã cũ)
         """
         try:
-            # Kiểm tra xem giao dịch đã được xử lý trước đó chưa
-            transaction = db.query(PaymentTransaction).filter(
-                PaymentTransaction.transaction_id == transaction_id
-            ).first()
-            
-            if not transaction:
-                logger.warning(f"Không tìm thấy giao dịch với ID: {transaction_id}")
-                raise ValueError("Không tìm thấy giao dịch")
-            
-            # Nếu giao dịch đã được hoàn thành trước đó, trả về thành công ngay
-            if transaction.status == "completed":
-                logger.info(f"Giao dịch {transaction_id} đã được xử lý trước đó, không cần xác minh lại")
-                return True
-                
-            # Sử dụng PayOS SDK để kiểm tra thông tin thanh toán
-            logger.info(f"Xác minh thanh toán với PayOS SDK: {transaction_id}")
-            payment_info = payos_client.getPaymentLinkInformation(orderId=transaction_id)
-            logger.info(f"Thông tin thanh toán: {payment_info.to_json() if hasattr(payment_info, 'to_json') else payment_info}")
-            
-            # Cập nhật trạng thái giao dịch dựa trên thông tin từ PayOS
-            payment_status = payment_info.status
-            
-            if payment_status == "PAID":
-                # Cập nhật trạng thái giao dịch thành công
-                transaction.status = "completed"
-                transaction.completed_at = datetime.now().isoformat()
-                
-                # Cộng credits cho người dùng
-                user = db.query(User).filter(User.id == transaction.user_id).first()
-                if user:
-                    user.credits += transaction.credits
-                    logger.info(f"Đã cộng {transaction.credits} credits cho người dùng {user.id}")
-                
-                db.commit()
-                return True
-            
-            elif payment_status in ["CANCELLED", "EXPIRED"]:
-                # Cập nhật trạng thái giao dịch thất bại
-                transaction.status = "failed"
-                db.commit()
-            
-            return False
-            
+            return PaymentService.refresh_status(db, transaction_id).status == "completed"
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"Lỗi khi xác minh thanh toán: {str(e)}")
             raise ValueError(f"Lỗi khi xác minh thanh toán: {str(e)}")
     
     @staticmethod
-    def process_webhook(db: Session, webhook_data: dict) -> bool:
+    def _load_status(transaction_id: str) -> PaymentTransaction:
+        """Đọc trạng thái giao dịch bằng session riêng (dùng cho event stream)"""
+        db = SessionLocal()
+        try:
+            try:
+                transaction = PaymentService.refresh_status(db, transaction_id)
+            except ValueError:
+                raise
+            except Exception as e:
+                # PayOS lỗi: vẫn trả về trạng thái trong DB, lần kiểm tra sau sẽ thử lại
+                logger.error(f"Lỗi khi kiểm tra trạng thái với PayOS: {str(e)}")
+                db.rollback()
+                transaction = db.query(PaymentTransaction).filter(
+                    PaymentTransaction.transaction_id == transaction_id
+                ).one()
+            # Nạp lại các thuộc tính đã hết hạn sau commit trước khi tách khỏi session
+            db.refresh(transaction)
+            db.expunge(transaction)
+            return transaction
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _status_event(transaction: PaymentTransaction) -> str:
+        data = json.dumps({
+            "transaction_id": transaction.transaction_id,
+            "status": transaction.status,
+            "completed_at": transaction.completed_at,
+        })
+        return f"event: status\ndata: {data}\n\n"
+    
+    @staticmethod
+    async def stream_status(transaction_id: str) -> AsyncIterator[str]:
+        """
+        Server-sent events với trạng thái giao dịch: gửi trạng thái hiện tại, sau đó
+        mỗi lần trạng thái thay đổi, và kết thúc khi giao dịch hoàn tất hoặc thất bại.
+        Webhook đánh thức stream ngay lập tức; DB được kiểm tra lại định kỳ cho các
+        thay đổi từ worker khác.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + Config.PAYMENT.STATUS_STREAM_TIMEOUT
+        broker = DIContainer.get_instance(PaymentStatusBroker)
+        # Đăng ký trước khi đọc trạng thái để không bỏ lỡ webhook đến giữa chừng
+        async with broker.subscribe(transaction_id) as queue:
+            transaction = await run_in_threadpool(PaymentService._load_status, transaction_id)
+            yield PaymentService._status_event(transaction)
+            status = transaction.status
+            while status == "pending" and loop.time() < deadline:
+                try:
+                    await asyncio.wait_for(queue.get(), Config.PAYMENT.STATUS_STREAM_CHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                transaction = await run_in_threadpool(PaymentService._load_status, transaction_id)
+                if transaction.status == status:
+                    yield ": keep-alive\n\n"
+                    continue
+                status = transaction.status
+                yield PaymentService._status_event(transaction)
+    
+    @staticmethod
+    def verify_webhook(webhook_data: dict):
         """
-        Xử lý dữ liệu webhook từ PayOS
+        Xác minh chữ ký webhook từ PayOS
+
+        Raises:
+            ValueError: Dữ liệu hoặc chữ ký không hợp lệ
         """
         try:
-            # Xác minh tính hợp lệ của dữ liệu webhook
-            verified_data = payos_client.verifyPaymentWebhookData(webhook_data)
-            logger.info(f"Dữ liệu webhook đã xác minh: {verified_data.to_json() if hasattr(verified_data, 'to_json') else verified_data}")
-            
-            # Lấy mã giao dịch từ dữ liệu đã xác minh
-            payment_link_id = verified_data.paymentLinkId
-            
-            # Tìm giao dịch trong cơ sở dữ liệu
-            transaction = db.query(PaymentTransaction).filter(
-                PaymentTransaction.transaction_id == payment_link_id
-            ).first()
-            
-            if not transaction:
-                logger.warning(f"Không tìm thấy giao dịch với ID: {payment_link_id}")
-                return False
-            
-            # Kiểm tra nếu giao dịch đã hoàn thành thì bỏ qua
-            if transaction.status == "completed":
-                logger.info(f"Giao dịch {payment_link_id} đã được xử lý trước đó")
-                return True
-            
-            # Cập nhật trạng thái giao dịch
-            if verified_data.code == "00":  # Thanh toán thành công
-                transaction.status = "completed"
-                transaction.completed_at = datetime.now().isoformat()
-                
-                # Cộng credits cho người dùng
-                user = db.query(User).filter(User.id == transaction.user_id).first()
-                if user:
-                    user.credits += transaction.credits
-                    logger.info(f"Đã cộng {transaction.credits} credits cho người dùng {user.username}")
-                
-                db.commit()
-                return True
-            else:
-                logger.warning(f"Webhook báo trạng thái không thành công: {verified_data.code} - {verified_data.desc}")
-                return False
-                
+            return payos_client.verifyPaymentWebhookData(webhook_data)
         except Exception as e:
-            logger.error(f"Lỗi khi xử lý webhook: {str(e)}")
-            return False
+            raise ValueError(f"Webhook không hợp lệ: {str(e)}")
+    
+    @staticmethod
+    def apply_webhook(db: Session, verified_data: Dict[str, Any]) -> str:
+        """
+        Áp dụng dữ liệu webhook đã xác minh vào giao dịch, không commit.
+        Gọi lại với cùng dữ liệu không cộng credits lần nữa.
+
+        Returns:
+            "applied" nếu giao dịch vừa được hoàn tất, ngược lại "ignored"
+        """
+        payment_link_id = verified_data.get("paymentLinkId")
+        transaction = db.query(PaymentTransaction).filter(
+            PaymentTransaction.transaction_id == payment_link_id
+        ).first()
+        
+        if not transaction:
+            logger.warning(f"Không tìm thấy giao dịch với ID: {payment_link_id}")
+            return "ignored"
+        
+        if verified_data.get("code") != "00":
+            logger.warning(f"Webhook báo trạng thái không thành công: {verified_data.get('code')} - {verified_data.get('desc')}")
+            return "ignored"
+        
+        if not PaymentService._complete_transaction(db, transaction, commit=False):
+            logger.info(f"Giao dịch {payment_link_id} đã được xử lý trước đó")
+            return "ignored"
+        return "applied"
     
     @staticmethod
-    def get_all_payment_transactions(db: Session, skip: int = 0, limit: int = 100):
+    def get_all_payment_transactions(db: Session, skip: int = 0, limit: int = 100,
+                                     start: Optional[datetime] = None, end: Optional[datetime] = None):
         """
-        Lấy tất cả các giao dịch thanh toán
+        Lấy tất cả các giao dịch thanh toán, lọc theo khoảng thời gian [start, end) nếu có
         """
-        return db.query(PaymentTransaction).offset(skip).limit(limit).all()
+        query = filter_time_range(db.query(PaymentTransaction), PaymentTransaction.created_at, start, end)
+        return query.offset(skip).limit(limit).all()
     
     @staticmethod
-    def get_user_payment_transactions(db: Session, user_id: int, skip: int = 0, limit: int = 100):
+    def get_user_payment_transactions(db: Session, user_id: int, skip: int = 0, limit: int = 100,
+                                      start: Optional[datetime] = None, end: Optional[datetime] = None):
         """
-        Lấy các giao dịch thanh toán của một người dùng cụ thể
+        Lấy các giao dịch thanh toán của một người dùng cụ thể, lọc theo khoảng thời gian [start, end) nếu có
+        """
+        query = db.query(PaymentTransaction).filter(PaymentTransaction.user_id == user_id)
+        query = filter_time_range(query, PaymentTransaction.created_at, start, end)
+        return query.offset(skip).limit(limit).all()
+    
+    @staticmethod
+    def get_all_payment_transactions_count(db: Session, start: Optional[datetime] = None,
+                                           end: Optional[datetime] = None) -> int:
+        """
+        Lấy tổng số giao dịch thanh toán, lọc theo khoảng thời gian [start, end) nếu có
+        """
+        return filter_time_range(db.query(PaymentTransaction), PaymentTransaction.created_at, start, end).count()
+    
+    @staticmethod
+    def get_user_payment_history_page(db: Session, user_id: int, limit: int = 20, cursor: Optional[str] = None,
+                                      skip: int = 0, start: Optional[datetime] = None,
+                                      end: Optional[datetime] = None) -> Tuple[List[PaymentTransaction], Optional[str]]:
+        """
+        Lấy một trang lịch sử thanh toán của người dùng, mới nhất trước (phân trang bằng cursor)
+
+        Returns:
+            Danh sách giao dịch của trang và cursor của trang sau (None nếu là trang cuối)
+
+        Raises:
+            ValueError: Cursor không hợp lệ
         """
-        return db.query(PaymentTransaction).filter(PaymentTransaction.user_id == user_id).offset(skip).limit(limit).all()
+        query = db.query(PaymentTransaction).filter(PaymentTransaction.user_id == user_id)
+        query = filter_time_range(query, PaymentTransaction.created_at, start, end)
+        return paginate_newest_first(query, PaymentTransaction.created_at, PaymentTransaction.id, limit, cursor, skip)
     
     @staticmethod
-    def get_all_payment_transactions_count(db: Session) -> int:
+    def get_user_payment_history_version(db: Session, user_id: int) -> str:
         """
-        Lấy tổng số giao dịch thanh toán
+        Phiên bản lịch sử thanh toán của người dùng: thay đổi khi có giao dịch mới
+        hoặc giao dịch đổi trạng thái. Chỉ đọc index (user_id, created_at) và các cột tổng hợp.
         """
-        return db.query(PaymentTransaction).count()
+        count, max_id, max_updated_at = db.query(
+            func.count(PaymentTransaction.id),
+            func.max(PaymentTransaction.id),
+            func.max(PaymentTransaction.updated_at)
+        ).filter(PaymentTransaction.user_id == user_id).one()
+        return f"{count}:{max_id}:{max_updated_at}"
     
     @staticmethod
     def get_user_payment_transactions_count(db: Session, user_id: int) -> int:
@@ -0,0 +1,254 @@
+"""
+Inbox for PayOS webhooks and the worker that applies them.
+
+The webhook endpoint only verifies the signature and stores the event, keyed by
+payment link and result code so PayOS retries collapse into one row, then
+acknowledges. A single asyncio worker per process applies stored events in
+batches; applying an event twice never credits a user twice. An event that fails
+to apply stays pending and is retried with exponential backoff, and is only
+marked failed after WEBHOOK_MAX_ATTEMPTS; admins can requeue failed events.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from config import Config
+from core.dependency_injection import DIContainer
+from models import PaymentWebhookEvent
+from services.payment_events import PaymentStatusBroker
+from services.payment_service import PaymentService
+
+logger = logging.getLogger("payment_webhooks")
+
+
+class PaymentWebhookInbox:
+    """Service for storing verified webhooks and inspecting the inbox."""
+
+    @staticmethod
+    def receive(db: Session, webhook_data: dict) -> bool:
+        """
+        Verify a webhook and store it for the worker.
+
+        Args:
+            db: Database session
+            webhook_data: Webhook body as sent by PayOS
+
+        Returns:
+            True if the event is new, False if it was already received
+
+        Raises:
+            ValueError: If the signature or payload is invalid
+        """
+        verified = PaymentService.verify_webhook(webhook_data)
+        payload = verified.to_json()
+        payment_link_id = payload.get("paymentLinkId")
+        code = payload.get("code")
+
+        dialect = db.get_bind().dialect.name
+        insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+        now = datetime.utcnow().isoformat()
+        # The unique event key turns PayOS retries into no-ops without a prior lookup
+        statement = insert(PaymentWebhookEvent).values(
+            event_key=f"{payment_link_id}:{code}",
+            payment_link_id=payment_link_id,
+            code=code,
+            payload=json.dumps(payload),
+            status="pending",
+            attempts=0,
+            next_attempt_at=now,
+            received_at=now
+        ).on_conflict_do_nothing(index_elements=[PaymentWebhookEvent.event_key])
+        inserted = db.execute(statement).rowcount
+        db.commit()
+
+        if inserted:
+            DIContainer.get_instance(PaymentWebhookWorker).notify()
+        else:
+            logger.info(f"Duplicate webhook for payment link {payment_link_id} ignored")
+        return bool(inserted)
+
+    @staticmethod
+    def get_statistics(db: Session) -> Dict[str, Any]:
+        """
+        Get inbox counts per status and this process's processing figures.
+
+        Returns:
+            Counts of pending, applied, ignored and failed events plus worker figures
+        """
+        counts = dict(
+            db.query(PaymentWebhookEvent.status, func.count(PaymentWebhookEvent.id))
+            .group_by(PaymentWebhookEvent.status)
+            .all()
+        )
+        oldest_pending = db.query(func.min(PaymentWebhookEvent.received_at))\
+            .filter(PaymentWebhookEvent.status == "pending")\
+            .scalar()
+        return {
+            "pending": counts.get("pending", 0),
+            "applied": counts.get("applied", 0),
+            "ignored": counts.get("ignored", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_pending_at": oldest_pending,
+            "worker": DIContainer.get_instance(PaymentWebhookWorker).status()
+        }
+
+    @staticmethod
+    def requeue_failed(db: Session) -> int:
+        """
+        Give failed events a fresh set of attempts, e.g. once the cause of the failures is fixed.
+
+        Returns:
+            Number of events requeued
+        """
+        requeued = db.query(PaymentWebhookEvent)\
+            .filter(PaymentWebhookEvent.status == "failed")\
+            .update({
+                PaymentWebhookEvent.status: "pending",
+                PaymentWebhookEvent.attempts: 0,
+                PaymentWebhookEvent.next_attempt_at: datetime.utcnow().isoformat(),
+            }, synchronize_session=False)
+        db.commit()
+        if requeued:
+            logger.info(f"Requeued {requeued} failed webhook events")
+            DIContainer.get_instance(PaymentWebhookWorker).notify()
+        return requeued
+
+
+class PaymentWebhookWorker:
+    """Applies stored webhook events in batches, one transaction per batch."""
+
+    def __init__(self, session_factory: Optional[Callable] = None):
+        """
+        Args:
+            session_factory: Callable returning a new database session (default: SessionLocal)
+        """
+        if session_factory is None:
+            from database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Processing figures for this process
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self._latency_total = 0.0
+
+    def status(self) -> Dict[str, Any]:
+        """Events processed, retries scheduled and mean receipt-to-apply latency since the worker started"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "mean_latency_ms": self._latency_total / self.processed * 1000 if self.processed else 0.0,
+        }
+
+    def start(self) -> None:
+        """Start processing on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Payment webhook worker started")
+
+    def notify(self) -> None:
+        """Wake the worker now instead of at its next poll; safe to call from any thread"""
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def close(self) -> None:
+        """Stop the worker; unprocessed events stay pending for the next start"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                processed = await asyncio.to_thread(self.process_batch)
+            except Exception as e:
+                logger.exception(f"Error processing payment webhooks: {str(e)}")
+                processed = 0
+            # A full batch means more events may be waiting
+            if processed >= Config.PAYMENT.WEBHOOK_BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), Config.PAYMENT.WEBHOOK_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def process_batch(self) -> int:
+        """
+        Apply one batch of due pending events and commit them together.
+        Each event runs in a savepoint so a failing event is rescheduled, or marked
+        failed once out of attempts, without undoing the rest of the batch.
+
+        Returns:
+            Number of events attempted
+        """
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            events: List[PaymentWebhookEvent] = db.query(PaymentWebhookEvent)\
+                .filter(
+                    PaymentWebhookEvent.status == "pending",
+                    or_(PaymentWebhookEvent.next_attempt_at.is_(None),
+                        PaymentWebhookEvent.next_attempt_at <= now.isoformat())
+                )\
+                .order_by(PaymentWebhookEvent.id)\
+                .limit(Config.PAYMENT.WEBHOOK_BATCH_SIZE)\
+                .with_for_update(skip_locked=True)\
+                .all()
+            if not events:
+                return 0
+
+            completed = []
+            for event in events:
+                try:
+                    with db.begin_nested():
+                        event.status = PaymentService.apply_webhook(db, json.loads(event.payload))
+                except Exception as e:
+                    self._schedule_retry(event, e, now)
+                    if event.status == "pending":
+                        continue
+                event.processed_at = now.isoformat()
+                if event.status == "applied":
+                    completed.append(event.payment_link_id)
+                self.processed += 1
+                self._latency_total += (now - datetime.fromisoformat(event.received_at)).total_seconds()
+            db.commit()
+
+            broker = DIContainer.get_instance(PaymentStatusBroker)
+            for payment_link_id in completed:
+                broker.publish(payment_link_id, "completed")
+            return len(events)
+        finally:
+            db.close()
+
+    def _schedule_retry(self, event: PaymentWebhookEvent, error: Exception, now: datetime) -> None:
+        event.attempts = (event.attempts or 0) + 1
+        event.error = str(error)[:1000]
+        if event.attempts >= Config.PAYMENT.WEBHOOK_MAX_ATTEMPTS:
+            event.status = "failed"
+            self.failed += 1
+            logger.error(f"Giving up on webhook event {event.id} after {event.attempts} attempts: {error}")
+            return
+        event.status = "pending"
+        delay = Config.PAYMENT.WEBHOOK_RETRY_BASE_SECONDS * 2 ** (event.attempts - 1)
+        event.next_attempt_at = (now + timedelta(seconds=delay)).isoformat()
+        self.retried += 1
+        logger.warning(f"Failed to apply webhook event {event.id}, retrying in {delay:.0f}s: {error}")
@@ -0,0 +1,230 @@
+"""
+Local near-duplicate index over historical prompts using MinHash and LSH.
+"""
+import hashlib
+import random
+import re
+import threading
+import logging
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from models import CodeGeneration
+
+logger = logging.getLogger("prompt_similarity")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_language(language: Optional[str]) -> str:
+    """Match DirectAPICodeGenerator's default of C++ when no language is given"""
+    return (language or "C++").strip().lower()
+
+
+class PromptSimilarityIndex:
+    """
+    MinHash signatures over word shingles, bucketed by LSH bands.
+    Prompts are only compared with others for the same (language, model) key,
+    and only with the asking user's own prompts unless sharing across users is on.
+
+    Signatures live in one flat array and bucket values are plain ints until a
+    bucket collides, which keeps a million-prompt index under a gigabyte.
+    """
+
+    def __init__(self, num_perm: Optional[int] = None, bands: Optional[int] = None,
+                 shingle_size: Optional[int] = None):
+        """
+        Args:
+            num_perm: Number of MinHash permutations (default from Config)
+            bands: Number of LSH bands; must divide num_perm (default from Config)
+            shingle_size: Words per shingle (default from Config)
+        """
+        self.num_perm = num_perm or Config.PROMPT_REUSE.NUM_PERM
+        self.bands = bands or Config.PROMPT_REUSE.BANDS
+        self.shingle_size = shingle_size or Config.PROMPT_REUSE.SHINGLE_SIZE
+        if self.num_perm % self.bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.rows = self.num_perm // self.bands
+
+        # Admin-tunable reuse settings
+        self.enabled = Config.PROMPT_REUSE.ENABLED
+        self.threshold = Config.PROMPT_REUSE.THRESHOLD
+        self.credit_ratio = Config.PROMPT_REUSE.CREDIT_RATIO
+        self.share_across_users = Config.PROMPT_REUSE.SHARE_ACROSS_USERS
+
+        rng = random.Random(1)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(self.num_perm)
+        ]
+        self._lock = threading.Lock()
+        self._key_ids: Dict[Tuple[str, str], int] = {}
+        self._ids = array("q")
+        self._users = array("q")  # Owner of each slot, -1 if unknown
+        self._signatures = array("I")
+        self._buckets: Dict[int, object] = {}
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def status(self) -> Dict[str, object]:
+        """Current reuse settings and index state"""
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "credit_ratio": self.credit_ratio,
+            "share_across_users": self.share_across_users,
+            "ready": self.ready,
+            "indexed_prompts": len(self),
+        }
+
+    def update_settings(self, enabled: bool, threshold: float, credit_ratio: float,
+                        share_across_users: bool = False) -> None:
+        """Change the reuse settings at runtime"""
+        self.enabled = enabled
+        self.threshold = threshold
+        self.credit_ratio = credit_ratio
+        self.share_across_users = share_across_users
+        logger.info(f"Prompt reuse settings updated: enabled={enabled}, threshold={threshold}, "
+                    f"credit_ratio={credit_ratio}, share_across_users={share_across_users}")
+
+    def _shingles(self, prompt: str) -> set:
+        tokens = re.findall(r"\w+", prompt.lower())
+        if len(tokens) <= self.shingle_size:
+            return {" ".join(tokens)} if tokens else set()
+        return {
+            " ".join(tokens[i:i + self.shingle_size])
+            for i in range(len(tokens) - self.shingle_size + 1)
+        }
+
+    def signature(self, prompt: str) -> Optional[List[int]]:
+        """Compute the MinHash signature of a prompt, or None if it has no words"""
+        shingles = self._shingles(prompt)
+        if not shingles:
+            return None
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+            for shingle in shingles
+        ]
+        return [
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH
+            for a, b in self._perms
+        ]
+
+    def _band_keys(self, key_id: int, signature: List[int]) -> List[int]:
+        return [
+            hash((key_id, band, tuple(signature[band * self.rows:(band + 1) * self.rows])))
+            for band in range(self.bands)
+        ]
+
+    def _key_id(self, language: Optional[str], model_name: str, create: bool) -> Optional[int]:
+        key = (normalize_language(language), model_name)
+        key_id = self._key_ids.get(key)
+        if key_id is None and create:
+            key_id = self._key_ids[key] = len(self._key_ids)
+        return key_id
+
+    def add(self, code_gen_id: int, prompt: str, language: Optional[str], model_name: str,
+            user_id: Optional[int]) -> None:
+        """Index a stored generation of user_id's"""
+        signature = self.signature(prompt)
+        if signature is None:
+            return
+        with self._lock:
+            key_id = self._key_id(language, model_name, create=True)
+            slot = len(self._ids)
+            self._ids.append(code_gen_id)
+            self._users.append(-1 if user_id is None else user_id)
+            self._signatures.extend(signature)
+            for band_key in self._band_keys(key_id, signature):
+                existing = self._buckets.get(band_key)
+                if existing is None:
+                    self._buckets[band_key] = slot
+                elif isinstance(existing, list):
+                    existing.append(slot)
+                else:
+                    self._buckets[band_key] = [existing, slot]
+
+    def query(self, prompt: str, language: Optional[str], model_name: str,
+              threshold: Optional[float] = None, user_id: Optional[int] = None) -> Optional[Tuple[int, float]]:
+        """
+        Find the most similar stored prompt for the same language and model.
+
+        Args:
+            prompt: Prompt to look up
+            language: Requested programming language
+            model_name: Requested model
+            threshold: Minimum estimated Jaccard similarity (default: self.threshold)
+            user_id: Only match this user's prompts (default: match anyone's)
+
+        Returns:
+            Tuple of (code generation id, estimated similarity), or None if nothing is similar enough
+        """
+        if threshold is None:
+            threshold = self.threshold
+        signature = self.signature(prompt)
+        if signature is None:
+            return None
+
+        with self._lock:
+            key_id = self._key_id(language, model_name, create=False)
+            if key_id is None:
+                return None
+            candidates = set()
+            for band_key in self._band_keys(key_id, signature):
+                bucket = self._buckets.get(band_key)
+                if bucket is None:
+                    continue
+                if isinstance(bucket, list):
+                    candidates.update(bucket)
+                else:
+                    candidates.add(bucket)
+
+            best = None
+            for slot in candidates:
+                if user_id is not None and self._users[slot] != user_id:
+                    continue
+                stored = self._signatures[slot * self.num_perm:(slot + 1) * self.num_perm]
+                similarity = sum(1 for x, y in zip(signature, stored) if x == y) / self.num_perm
+                # Prefer the most recent generation on ties
+                if similarity >= threshold and (best is None or (similarity, slot) > best):
+                    best = (similarity, slot)
+
+            if best is None:
+                return None
+            return self._ids[best[1]], best[0]
+
+    def build(self, session_factory: Callable, batch_size: int = 1000) -> None:
+        """
+        Index every stored generation, oldest first, except those that reused another's code.
+
+        Args:
+            session_factory: Callable returning a new database session
+            batch_size: Rows fetched per round-trip
+        """
+        db = session_factory()
+        try:
+            rows = db.query(
+                CodeGeneration.id, CodeGeneration.prompt, CodeGeneration.language, CodeGeneration.model_name,
+                CodeGeneration.user_id
+            ).filter(CodeGeneration.generated_code.isnot(None), CodeGeneration.reused_from.is_(None))\
+                .order_by(CodeGeneration.id)\
+                .yield_per(batch_size)
+            for code_gen_id, prompt, language, model_name, user_id in rows:
+                self.add(code_gen_id, prompt or "", language, model_name, user_id)
+            self.ready = True
+            logger.info(f"Prompt similarity index built with {len(self)} prompts")
+        except Exception as e:
+            logger.exception(f"Error building prompt similarity index: {str(e)}")
+        finally:
+            db.close()
+
+    def build_in_background(self, session_factory: Callable) -> threading.Thread:
+        """Build the index on a daemon thread; lookups return nothing until it's ready"""
+        thread = threading.Thread(target=self.build, args=(session_factory,), daemon=True,
+                                  name="prompt-similarity-build")
+        thread.start()
+        return thread
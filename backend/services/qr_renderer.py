@@ -0,0 +1,177 @@
+"""
+QR code rendering for payment checkout links.
+
+Rendering is CPU-bound pure Python and PIL work, so it runs in a process pool
+rather than in the request thread, where it would hold the GIL against every
+other request in the worker. Results are cached by checkout URL.
+"""
+import base64
+import logging
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger("qr_renderer")
+
+QR_MEDIA_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+
+def render_qr(data: str, image_format: str, box_size: int) -> str:
+    """
+    Render a QR code and return it base64 encoded.
+    Module-level so it can be pickled into pool processes.
+    """
+    import qrcode
+
+    image_factory = None
+    if image_format == "svg":
+        import qrcode.image.svg
+        image_factory = qrcode.image.svg.SvgPathImage
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=4,
+        image_factory=image_factory,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    if image_format == "svg":
+        img = qr.make_image()
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+    buffered = BytesIO()
+    img.save(buffered)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+class QRRenderer:
+    """Renders QR codes in a process pool behind an LRU cache."""
+
+    def __init__(self, max_workers: Optional[int] = None, cache_size: Optional[int] = None):
+        """
+        Args:
+            max_workers: Pool processes; 0 renders inline (default from Config)
+            cache_size: Rendered codes kept in memory (default from Config)
+        """
+        self.max_workers = Config.PAYMENT.QR_WORKERS if max_workers is None else max_workers
+        self.cache_size = Config.PAYMENT.QR_CACHE_SIZE if cache_size is None else cache_size
+        self.image_format = Config.PAYMENT.QR_IMAGE_FORMAT
+        self.box_size = Config.PAYMENT.QR_BOX_SIZE
+        self._cache: "OrderedDict[Tuple[str, str, int], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def media_type(self) -> str:
+        return QR_MEDIA_TYPES[self.image_format]
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.max_workers <= 0:
+            return None
+        with self._lock:
+            if self._pool is None:
+                # spawn, because forking a process that runs threads can copy held locks
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def submit(self, data: str) -> Future:
+        """
+        Start rendering the QR code for data without waiting for it.
+
+        Args:
+            data: Content to encode, usually the checkout URL
+
+        Returns:
+            Future of the base64 encoded PNG or SVG; already done if it was cached or rendered inline
+        """
+        key = (data, self.image_format, self.box_size)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        pool = self._get_pool()
+        if pool is not None:
+            try:
+                future = pool.submit(render_qr, data, self.image_format, self.box_size)
+                future.add_done_callback(lambda done: self._store(key, done, pool))
+                return future
+            except BrokenProcessPool:
+                self._reset_pool(pool)
+
+        future = Future()
+        future.set_result(render_qr(data, self.image_format, self.box_size))
+        self._store(key, future)
+        return future
+
+    def render(self, data: str) -> str:
+        """
+        Get the QR code for data as a base64 encoded image, rendering it if it isn't cached.
+
+        Args:
+            data: Content to encode, usually the checkout URL
+
+        Returns:
+            Base64 encoded PNG or SVG, per QR_IMAGE_FORMAT
+
+        Raises:
+            TimeoutError: If rendering took longer than QR_RENDER_TIMEOUT
+        """
+        try:
+            return self.submit(data).result(timeout=Config.PAYMENT.QR_RENDER_TIMEOUT)
+        except BrokenProcessPool:
+            return self.submit(data).result(timeout=Config.PAYMENT.QR_RENDER_TIMEOUT)
+
+    def _store(self, key: Tuple[str, str, int], future: Future, pool: Optional[ProcessPoolExecutor] = None) -> None:
+        """Cache a finished render; a broken pool is replaced on the next submit"""
+        if future.cancelled():
+            return
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._reset_pool(pool)
+        if error is not None:
+            return
+        with self._lock:
+            self._cache[key] = future.result()
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _reset_pool(self, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._pool is not pool:
+                return  # Already replaced
+            self._pool = None
+        logger.error("QR render pool broke, restarting it")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self) -> None:
+        """Start the pool processes ahead of the first payment"""
+        pool = self._get_pool()
+        if pool is not None:
+            pool.submit(render_qr, "warm-up", self.image_format, self.box_size)
+
+    def close(self) -> None:
+        """Shut the pool down"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -1,18 +1,16 @@
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from fastapi import HTTPException, status, Request, BackgroundTasks
+from fastapi import HTTPException, status, Request
 import random
 import string
 import ipaddress
 from jose import jwt
 from datetime import datetime, timedelta
-import smtplib
-from email.mime.text import MIMEText
 from config import Config
 from core.security import get_password_hash
-from email.mime.multipart import MIMEMultipart
 
-from models import User
+from models import PaymentTransaction, User
+from services.mail_outbox import MailOutbox
 
 RESET_PASSWORD_SECRET = Config.SECURITY.SECRET_KEY
 RESET_PASSWORD_EXPIRE_MINUTES = 30
@@ -43,6 +41,17 @@ class UserService:
         """Get a user by their referral code"""
         return db.query(User).filter(User.referral_code == referral_code).first()
     
+    @staticmethod
+    def get_tier(db: Session, user: User) -> str:
+        """Rate limit tier of a user: admin, paid (has completed a payment) or free"""
+        if user.is_admin:
+            return "admin"
+        paid = db.query(PaymentTransaction.id).filter(
+            PaymentTransaction.user_id == user.id,
+            PaymentTransaction.status == "completed"
+        ).first()
+        return "paid" if paid else "free"
+    
     @staticmethod
     def generate_unique_referral_code(db: Session, length: int = 8) -> str:
         """Generate a unique referral code"""
@@ -173,7 +182,7 @@ class UserService:
         return db_user
     
     @staticmethod
-    def forgot_password(db: Session, email: str, background_tasks: BackgroundTasks):
+    def forgot_password(db: Session, email: str):
         """Handle forgot password request"""
 
         user = UserService.get_user_by_email(db, email)
@@ -186,8 +195,8 @@ class UserService:
         token = jwt.encode(payload, RESET_PASSWORD_SECRET, algorithm="HS256")
         # Tạo link reset password
         reset_link = f"{FRONTEND_BASE_URL}reset-password?token={token}"
-        # Gửi email trong background
-        background_tasks.add_task(UserService.send_reset_email, user.email, reset_link)
+        # Đưa email vào outbox để worker gửi
+        UserService.send_reset_email(db, user.email, reset_link)
 
     @staticmethod
     def reset_password(db: Session, token: str, new_password: str):
@@ -206,12 +215,8 @@ class UserService:
         db.refresh(user)
 
     @staticmethod
-    def send_reset_email(email: str, reset_link: str):
-        print("sending")
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = "🔒 Đặt lại mật khẩu CodaWaka"
-        msg['From'] = Config.EMAIL.FROM_ADDRESS
-        msg['To'] = email
+    def send_reset_email(db: Session, email: str, reset_link: str):
+        subject = "🔒 Đặt lại mật khẩu CodaWaka"
 
         # Plain text fallback
         text = f"""
@@ -288,18 +293,5 @@ class UserService:
     </html>
     """
 
-        msg.attach(MIMEText(text, 'plain'))
-        msg.attach(MIMEText(html, 'html'))
-
-        try:
-            with smtplib.SMTP(Config.EMAIL.SMTP_SERVER, Config.EMAIL.SMTP_PORT) as server:
-                server.ehlo()
-                server.starttls()
-                server.ehlo()
-                server.login(Config.EMAIL.SMTP_USER, Config.EMAIL.SMTP_PASSWORD)
-                server.sendmail(Config.EMAIL.FROM_ADDRESS, [email], msg.as_string())
-                print(f"✅ Đã gửi email đặt lại mật khẩu đến {email}")
-        except smtplib.SMTPAuthenticationError as e:
-            print(f"❌ Lỗi xác thực SMTP: {e.smtp_error.decode()}")
-        except Exception as e:
-            print(f"❌ Lỗi gửi email: {e}")
+        # Gửi qua outbox; worker sẽ gửi lại nếu SMTP lỗi
+        MailOutbox.enqueue(db, email, subject, text, html)
@@ -0,0 +1,94 @@
+"""
+Shared fixtures for the backend tests.
+
+The application reads its configuration at import, so a scratch SQLite
+database and test settings are put in the environment before main is
+imported. The AI providers and PayOS are never called: generation is replaced
+by a function returning a fixed program.
+"""
+import itertools
+import os
+import shutil
+import tempfile
+
+import pytest
+
+_workdir = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(_workdir, 'app.db')}",
+    DATABASE_REPLICA_URLS="",
+    ARCHIVE_DIR=os.path.join(_workdir, "archive"),
+    HISTORY_SPILL_DIR=os.path.join(_workdir, "spill"),
+    QUERY_STATS_HEADERS="true",
+    RATE_LIMIT_ENABLED="false",
+    QR_WORKERS="0",
+)
+for _name in ("SECRET_KEY", "GOOGLE_API_KEYS", "PAYOS_CLIENT_ID", "PAYOS_API_KEY", "PAYOS_CHECKSUM_KEY"):
+    os.environ.setdefault(_name, "backend-tests")
+
+import main as app_main  # noqa: E402
+from core.security import create_access_token, get_password_hash  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from models import ModelPricing, PaymentTransaction, User  # noqa: E402
+from repositories.code_repository import CodeGenerationRepository  # noqa: E402
+from services.code_generation_service import DirectAPICodeGenerator  # noqa: E402
+
+# History records and payments seeded per user, so a query per row shows up in the counts
+HISTORY_ROWS = 20
+
+_user_numbers = itertools.count()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient running the application's startup and shutdown"""
+    from fastapi.testclient import TestClient
+
+    def generate_code(model_name, prompt, language=None, deadline=None):
+        return f"// {prompt}\nint main() {{ return 0; }}"
+
+    DirectAPICodeGenerator.generate_code = staticmethod(generate_code)
+    db = SessionLocal()
+    try:
+        db.add(ModelPricing(model_name="gemini-2.0-flash", credit_cost_per_request=1))
+        db.add(User(username="admin", email="admin@example.com", hashed_password=get_password_hash("password"),
+                    is_admin=True, credits=100, referral_code="ADMIN"))
+        db.commit()
+    finally:
+        db.close()
+    with TestClient(app_main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    return {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+
+
+@pytest.fixture
+def make_user(client):
+    """Create a user with HISTORY_ROWS history records and payments; returns the user's id and auth headers"""
+    def make(credits: float = 100):
+        name = f"user-{next(_user_numbers)}"
+        db = SessionLocal()
+        try:
+            user = User(username=name, email=f"{name}@example.com", credits=credits, referral_code=name.upper())
+            db.add(user)
+            db.commit()
+            repository = CodeGenerationRepository(db)
+            for i in range(HISTORY_ROWS):
+                repository.create_generation(user.id, "gemini-2.0-flash", f"Problem {i}: sum of an array",
+                                             f"int main() {{ return {i % 5}; }}", 1.0, "cpp")
+                db.add(PaymentTransaction(user_id=user.id, amount=1000, credits=1, transaction_id=f"{name}-{i}",
+                                          status="completed", created_at="2026-01-01T00:00:00",
+                                          updated_at="2026-01-01T00:00:00"))
+            db.commit()
+            return user.id, {"Authorization": f"Bearer {create_access_token({'sub': name})}"}
+        finally:
+            db.close()
+
+    return make
@@ -0,0 +1,57 @@
+"""
+Query budgets for the endpoints that have gained hidden queries before.
+
+Each budget is the number of queries the endpoint runs today, independent of
+how much history the user has, so an extra lookup or a lazy load per row fails
+here rather than in production.
+"""
+from core.query_stats import assert_max_queries, assert_response_max_queries
+from core.security import get_user
+from database import SessionLocal
+
+# Authentication, the user read for the credit check, pricing, the paid-tier lookup,
+# the credit update and the history insert
+GENERATE_CODE_BUDGET = 12
+# The user lookup in get_current_user
+CURRENT_USER_BUDGET = 1
+# Authentication, the user, its history and payments, detaching them and the delete
+DELETE_USER_BUDGET = 7
+
+
+def test_get_current_user_runs_one_query(client, make_user):
+    user_id, headers = make_user()
+    response = client.get("/users/me", headers=headers)
+    assert response.status_code == 200
+    assert_response_max_queries(response, CURRENT_USER_BUDGET)
+
+
+def test_get_user_runs_one_query(client, make_user):
+    user_id, headers = make_user()
+    db = SessionLocal()
+    try:
+        username = client.get("/users/me", headers=headers).json()["username"]
+        with assert_max_queries(CURRENT_USER_BUDGET):
+            assert get_user(db, username=username).id == user_id
+    finally:
+        db.close()
+
+
+def test_generate_code_stays_within_budget(client, make_user):
+    user_id, headers = make_user()
+    for i in range(2):
+        response = client.post("/code/generate-code", headers=headers, json={
+            "model_name": "gemini-2.0-flash",
+            "prompt": f"Budget check {user_id}-{i}: print the sum of two integers",
+            "language": "cpp",
+            "allow_reuse": False,
+        })
+        assert response.status_code == 200, response.text
+        assert_response_max_queries(response, GENERATE_CODE_BUDGET)
+
+
+def test_delete_user_stays_within_budget(client, admin_headers, make_user):
+    user_id, headers = make_user()
+    response = client.delete(f"/admin/users/{user_id}", headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert_response_max_queries(response, DELETE_USER_BUDGET)
+    assert client.get("/users/me", headers=headers).status_code == 401